@@ -0,0 +1,130 @@
+"""
+Batch mode: updates many dashboards in one run, each described by its own config file in the same format as
+config.json, instead of one cron job per display that each starts Python, the Google client and Chrome from scratch.
+
+Calendars are fetched once per time zone, however many dashboards show them, and the dashboards are then rendered on
+a pool of worker processes, one per CPU core by default. Each worker keeps one headless browser (or the Pillow
+renderer and its font cache) for all the dashboards it renders. Every dashboard is identified by the "name" in its
+config, or else by the config file name, which keeps its page, screenshot and render cache apart from the others.
+
+    python3 main.py --batch dashboards/
+    python3 main.py --batch kitchen.json office.json --workers 2
+"""
+
+from concurrent.futures import as_completed
+import glob
+import json
+import logging
+import os
+import time
+from options import display_window, gcal_options, render_options
+from render.pool import create_pool, render_dashboard
+from tracing import tracer
+
+
+def load_dashboards(paths):
+    # Returns (name, config) for every config file given directly or found in a given directory
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files += sorted(glob.glob(os.path.join(path, '*.json')))
+        else:
+            files.append(path)
+
+    dashboards = []
+    names = set()
+    for file in files:
+        with open(file, 'r') as f:
+            config = json.load(f)
+        name = config.get('name', os.path.splitext(os.path.basename(file))[0])  # Identifies the dashboard
+        if name in names:
+            raise ValueError(f"Two dashboards are named '{name}', set a unique \"name\" in {file}")
+        names.add(name)
+        dashboards.append((name, config))
+    return dashboards
+
+
+class BatchRunner:
+
+    def __init__(self, dashboards, workers=None):
+        self.logger = logging.getLogger('maginkdash')
+        self.dashboards = dashboards
+        self.workers = max(1, min(workers or os.cpu_count() or 1, len(dashboards)))
+        self.executor = create_pool(self.workers)
+        # Spans go where the first dashboard that sets spansLog or prometheusTextfile says, labelled with the name
+        # of the dashboard they were rendered for
+        for name, config in dashboards:
+            if config.get('spansLog') or config.get('prometheusTextfile'):
+                tracer.configure(config.get('spansLog'), config.get('prometheusTextfile'), dashboard='batch')
+                break
+
+        # One calendar client for all dashboards, with the most generous fetch settings any of them asks for
+        from gcal.gcal import GcalModule
+        options = [gcal_options(config) for name, config in dashboards]
+        self.calModule = GcalModule(eventStore=any(o['eventStore'] for o in options),
+                                    fetchWorkers=max(o['fetchWorkers'] for o in options),
+                                    fetchTimeout=max(o['fetchTimeout'] for o in options),
+                                    eventCache=next((o['eventCache'] for o in options if o['eventCache']), None))
+
+    def fetch(self):
+        # Returns name -> (currDate, days, staleSince) for every dashboard. Calendars are fetched once per time
+        # zone.
+        calHelper = self.calModule.calHelper
+        groups = {}
+        for name, config in self.dashboards:
+            groups.setdefault(config['displayTZ'], []).append((name, config))
+
+        events = {}
+        requested = fetched = 0
+        for displayTZName, group in groups.items():
+            displayTZ, currDate, calStartDatetime, calEndDatetime = display_window(group[0][1])
+            calendars = list(dict.fromkeys(cal for name, config in group for cal in config['calendars']))
+            requested += sum(len(config['calendars']) for name, config in group)
+            fetched += len(calendars)
+            items = calHelper.fetch_items(calendars, calStartDatetime, calEndDatetime, displayTZ)
+            staleSince = self.calModule.stale_since(displayTZ)
+            for name, config in group:
+                raw = [item for cal in config['calendars'] for item in items.get(cal, [])]
+                eventList = calHelper.parse_items(raw, displayTZ, config.get('ignorePatterns', []))
+                days = self.calModule.split_days(eventList, currDate, displayTZ, 3)
+                # Plain lists, as the days are sent to another process
+                events[name] = (currDate, [list(day) for day in days], staleSince)
+        self.logger.info(f"Fetched {fetched} calendars for {requested} calendar views in {len(groups)} time zones")
+        return events
+
+    def run(self):
+        start = time.perf_counter()
+        events = self.fetch()
+        fetchTime = time.perf_counter() - start
+
+        futures = {}
+        for name, config in self.dashboards:
+            currDate, days, staleSince = events[name]
+            future = self.executor.submit(render_dashboard, name, render_options(config), currDate, days,
+                                          config['path_to_server_image'], staleSince)
+            futures[future] = name
+
+        results = []
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                name, rendered, renderTime, spans = future.result()
+                tracer.extend(spans)
+                latency = time.perf_counter() - start
+                results.append((name, rendered, renderTime, latency))
+                self.logger.info(f"Dashboard {name}: {'rendered' if rendered else 'unchanged'} in {renderTime:.2f}s, "
+                                 f"done {latency:.2f}s after the batch started")
+            except Exception as e:
+                self.logger.exception(f"Dashboard {name} failed: {str(e)}")
+
+        total = time.perf_counter() - start
+        latencies = sorted(result[3] for result in results)
+        if latencies:
+            self.logger.info(f"Updated {len(results)} of {len(self.dashboards)} dashboards in {total:.2f}s on "
+                             f"{self.workers} workers ({len(results) / total:.2f} dashboards/s, "
+                             f"fetch {fetchTime:.2f}s, latency median {latencies[len(latencies) // 2]:.2f}s, "
+                             f"max {latencies[-1]:.2f}s)")
+        return results
+
+    def close(self):
+        self.executor.shutdown()
@@ -0,0 +1,185 @@
+"""
+End-to-end benchmark that needs no Google account. It starts the fake Calendar API from gcal/fakeapi.py with synthetic
+calendars, points GcalHelper at it and times every stage of an update, as many times as asked:
+
+    fetch     fetching the raw items of all calendars, following every page
+    parse     turning items into events (to_datetime, adjust_end_time)
+    sort      sorting the events by start
+    bucket    dropping past events and splitting them into days (split_days)
+    html      building the days and the dashboard HTML in process_inputs
+    inline    inlining the CSS and font subsets (browser backend only)
+    capture   the screenshot, or drawing with Pillow
+    publish   grayscale conversion and writing the published files
+
+The results are written as JSON, with the parameters, the environment and the minimum, median and maximum of each
+stage. Given the JSON of an earlier run, the medians are compared and the exit status is 1 if a stage got slower than
+the tolerance allows, so it can guard against regressions:
+
+    python3 benchmark.py --calendars 5 --events 400 --backend pillow --output before.json
+    python3 benchmark.py --calendars 5 --events 400 --backend pillow --output after.json --compare before.json
+"""
+
+import argparse
+import datetime
+import json
+import logging
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime as dt
+from pytz import timezone
+
+STAGES = ['fetch', 'parse', 'sort', 'bucket', 'html', 'inline', 'capture', 'publish']
+
+
+def run_once(calModule, renderService, calendars, currDate, calStart, calEnd, displayTZ, imagePath):
+    # One update, timed stage by stage as GcalHelper.retrieve_events, GcalModule.split_days and
+    # RenderHelper.process_inputs do it
+    calHelper = calModule.calHelper
+    timings = {}
+    start = time.perf_counter()
+    items = calHelper.fetch_items(calendars, calStart, calEnd, displayTZ)
+    timings['fetch'] = time.perf_counter() - start
+
+    raw = [item for cal in calendars for item in items.get(cal, [])]
+    start = time.perf_counter()
+    eventList = [calHelper.parse_event(item, displayTZ) for item in raw]
+    timings['parse'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    eventList = sorted(eventList, key=lambda k: k['startDatetime'])
+    timings['sort'] = time.perf_counter() - start
+
+    # Seen from the start of the window, so no event is dropped as past and every run shows the same days
+    start = time.perf_counter()
+    days = calModule.split_days(eventList, currDate, displayTZ, 3, now=calStart)
+    timings['bucket'] = time.perf_counter() - start
+
+    renderService.process_inputs(currDate, list(days), imagePath)
+    timings.update(renderService.timings)
+    counts = {'items': len(raw), 'events': len(eventList), 'shown': sum(len(day) for day in days[:3])}
+    return timings, counts
+
+
+def summarize(runs):
+    stages = {}
+    for stage in STAGES:
+        values = [run[stage] for run in runs if stage in run]
+        if values:
+            stages[stage] = {'min': min(values), 'median': statistics.median(values), 'max': max(values),
+                             'runs': values}
+    return stages
+
+
+def compare(stages, previous, tolerance):
+    # Print the change of every stage median against an earlier result. Returns the stages that got slower by more
+    # than the tolerance, ignoring differences under a millisecond.
+    regressions = []
+    print(f"\n{'stage':<10} {'before ms':>10} {'after ms':>10} {'change':>8}")
+    for stage, result in stages.items():
+        before = previous['stages'].get(stage)
+        if before is None:
+            continue
+        change = result['median'] / before['median'] - 1 if before['median'] else 0
+        slower = change > tolerance and result['median'] - before['median'] > 0.001
+        if slower:
+            regressions.append(stage)
+        print(f"{stage:<10} {1000 * before['median']:>10.2f} {1000 * result['median']:>10.2f} "
+              f"{100 * change:>+7.1f}%{'  slower' if slower else ''}")
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark a dashboard update against a fake Calendar API.')
+    parser.add_argument('--calendars', type=int, default=3, help='number of calendars (default 3)')
+    parser.add_argument('--events', type=int, default=100, help='events per calendar (default 100)')
+    parser.add_argument('--multiday', type=float, default=0.1,
+                        help='share of events spanning several days (default 0.1)')
+    parser.add_argument('--allday', type=float, default=0.1, help='share of all-day events (default 0.1)')
+    parser.add_argument('--recurring', type=float, default=0.2,
+                        help='share of events that are instances of recurring series (default 0.2)')
+    parser.add_argument('--page-size', type=int, default=250,
+                        help='items per page returned by the fake API (default 250, like the real one)')
+    parser.add_argument('--repeat', type=int, default=5, help='number of timed updates (default 5)')
+    parser.add_argument('--backend', default='pillow', choices=['pillow', 'browser'],
+                        help="render backend (default 'pillow', which needs no browser)")
+    parser.add_argument('--width', type=int, default=1200, help='image width (default 1200)')
+    parser.add_argument('--height', type=int, default=825, help='image height (default 825)')
+    parser.add_argument('--tz', default='UTC', help="display time zone (default 'UTC')")
+    parser.add_argument('--output', default='benchmark.json', help="JSON results file (default 'benchmark.json')")
+    parser.add_argument('--compare', metavar='JSON', help='results of an earlier run to compare the medians with')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='slowdown of a stage median counted as a regression (default 0.2, i.e. 20%%)')
+    parser.add_argument('--verbose', action='store_true', help="show the dashboard's own log messages")
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s %(levelname)s - %(message)s')
+    logger = logging.getLogger('maginkdash')
+    logger.setLevel(logging.INFO if args.verbose else logging.WARNING)
+
+    from google.auth.credentials import AnonymousCredentials
+    from gcal.fakeapi import FakeCalendarAPI
+    from gcal.gcal import GcalModule
+    from render.render import RenderHelper
+
+    displayTZ = timezone(args.tz)
+    currDate = dt.now(displayTZ).date()
+    calStart = displayTZ.localize(dt.combine(currDate, dt.min.time()))
+    calEnd = displayTZ.localize(dt.combine(currDate + datetime.timedelta(days=2), dt.max.time()))
+
+    api = FakeCalendarAPI(calendars=args.calendars, events=args.events, startDate=currDate, multiday=args.multiday,
+                          allday=args.allday, recurring=args.recurring, pageSize=args.page_size)
+    api.start()
+    outputDir = tempfile.mkdtemp(prefix='maginkdash-benchmark-')
+    renderService = None
+    try:
+        calModule = GcalModule(credentials=AnonymousCredentials(), apiEndpoint=api.endpoint)
+        # No render cache, every run renders in full
+        renderService = RenderHelper(args.width, args.height, keepBrowser=True, useCache=False,
+                                     backend=args.backend, name='benchmark')
+        runs = []
+        for i in range(args.repeat):
+            requestsBefore, bytesBefore = api.requests, api.bytesSent
+            timings, counts = run_once(calModule, renderService, api.calendarIds, currDate, calStart, calEnd,
+                                       displayTZ, os.path.join(outputDir, 'maginkdash.png'))
+            counts.update(requests=api.requests - requestsBefore, bytes=api.bytesSent - bytesBefore)
+            runs.append(timings)
+            print(f"run {i + 1}: " + ', '.join(f"{stage} {1000 * timings[stage]:.1f} ms"
+                                               for stage in STAGES if stage in timings))
+    finally:
+        if renderService is not None:
+            renderService.close()
+        api.stop()
+        shutil.rmtree(outputDir, ignore_errors=True)
+
+    results = {
+        'parameters': {'calendars': args.calendars, 'events': args.events, 'multiday': args.multiday,
+                       'allday': args.allday, 'recurring': args.recurring, 'pageSize': args.page_size,
+                       'repeat': args.repeat, 'backend': args.backend, 'width': args.width, 'height': args.height,
+                       'tz': args.tz},
+        'environment': {'python': platform.python_version(), 'platform': platform.platform(),
+                        'machine': platform.machine(), 'cpus': os.cpu_count()},
+        'time': dt.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'counts': counts,
+        'stages': summarize(runs),
+        'total': {'median': statistics.median(sum(run.values()) for run in runs)},
+    }
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"{counts['items']} items in {counts['requests']} requests ({counts['bytes'] // 1024} KB), "
+          f"{counts['shown']} events shown, median update {1000 * results['total']['median']:.1f} ms. "
+          f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            previous = json.load(f)
+        if previous['parameters'] != results['parameters']:
+            print(f"Warning: {args.compare} was run with different parameters")
+        regressions = compare(results['stages'], previous, args.tolerance)
+        if regressions:
+            print(f"Slower than {args.compare}: {', '.join(regressions)}")
+            sys.exit(1)
@@ -0,0 +1,89 @@
+"""
+Micro-benchmark for splitting events into days (dayindex.py). It times the day index against the previous approach,
+which copied every multi-day event into the list of each day it spans, for a range of event counts and horizons.
+Run it from the project folder, no Google account needed:
+
+    python3 -m gcal.benchmark_days
+    python3 -m gcal.benchmark_days --events 100 1000 10000 --days 3 7 31 --multiday 0.2
+"""
+
+import argparse
+import datetime
+import random
+import time
+from pytz import timezone
+from gcal.dayindex import DayIndex
+
+
+def synthetic_events(count, startDate, numDays, multidayRatio, displayTZ, seed=0):
+    # Events spread over the horizon and sorted by start, like GcalHelper.retrieve_events returns them
+    rng = random.Random(seed)
+    start = displayTZ.localize(datetime.datetime.combine(startDate, datetime.time()))
+    events = []
+    for i in range(count):
+        startDatetime = start + datetime.timedelta(minutes=rng.randrange(numDays * 24 * 60))
+        if rng.random() < multidayRatio:
+            endDatetime = startDatetime + datetime.timedelta(days=rng.randint(1, max(1, numDays // 2)))
+        else:
+            endDatetime = startDatetime + datetime.timedelta(minutes=rng.choice((30, 60, 90)))
+        events.append({'summary': f'Event {i}', 'allday': False, 'startDatetime': startDatetime,
+                       'endDatetime': endDatetime, 'updatedDatetime': startDatetime,
+                       'isMultiday': endDatetime.date() > startDatetime.date()})
+    events.sort(key=lambda e: e['startDatetime'])
+    return events
+
+
+def copy_per_day(events, startDate, numDays):
+    # The previous implementation, kept as the baseline
+    calList = [[] for _ in range(numDays)]
+    for event in events:
+        idx = (event['startDatetime'].date() - startDate).days
+        if event['isMultiday']:
+            end_idx = min((event['endDatetime'].date() - startDate).days, numDays - 1)
+            for i in range(max(idx, 0), end_idx + 1):
+                calList[i].append(event)
+        elif 0 <= idx < numDays:
+            calList[idx].append(event)
+    return calList
+
+
+def index_and_show(events, startDate, numDays, shownDays=3):
+    # Build the index and read the days the dashboard shows, which is when carried-over events are looked up
+    index = DayIndex(events, startDate, numDays)
+    for day in index.days[:shownDays]:
+        list(day)
+    return index
+
+
+def best_of(repeat, func, *args):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark splitting events into days.')
+    parser.add_argument('--events', type=int, nargs='+', default=[100, 1000, 10000],
+                        help='event counts to try (default 100 1000 10000)')
+    parser.add_argument('--days', type=int, nargs='+', default=[3, 7, 31],
+                        help='numbers of days to try (default 3 7 31)')
+    parser.add_argument('--multiday', type=float, default=0.1,
+                        help='share of events spanning several days (default 0.1)')
+    parser.add_argument('--repeat', type=int, default=5, help='runs per case, the best one is reported (default 5)')
+    args = parser.parse_args()
+
+    displayTZ = timezone('UTC')
+    startDate = datetime.date(2024, 3, 15)
+    print(f"{'events':>8} {'days':>5} {'copy ms':>10} {'index ms':>10} {'speedup':>8}")
+    for count in args.events:
+        for numDays in args.days:
+            events = synthetic_events(count, startDate, numDays, args.multiday, displayTZ)
+            copyTime, expected = best_of(args.repeat, copy_per_day, events, startDate, numDays)
+            indexTime, index = best_of(args.repeat, index_and_show, events, startDate, numDays)
+            # Both must give the same days, in the same order
+            assert [[id(e) for e in day] for day in expected] == [[id(e) for e in day] for day in index.days]
+            print(f"{count:>8} {numDays:>5} {1000 * copyTime:>10.2f} {1000 * indexTime:>10.2f} "
+                  f"{copyTime / indexTime:>7.1f}x")
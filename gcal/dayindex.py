@@ -0,0 +1,102 @@
+"""
+Splits a list of events into the days of the dashboard. The events are sorted once by the first day they appear on,
+so the events starting on a given day are one contiguous slice of that list, found with a binary search. Multi-day
+events that started on an earlier day are carried forward from day to day, up to the last day read, so each running
+event is checked once per day it spans. Each day is a read-only view into the sorted list rather than a copy, and
+only the days actually shown pay for the carried-over events.
+"""
+
+from bisect import bisect_left
+from collections.abc import Sequence
+from operator import le
+
+
+class DayView(Sequence):
+    # The events of one day: multi-day events carried over from earlier days, then the events starting that day
+
+    __slots__ = ('index', 'day', 'start', 'stop')
+
+    def __init__(self, index, day, start, stop):
+        self.index = index
+        self.day = day
+        self.start = start  # the events starting this day are index.events[start:stop]
+        self.stop = stop
+
+    @property
+    def carried(self):
+        # Positions of the multi-day events that started earlier and are still running
+        return self.index.carried(self.day)
+
+    def __len__(self):
+        return len(self.carried) + self.stop - self.start
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('day index out of range')
+        carried = self.carried
+        if i < len(carried):
+            return self.index.events[carried[i]]
+        return self.index.events[self.start + i - len(carried)]
+
+    def __iter__(self):
+        events = self.index.events
+        for i in self.carried:
+            yield events[i]
+        yield from events[self.start:self.stop]
+
+    def __repr__(self):
+        return f"DayView({list(self)!r})"
+
+
+class DayIndex:
+
+    def __init__(self, events, startDate, numDays):
+        self.startDate = startDate
+        self.numDays = numDays
+
+        # First day of every event relative to startDate
+        base = startDate.toordinal()
+        firstDays = [event['startDatetime'].toordinal() - base for event in events]
+
+        # The events usually arrive sorted by start already. Otherwise sort them stably, so they keep their
+        # start-time order within a day.
+        if not all(map(le, firstDays, firstDays[1:])):
+            order = sorted(range(len(events)), key=firstDays.__getitem__)
+            events = [events[i] for i in order]
+            firstDays = [firstDays[i] for i in order]
+        self.events = events
+        self.firstDays = firstDays
+
+        # Last day of the events running into a later day, by position, and those positions in order
+        self.lastDays = {i: events[i]['endDatetime'].toordinal() - base
+                         for i, event in enumerate(events) if event['isMultiday']}
+        self.multiday = [i for i, last in self.lastDays.items() if last > firstDays[i]]
+        multidayFirstDays = [firstDays[i] for i in self.multiday]
+        # The multi-day events starting on day d are multiday[multidayBounds[d]:multidayBounds[d + 1]]
+        self.multidayBounds = [bisect_left(multidayFirstDays, day) for day in range(numDays + 1)]
+        self.carriedDays = []  # carried-over positions of the days swept so far
+
+        bounds = [bisect_left(firstDays, day) for day in range(numDays + 1)]
+        self.days = [DayView(self, day, bounds[day], bounds[day + 1]) for day in range(numDays)]
+
+    def carried(self, day):
+        # Sweep forward from the last day done: the events carried into a day are those carried into the day before
+        # plus the ones starting that day, less the ones that have ended. Each day is worked out once.
+        lastDays = self.lastDays
+        while len(self.carriedDays) <= day:
+            current = len(self.carriedDays)
+            if current == 0:
+                running = self.multiday[:self.multidayBounds[0]]
+            else:
+                previous = current - 1
+                running = self.carriedDays[previous] + tuple(
+                    self.multiday[self.multidayBounds[previous]:self.multidayBounds[current]])
+            self.carriedDays.append(tuple(i for i in running if lastDays[i] >= current))
+        return self.carriedDays[day]
+
+    def day(self, day):
+        return self.days[day]
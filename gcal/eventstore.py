@@ -0,0 +1,81 @@
+"""
+Local copy of the calendar events, kept in SQLite so that each run only has to ask the Calendar API for what changed
+since the previous run (using the per-calendar sync token) instead of downloading every event in the window again.
+The events for the display window are then read back from the local index.
+"""
+
+import json
+import logging
+import sqlite3
+import threading
+
+
+class EventStore:
+
+    def __init__(self, dbPath):
+        self.logger = logging.getLogger('maginkdash')
+        # The connection is shared by the fetch threads, the lock serialises access to it
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(dbPath, check_same_thread=False)
+        with self.lock, self.conn:
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS events (
+                    calendar_id TEXT NOT NULL,
+                    event_id TEXT NOT NULL,
+                    start_ts REAL NOT NULL,
+                    end_ts REAL NOT NULL,
+                    data TEXT NOT NULL,
+                    PRIMARY KEY (calendar_id, event_id)
+                )''')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS events_window ON events (calendar_id, start_ts, end_ts)')
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS sync_state (
+                    calendar_id TEXT PRIMARY KEY,
+                    sync_token TEXT,
+                    synced_from REAL NOT NULL,
+                    synced_until REAL NOT NULL,
+                    timezone TEXT NOT NULL
+                )''')
+
+    def get_sync_state(self, calendarId):
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT sync_token, synced_from, synced_until, timezone FROM sync_state WHERE calendar_id = ?',
+                (calendarId,)).fetchone()
+        if row is None:
+            return None
+        return {'syncToken': row[0], 'syncedFrom': row[1], 'syncedUntil': row[2], 'timezone': row[3]}
+
+    def apply_changes(self, calendarId, changes, deletedIds, syncState, replace=False):
+        # changes is a list of (event_id, start_ts, end_ts, event) tuples. With replace, every stored event of the
+        # calendar is dropped first, as after a full sync.
+        with self.lock, self.conn:
+            if replace:
+                self.conn.execute('DELETE FROM events WHERE calendar_id = ?', (calendarId,))
+            self.conn.executemany(
+                'DELETE FROM events WHERE calendar_id = ? AND event_id = ?',
+                [(calendarId, eventId) for eventId in deletedIds])
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO events (calendar_id, event_id, start_ts, end_ts, data) VALUES (?, ?, ?, ?, ?)',
+                [(calendarId, eventId, startTs, endTs, json.dumps(event))
+                 for eventId, startTs, endTs, event in changes])
+            self.conn.execute(
+                'INSERT OR REPLACE INTO sync_state (calendar_id, sync_token, synced_from, synced_until, timezone) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (calendarId, syncState['syncToken'], syncState['syncedFrom'], syncState['syncedUntil'],
+                 syncState['timezone']))
+
+    def clear_calendar(self, calendarId):
+        with self.lock, self.conn:
+            self.conn.execute('DELETE FROM events WHERE calendar_id = ?', (calendarId,))
+            self.conn.execute('DELETE FROM sync_state WHERE calendar_id = ?', (calendarId,))
+
+    def query_window(self, calendars, startTs, endTs):
+        # Same semantics as the API's timeMin/timeMax: events ending after the start and starting before the end
+        placeholders = ','.join('?' * len(calendars))
+        with self.lock:
+            rows = self.conn.execute(
+                f'SELECT data FROM events WHERE calendar_id IN ({placeholders}) AND start_ts < ? AND end_ts > ? '
+                'ORDER BY start_ts',
+                (*calendars, endTs, startTs)).fetchall()
+        return [json.loads(row[0]) for row in rows]
@@ -0,0 +1,220 @@
+"""
+A local stand-in for the parts of the Google Calendar API v3 that GcalHelper uses, for benchmarks and offline runs.
+It serves synthetic calendars from a background thread: events().list with timeMin/timeMax, orderBy=startTime,
+maxResults/pageToken pagination, sync tokens, fields partial responses and gzip, and calendarList().list. Events look
+like the real resources, with the fields the dashboard doesn't use, and recurring series are returned expanded into
+their instances the way singleEvents=True does. The same parameters and seed always give the same events. A latency
+can be added to every response to play a slow connection.
+
+Point GcalHelper at it with credentials=AnonymousCredentials() and apiEndpoint=FakeCalendarAPI.endpoint.
+"""
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+import datetime as dt
+import gzip
+import json
+import logging
+import random
+import re
+import threading
+import time
+
+EVENTS_PATH_RE = re.compile(r'/calendars/([^/]+)/events$')
+ITEMS_FIELDS_RE = re.compile(r'items\(([^)]*)\)')
+MAX_PAGE_SIZE = 2500  # the API caps maxResults at 2500
+
+
+def iso_utc(datetimeObj):
+    return datetimeObj.astimezone(dt.timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def parse_time(value):
+    return dt.datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+
+def select_fields(body, fields):
+    # Partial response for a fields parameter of the form 'items(id,summary),nextPageToken'
+    itemFields = ITEMS_FIELDS_RE.search(fields)
+    topFields = set(name.strip() for name in ITEMS_FIELDS_RE.sub('items', fields).split(','))
+    selected = {key: value for key, value in body.items() if key in topFields}
+    if itemFields and 'items' in selected:
+        names = set(name.strip() for name in itemFields.group(1).split(','))
+        selected['items'] = [{key: value for key, value in item.items() if key in names} for item in body['items']]
+    return selected
+
+
+class FakeCalendarAPI:
+
+    def __init__(self, calendars=3, events=100, startDate=None, days=3, multiday=0.1, allday=0.1, recurring=0.2,
+                 pageSize=250, latency=0, host='127.0.0.1', port=0, seed=0):
+        self.logger = logging.getLogger('maginkdash')
+        self.startDate = startDate or dt.date.today()
+        self.days = days
+        self.pageSize = pageSize  # items per page when the request doesn't set maxResults, 250 like the real API
+        self.latency = latency  # seconds every response is delayed by, to play a slow connection
+        self.host = host
+        self.port = port
+        self.calendarIds = [f'calendar{i}@fake.calendar' for i in range(calendars)]
+        # calendar id -> event resources sorted by start
+        self.calendars = {cal: self.generate(cal, events, multiday, allday, recurring, seed + i)
+                          for i, cal in enumerate(self.calendarIds)}
+        self.requests = 0
+        self.bytesSent = 0  # response bodies as sent, after compression
+        self.lock = threading.Lock()
+        self.httpd = None
+
+    @property
+    def endpoint(self):
+        # Base URL to pass as the API endpoint, in place of https://www.googleapis.com/calendar/v3/
+        return f'http://{self.host}:{self.port}/calendar/v3/'
+
+    def generate(self, cal, count, multidayRatio, alldayRatio, recurringRatio, seed):
+        # count events over the days from startDate: a share of them are the instances of daily recurring series,
+        # the others are one-off timed, all-day or multi-day events
+        rng = random.Random(seed)
+        start = dt.datetime.combine(self.startDate, dt.time(), tzinfo=dt.timezone.utc)
+        updated = iso_utc(start - dt.timedelta(days=7))
+        items = []
+
+        def resource(eventId, summary, startField, endField, **extra):
+            return dict({
+                'kind': 'calendar#event', 'etag': f'"{rng.getrandbits(48)}"', 'id': eventId, 'status': 'confirmed',
+                'htmlLink': f'https://www.google.com/calendar/event?eid={eventId}', 'created': updated,
+                'updated': updated, 'summary': summary, 'creator': {'email': cal, 'self': True},
+                'organizer': {'email': cal, 'self': True}, 'start': startField, 'end': endField,
+                'iCalUID': f'{eventId}@google.com', 'sequence': 0, 'reminders': {'useDefault': True},
+                'eventType': 'default',
+            }, **extra)
+
+        recurringCount = int(count * recurringRatio)
+        series = 0
+        while recurringCount > 0:
+            seriesId = f'{cal.split("@")[0]}r{series}'
+            first = start + dt.timedelta(minutes=rng.randrange(7 * 60, 20 * 60, 15))
+            duration = dt.timedelta(minutes=rng.choice((15, 30, 60)))
+            for day in range(min(self.days, recurringCount)):
+                instanceStart = first + dt.timedelta(days=day)
+                instanceId = f'{seriesId}_{instanceStart.strftime("%Y%m%dT%H%M%SZ")}'
+                items.append(resource(instanceId, f'Recurring {series}',
+                                      {'dateTime': iso_utc(instanceStart), 'timeZone': 'UTC'},
+                                      {'dateTime': iso_utc(instanceStart + duration), 'timeZone': 'UTC'},
+                                      recurringEventId=seriesId,
+                                      originalStartTime={'dateTime': iso_utc(instanceStart), 'timeZone': 'UTC'}))
+                recurringCount -= 1
+            series += 1
+
+        for i in range(count - len(items)):
+            eventId = f'{cal.split("@")[0]}e{i}'
+            kind = rng.random()
+            day = self.startDate + dt.timedelta(days=rng.randrange(self.days))
+            if kind < multidayRatio:
+                eventStart = start + dt.timedelta(minutes=rng.randrange(self.days * 24 * 60))
+                eventEnd = eventStart + dt.timedelta(days=rng.randint(1, 3), hours=rng.randint(0, 12))
+                items.append(resource(eventId, f'Trip {i}', {'dateTime': iso_utc(eventStart)},
+                                      {'dateTime': iso_utc(eventEnd)}))
+            elif kind < multidayRatio + alldayRatio:
+                items.append(resource(eventId, f'All day {i}', {'date': day.isoformat()},
+                                      {'date': (day + dt.timedelta(days=1)).isoformat()}))
+            else:
+                eventStart = dt.datetime.combine(day, dt.time(), tzinfo=dt.timezone.utc) + \
+                    dt.timedelta(minutes=rng.randrange(6 * 60, 22 * 60, 5))
+                eventEnd = eventStart + dt.timedelta(minutes=rng.choice((15, 30, 45, 60, 90, 120)))
+                items.append(resource(eventId, f'Event {i} with a fairly typical title',
+                                      {'dateTime': iso_utc(eventStart)}, {'dateTime': iso_utc(eventEnd)}))
+
+        items.sort(key=lambda item: self.item_range(item)[0])
+        return items
+
+    def item_range(self, item):
+        def bound(field):
+            if 'dateTime' in field:
+                return parse_time(field['dateTime'])
+            return dt.datetime.combine(dt.date.fromisoformat(field['date']), dt.time(), tzinfo=dt.timezone.utc)
+        return bound(item['start']), bound(item['end'])
+
+    def list_events(self, cal, params):
+        if cal not in self.calendars:
+            return 404, {'error': {'code': 404, 'message': 'Not Found'}}
+        if 'syncToken' in params:
+            # Nothing changes between requests
+            return 200, {'kind': 'calendar#events', 'items': [], 'nextSyncToken': f'sync-{cal}'}
+
+        items = self.calendars[cal]
+        if 'timeMin' in params or 'timeMax' in params:
+            timeMin = parse_time(params['timeMin']) if 'timeMin' in params else None
+            timeMax = parse_time(params['timeMax']) if 'timeMax' in params else None
+            kept = []
+            for item in items:
+                itemStart, itemEnd = self.item_range(item)
+                if (timeMin is None or itemEnd > timeMin) and (timeMax is None or itemStart < timeMax):
+                    kept.append(item)
+            items = kept
+
+        pageSize = min(int(params.get('maxResults', self.pageSize)), MAX_PAGE_SIZE)
+        offset = int(params.get('pageToken', 0))
+        body = {'kind': 'calendar#events', 'summary': cal, 'timeZone': 'UTC', 'items': items[offset:offset + pageSize]}
+        if offset + pageSize < len(items):
+            body['nextPageToken'] = str(offset + pageSize)
+        else:
+            body['nextSyncToken'] = f'sync-{cal}'
+        return 200, body
+
+    def list_calendars(self):
+        return 200, {'kind': 'calendar#calendarList',
+                     'items': [{'kind': 'calendar#calendarListEntry', 'id': cal, 'summary': cal}
+                               for cal in self.calendarIds]}
+
+    def make_handler(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                url = urlsplit(self.path)
+                params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+                match = EVENTS_PATH_RE.search(url.path)
+                if match:
+                    status, body = api.list_events(unquote(match.group(1)), params)
+                elif url.path.endswith('/users/me/calendarList'):
+                    status, body = api.list_calendars()
+                else:
+                    status, body = 404, {'error': {'code': 404, 'message': 'Not Found'}}
+                if status == 200 and 'fields' in params:
+                    body = select_fields(body, params['fields'])
+                data = json.dumps(body).encode('utf-8')
+                gzipped = 'gzip' in self.headers.get('Accept-Encoding', '')
+                if gzipped:
+                    data = gzip.compress(data)
+                if api.latency:
+                    time.sleep(api.latency)
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json; charset=UTF-8')
+                if gzipped:
+                    self.send_header('Content-Encoding', 'gzip')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+                with api.lock:
+                    api.requests += 1
+                    api.bytesSent += len(data)
+
+            def log_message(self, format, *args):
+                api.logger.debug('%s - %s' % (self.address_string(), format % args))
+
+        return Handler
+
+    def start(self):
+        self.httpd = ThreadingHTTPServer((self.host, self.port), self.make_handler())
+        self.httpd.daemon_threads = True
+        self.port = self.httpd.server_address[1]
+        thread = threading.Thread(target=self.httpd.serve_forever, name='fake-calendar-api', daemon=True)
+        thread.start()
+        self.logger.info(f"Fake Calendar API serving {len(self.calendars)} calendars on {self.endpoint}")
+
+    def stop(self):
+        if self.httpd is not None:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+            self.httpd = None
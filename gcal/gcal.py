@@ -3,15 +3,29 @@ This is where we retrieve events from the Google Calendar. Before doing so, make
 credentials.json and token.pickle in the same folder as this file. If not, run quickstart.py first.
 """
 
+from gcal.dayindex import DayIndex
 from gcal.gcalhelper import GcalHelper
 import logging
 from datetime import datetime
+from tracing import span
 
 
 class GcalModule:
-    def __init__(self):
+    def __init__(self, eventStore=False, fetchWorkers=4, fetchTimeout=30, credentials=None, apiEndpoint=None,
+                 eventCache=None):
         self.logger = logging.getLogger('maginkdash')
-        self.calHelper = GcalHelper()
+        self.calHelper = GcalHelper(eventStore=eventStore, fetchWorkers=fetchWorkers, fetchTimeout=fetchTimeout,
+                                    credentials=credentials, apiEndpoint=apiEndpoint, eventCache=eventCache)
+
+    @property
+    def ignoredEvents(self):
+        # Number of events dropped by ignorePatterns in the last update
+        return self.calHelper.ignoredEvents
+
+    def stale_since(self, displayTZ):
+        # When the oldest events shown in place of a calendar that couldn't be fetched in time were fetched, or None
+        staleSince = self.calHelper.staleSince
+        return datetime.fromtimestamp(staleSince, displayTZ) if staleSince is not None else None
 
     def get_day_in_cal(self, startDate, eventDate):
         delta = eventDate - startDate
@@ -32,47 +46,36 @@ class GcalModule:
             datetime_str = '{}{}am'.format(str(datetimeObj.hour), datetime_str)
         return datetime_str
 
-    def get_events(self, currDate, calendars, calStartDatetime, calEndDatetime, displayTZ, numDays):
-        eventList = self.calHelper.retrieve_events(calendars, calStartDatetime, calEndDatetime, displayTZ)
-
-        # Get current time in the display timezone for filtering past events
-        current_time = datetime.now(displayTZ)
-        self.logger.info(f"Current time: {current_time}")
-
-        # Filter out past events (events that have already ended)
-        filtered_events = []
-        for event in eventList:
-            # Keep all-day events and multi-day events
-            if event['allday'] or event['isMultiday']:
-                # For multi-day events, check if they end before current date
-                if event['isMultiday'] and event['endDatetime'].date() < current_time.date():
-                    self.logger.info(f"Skipping past multi-day event: {event['summary']}")
-                    continue
-                filtered_events.append(event)
-            # For regular events, check if they ended before current time
-            elif event['endDatetime'] > current_time:
-                filtered_events.append(event)
-            else:
-                self.logger.info(f"Skipping past event: {event['summary']} (ended at {event['endDatetime']})")
+    def get_events(self, currDate, calendars, calStartDatetime, calEndDatetime, displayTZ, numDays,
+                   ignorePatterns=None):
+        eventList = self.calHelper.retrieve_events(calendars, calStartDatetime, calEndDatetime, displayTZ,
+                                                   ignorePatterns)
+        return self.split_days(eventList, currDate, displayTZ, numDays)
 
-        self.logger.info(f"Filtered {len(eventList) - len(filtered_events)} past events")
+    def split_days(self, eventList, currDate, displayTZ, numDays, now=None):
+        with span('bucket', count=len(eventList)):
+            # Get current time in the display timezone for filtering past events. A later time can be given to see
+            # the days as they will be shown then.
+            current_time = now or datetime.now(displayTZ)
+            self.logger.info(f"Current time: {current_time}")
 
-        # check if event stretches across multiple days
-        calList = []
-        for i in range(numDays):
-            calList.append([])
+            # Filter out past events (events that have already ended)
+            filtered_events = []
+            for event in eventList:
+                # Keep all-day events and multi-day events
+                if event['allday'] or event['isMultiday']:
+                    # For multi-day events, check if they end before current date
+                    if event['isMultiday'] and event['endDatetime'].date() < current_time.date():
+                        self.logger.info(f"Skipping past multi-day event: {event['summary']}")
+                        continue
+                    filtered_events.append(event)
+                # For regular events, check if they ended before current time
+                elif event['endDatetime'] > current_time:
+                    filtered_events.append(event)
+                else:
+                    self.logger.info(f"Skipping past event: {event['summary']} (ended at {event['endDatetime']})")
 
-        for event in filtered_events:
-            idx = self.get_day_in_cal(currDate, event['startDatetime'].date())
-            if event['isMultiday']:
-                end_idx = self.get_day_in_cal(currDate, event['endDatetime'].date())
-                if idx < 0:
-                    idx = 0
-                if end_idx >= len(calList):
-                    end_idx = len(calList) - 1
-                for i in range(idx, end_idx + 1):
-                    calList[i].append(event)
-            elif idx >= 0:
-                calList[idx].append(event)
+            self.logger.info(f"Filtered {len(eventList) - len(filtered_events)} past events")
 
-        return calList
\ No newline at end of file
+            # Split the events into days, multi-day events appear on every day they span
+            return DayIndex(filtered_events, currDate, numDays).days
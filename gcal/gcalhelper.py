@@ -7,43 +7,86 @@ credentials.json and token.pickle in the same folder as this file. If not, run q
 
 from __future__ import print_function
 import datetime as dt
+import functools
 import pickle
 import os.path
 import pathlib
 from googleapiclient.discovery import build
-from google_auth_oauthlib.flow import InstalledAppFlow
-from google.auth.transport.requests import Request
+from googleapiclient.errors import HttpError
+from concurrent.futures import ThreadPoolExecutor, wait
 import logging
+import math
+import time
+from gcal.eventstore import EventStore
+from gcal.ignore import ignore_matcher
+from gcal.snapshot import EventSnapshot
+from gcal.transport import PooledHttp
+from tracing import span
+
+
+# Only the parts of the event resources parse_event and store_items use are requested
+EVENT_FIELDS = 'items(id,status,summary,start,end,updated),nextPageToken,nextSyncToken'
+# Tokens expiring within this many seconds are refreshed before a fetch rather than by a fetch thread mid-request
+TOKEN_REFRESH_MARGIN = 300
 
 
 class GcalHelper:
 
-    def __init__(self):
+    def __init__(self, eventStore=False, syncHorizonDays=28, fetchWorkers=4, fetchTimeout=30, credentials=None,
+                 apiEndpoint=None, eventCache=None):
         self.logger = logging.getLogger('maginkdash')
         # Initialise the Google Calendar using the provided credentials and token
         SCOPES = ['https://www.googleapis.com/auth/calendar.readonly']
         self.currPath = str(pathlib.Path(__file__).parent.absolute())
 
-        creds = None
-        # The file token.pickle stores the user's access and refresh tokens, and is
-        # created automatically when the authorization flow completes for the first
-        # time.
-        if os.path.exists(self.currPath + '/token.pickle'):
-            with open(self.currPath + '/token.pickle', 'rb') as token:
-                creds = pickle.load(token)
-        # If there are no (valid) credentials available, let the user log in.
-        if not creds or not creds.valid:
-            if creds and creds.expired and creds.refresh_token:
-                creds.refresh(Request())
-            else:
-                flow = InstalledAppFlow.from_client_secrets_file(
-                    self.currPath + '/credentials.json', SCOPES)
-                creds = flow.run_local_server(port=0)
-            # Save the credentials for the next run
-            with open(self.currPath + '/token.pickle', 'wb') as token:
-                pickle.dump(creds, token)
+        # Credentials and an API endpoint can be given instead of token.pickle and Google's servers, e.g. to run
+        # against the fake Calendar API in fakeapi.py
+        with span('auth'):
+            creds = credentials
+            # The file token.pickle stores the user's access and refresh tokens, and is
+            # created automatically when the authorization flow completes for the first
+            # time.
+            if creds is None and os.path.exists(self.currPath + '/token.pickle'):
+                with open(self.currPath + '/token.pickle', 'rb') as token:
+                    creds = pickle.load(token)
+            # If there are no (valid) credentials available, let the user log in. The OAuth and requests libraries
+            # are only imported then, a valid token doesn't need them.
+            if not creds or not creds.valid:
+                if creds and creds.expired and creds.refresh_token:
+                    from google.auth.transport.requests import Request
+                    creds.refresh(Request())
+                else:
+                    from google_auth_oauthlib.flow import InstalledAppFlow
+                    flow = InstalledAppFlow.from_client_secrets_file(
+                        self.currPath + '/credentials.json', SCOPES)
+                    creds = flow.run_local_server(port=0)
+                # Save the credentials for the next run
+                with open(self.currPath + '/token.pickle', 'wb') as token:
+                    pickle.dump(creds, token)
+
+        self.creds = creds
+        self.savesToken = credentials is None  # a refreshed token is saved back to token.pickle
+
+        # Calendars are fetched on a bounded thread pool. All fetch threads share one pooled keep-alive session,
+        # which is kept for later runs in daemon mode.
+        self.fetchWorkers = max(1, fetchWorkers)
+        self.fetchTimeout = fetchTimeout  # seconds allowed for fetching all pages of one calendar
+        self.executor = ThreadPoolExecutor(max_workers=self.fetchWorkers, thread_name_prefix='gcal-fetch')
+        self.http = PooledHttp(creds, timeout=fetchTimeout, poolSize=self.fetchWorkers)
+        clientOptions = {'api_endpoint': apiEndpoint} if apiEndpoint else None
+        self.service = build('calendar', 'v3', http=self.http, cache_discovery=False, client_options=clientOptions)
 
-        self.service = build('calendar', 'v3', credentials=creds, cache_discovery=False)
+        # With eventStore enabled, events are synced incrementally into a local SQLite database
+        self.eventStore = EventStore(self.currPath + '/events.db') if eventStore else None
+        self.syncHorizonDays = syncHorizonDays  # days past the display window covered by a full sync
+        self.ignoredEvents = 0  # events dropped by ignorePatterns in the last retrieve_events call
+
+        # With eventCache options (ttl, budget, maxAge), the last good events of each calendar are kept, so a slow or
+        # failing calendar doesn't hold up the update. Fetches that missed the budget finish in the background.
+        self.snapshot = EventSnapshot(self.currPath + '/events-snapshot.json', **eventCache) \
+            if eventCache is not None else None
+        self.pending = {}  # calendar id -> fetch still running in the background
+        self.staleSince = None  # time of the oldest snapshot used instead of fetching in the last fetch_items call
 
     def list_calendars(self):
         # helps to retrieve ID for calendars within the account
@@ -76,54 +119,257 @@ class GcalHelper:
         # check if event stretches across multiple days
         return start.date() != end.date()
 
-    def retrieve_events(self, calendars, startDatetime, endDatetime, localTZ):
-        # Call the Google Calendar API and return a list of events that fall within the specified dates
-        event_list = []
+    def parse_event(self, event, localTZ):
+        # extracting and converting events data into a new dict
+        new_event = {'summary': event['summary']}
+
+        if event['start'].get('dateTime') is None:
+            new_event['allday'] = True
+            new_event['startDatetime'] = self.to_datetime(event['start'].get('date'), localTZ)
+        else:
+            new_event['allday'] = False
+            new_event['startDatetime'] = self.to_datetime(event['start'].get('dateTime'), localTZ)
+
+        if event['end'].get('dateTime') is None:
+            new_event['endDatetime'] = self.adjust_end_time(self.to_datetime(event['end'].get('date'), localTZ),
+                                                           localTZ)
+        else:
+            new_event['endDatetime'] = self.adjust_end_time(self.to_datetime(event['end'].get('dateTime'), localTZ),
+                                                           localTZ)
+
+        new_event['updatedDatetime'] = self.to_datetime(event['updated'], localTZ)
+        new_event['isMultiday'] = self.is_multiday(new_event['startDatetime'], new_event['endDatetime'])
+        return new_event
+
+    def refresh_token(self):
+        # Refresh the access token once, before the fetch threads start, if it is about to expire
+        expiry = getattr(self.creds, 'expiry', None)
+        if expiry is None or not getattr(self.creds, 'refresh_token', None):
+            return
+        remaining = (expiry - dt.datetime.now(dt.timezone.utc).replace(tzinfo=None)).total_seconds()
+        if remaining > TOKEN_REFRESH_MARGIN:
+            return
+        from google.auth.transport.requests import Request
+        with span('auth', refresh=True):
+            self.creds.refresh(Request())
+        self.logger.info(f"Refreshed the access token, which expired in {remaining:.0f}s")
+        if self.savesToken:
+            with open(self.currPath + '/token.pickle', 'wb') as token:
+                pickle.dump(self.creds, token)
+
+    def list_all_pages(self, **kwargs):
+        # Run events().list and follow nextPageToken, returning all items and the final nextSyncToken
+        items = []
+        pageToken = None
+        deadline = time.monotonic() + self.fetchTimeout
+        requestsBefore, bytesBefore = self.http.thread_counters()
+        with span('fetch', calendar=kwargs.get('calendarId')) as record:
+            try:
+                while True:
+                    if time.monotonic() > deadline:
+                        raise TimeoutError(f"Fetching {kwargs.get('calendarId')} took longer than {self.fetchTimeout}s")
+                    result = self.service.events().list(pageToken=pageToken, fields=EVENT_FIELDS,
+                                                        **kwargs).execute()
+                    items += result.get('items', [])
+                    pageToken = result.get('nextPageToken')
+                    if not pageToken:
+                        return items, result.get('nextSyncToken')
+            finally:
+                requestsAfter, bytesAfter = self.http.thread_counters()
+                record.update(count=len(items), bytes=bytesAfter - bytesBefore, requests=requestsAfter - requestsBefore)
+
+    def sync_calendar(self, cal, startDatetime, endDatetime, localTZ):
+        # Bring the local event store up to date for one calendar. A full sync covers the display window plus
+        # syncHorizonDays, later runs only fetch changes using the sync token until the window moves past that.
+        state = self.eventStore.get_sync_state(cal)
+        if (state and state['syncToken'] and state['timezone'] == str(localTZ)
+                and state['syncedFrom'] <= startDatetime.timestamp()
+                and endDatetime.timestamp() <= state['syncedUntil']):
+            try:
+                items, syncToken = self.list_all_pages(calendarId=cal, syncToken=state['syncToken'],
+                                                       singleEvents=True)
+                self.store_items(cal, items, dict(state, syncToken=syncToken), localTZ, replace=False)
+                self.logger.info(f"Incremental sync of {cal}: {len(items)} changed events")
+                return
+            except HttpError as e:
+                if e.resp.status != 410:
+                    raise
+                # The sync token expired, start over with a full sync
+                self.logger.info(f"Sync token for {cal} is no longer valid, doing a full sync")
+                self.eventStore.clear_calendar(cal)
+
+        syncedUntil = endDatetime + dt.timedelta(days=self.syncHorizonDays)
+        items, syncToken = self.list_all_pages(calendarId=cal, timeMin=startDatetime.isoformat(),
+                                               timeMax=syncedUntil.isoformat(), singleEvents=True)
+        state = {'syncToken': syncToken, 'syncedFrom': startDatetime.timestamp(),
+                 'syncedUntil': syncedUntil.timestamp(), 'timezone': str(localTZ)}
+        self.store_items(cal, items, state, localTZ, replace=True)
+        self.logger.info(f"Full sync of {cal}: {len(items)} events")
 
+    def store_items(self, cal, items, syncState, localTZ, replace):
+        changes = []
+        deletedIds = []
+        for item in items:
+            if item.get('status') == 'cancelled':
+                deletedIds.append(item['id'])
+                continue
+            start = item['start'].get('dateTime') or item['start'].get('date')
+            end = item['end'].get('dateTime') or item['end'].get('date')
+            # Only the fields used by parse_event are kept
+            event = {'summary': item.get('summary', ''), 'start': item['start'], 'end': item['end'],
+                     'updated': item['updated']}
+            changes.append((item['id'], self.to_datetime(start, localTZ).timestamp(),
+                            self.to_datetime(end, localTZ).timestamp(), event))
+        self.eventStore.apply_changes(cal, changes, deletedIds, syncState, replace=replace)
+
+    def fetch_calendars(self, calendars, fetchOne):
+        # Run fetchOne(cal) for every calendar on a bounded thread pool. A calendar that fails or times out is
+        # logged and left out of the result, so it cannot hold up or break the others.
+        results = {}
+        if not calendars:
+            return results
+        futures = {self.executor.submit(fetchOne, cal): cal for cal in calendars}
+        # Every calendar enforces its own deadline, this only guards against a request that never returns
+        rounds = math.ceil(len(calendars) / self.fetchWorkers)
+        done, not_done = wait(futures, timeout=self.fetchTimeout * rounds + 5)
+
+        for future in not_done:
+            self.logger.error(f"Timed out fetching events from {futures[future]}")
+        for future in done:
+            cal = futures[future]
+            try:
+                results[cal] = future.result()
+            except Exception as e:
+                self.logger.error(f"Failed to fetch events from {cal}: {str(e)}")
+        return results
+
+    def fetch_within_budget(self, calendars, fetchOne, startTs, endTs):
+        # Like fetch_calendars, but a calendar that isn't fetched within the snapshot's budget, or fails, is served
+        # from its snapshot. Calendars without a usable snapshot are waited for as usual.
+        results = {}
+        futures = {}
+        stale = []
+        self.staleSince = None
+        for cal in calendars:
+            entry = self.snapshot.get(cal, startTs, endTs)
+            if entry is not None and self.snapshot.is_fresh(entry, startTs, endTs):
+                results[cal] = entry['items']
+                continue
+            future = self.pending.get(cal)
+            if future is None or future.done():
+                # A fetch that is still running from an earlier update is waited for instead of starting another
+                future = self.executor.submit(fetchOne, cal)
+                future.add_done_callback(functools.partial(self.fetched, cal, startTs, endTs))
+                self.pending[cal] = future
+            futures[future] = cal
+        if not futures:
+            return results
+
+        # One deadline for the whole update, like fetch_calendars, however many calendars have to be waited for
+        rounds = math.ceil(len(futures) / self.fetchWorkers)
+        deadline = time.monotonic() + self.fetchTimeout * rounds + 5
+        done, not_done = wait(futures, timeout=self.snapshot.budget)
+        waiting = []
+        for future, cal in futures.items():
+            try:
+                if future in done:
+                    results[cal] = future.result()
+                    continue
+            except Exception as e:
+                self.logger.error(f"Failed to fetch events from {cal}: {str(e)}")
+            entry = self.snapshot.get(cal, startTs, endTs)
+            if entry is not None:
+                results[cal] = entry['items']
+                stale.append(entry['fetched'])
+                if future in not_done:
+                    self.logger.warning(f"Fetching {cal} took longer than {self.snapshot.budget}s, showing the events "
+                                        f"fetched at {time.strftime('%H:%M:%S', time.localtime(entry['fetched']))} "
+                                        f"and refreshing in the background")
+                continue
+            if future in not_done:
+                # Nothing to show instead, wait for it like fetch_calendars would
+                waiting.append(future)
+
+        if waiting:
+            done, not_done = wait(waiting, timeout=max(deadline - time.monotonic(), 0))
+            for future in not_done:
+                self.logger.error(f"Timed out fetching events from {futures[future]}")
+            for future in done:
+                try:
+                    results[futures[future]] = future.result()
+                except Exception as e:
+                    self.logger.error(f"Failed to fetch events from {futures[future]}: {str(e)}")
+
+        if stale:
+            self.staleSince = min(stale)
+        return results
+
+    def fetched(self, cal, startTs, endTs, future):
+        # Runs when a fetch finishes, also after the update that started it has gone ahead without it
+        if self.pending.get(cal) is future:
+            del self.pending[cal]
+        if not future.cancelled() and future.exception() is None:
+            self.snapshot.store(cal, startTs, endTs, future.result())
+
+    def fetch_items(self, calendars, startDatetime, endDatetime, localTZ):
+        # Fetch the raw API items of every calendar concurrently, returned per calendar
+        self.refresh_token()
+        before = (self.http.requests, self.http.bytesReceived, self.http.connections)
+        items = self.fetch_window(calendars, startDatetime, endDatetime, localTZ)
+        self.logger.info(f"Fetched {len(items)} calendars in {self.http.requests - before[0]} requests, "
+                         f"{(self.http.bytesReceived - before[1]) / 1024:.1f} KB received, "
+                         f"{self.http.connections - before[2]} new connections")
+        return items
+
+    def fetch_window(self, calendars, startDatetime, endDatetime, localTZ):
         min_time_str = startDatetime.isoformat()
         max_time_str = endDatetime.isoformat()
-        if False:
-            return event_list
 
         self.logger.info('Retrieving events between ' + min_time_str + ' and ' + max_time_str + '...')
-        events_result = []
-        for cal in calendars:
-            events_result.append(
-                self.service.events().list(calendarId=cal, timeMin=min_time_str,
-                                           timeMax=max_time_str, singleEvents=True,
-                                           orderBy='startTime').execute()
-            )
+        if self.snapshot is not None:
+            def fetchOne(cal):
+                if self.eventStore is not None:
+                    self.sync_calendar(cal, startDatetime, endDatetime, localTZ)
+                    return self.eventStore.query_window([cal], startDatetime.timestamp(), endDatetime.timestamp())
+                return self.list_all_pages(calendarId=cal, timeMin=min_time_str, timeMax=max_time_str,
+                                           singleEvents=True, orderBy='startTime')[0]
+            return self.fetch_within_budget(calendars, fetchOne, startDatetime.timestamp(), endDatetime.timestamp())
+
+        if self.eventStore is not None:
+            # A calendar that fails to sync is still served from what was stored by earlier runs
+            self.fetch_calendars(calendars, lambda cal: self.sync_calendar(cal, startDatetime, endDatetime, localTZ))
+            return {cal: self.eventStore.query_window([cal], startDatetime.timestamp(), endDatetime.timestamp())
+                    for cal in calendars}
+        return self.fetch_calendars(
+            calendars,
+            lambda cal: self.list_all_pages(calendarId=cal, timeMin=min_time_str, timeMax=max_time_str,
+                                            singleEvents=True, orderBy='startTime')[0])
 
-        events = []
-        for eve in events_result:
-            events += eve.get('items', [])
-            # events = events_result.get('items', [])
+    def parse_items(self, events, localTZ, ignorePatterns=None):
+        # Turn raw API items into sorted events, dropping ignored events before they are parsed and sorted
+        event_list = []
+        matcher = ignore_matcher(tuple(ignorePatterns or ()))
+        self.ignoredEvents = 0
+        if matcher is not None:
+            with span('filter') as record:
+                kept = [event for event in events if not matcher(event.get('summary', ''))]
+                self.ignoredEvents = len(events) - len(kept)
+                events = kept
+                record.update(count=self.ignoredEvents)
+            self.logger.info(f"Ignored {self.ignoredEvents} events matching ignorePatterns")
 
         if not events:
             self.logger.info('No upcoming events found.')
-        for event in events:
-            # extracting and converting events data into a new list
-            new_event = {'summary': event['summary']}
-
-            if event['start'].get('dateTime') is None:
-                new_event['allday'] = True
-                new_event['startDatetime'] = self.to_datetime(event['start'].get('date'), localTZ)
-            else:
-                new_event['allday'] = False
-                new_event['startDatetime'] = self.to_datetime(event['start'].get('dateTime'), localTZ)
-
-            if event['end'].get('dateTime') is None:
-                new_event['endDatetime'] = self.adjust_end_time(self.to_datetime(event['end'].get('date'), localTZ),
-                                                               localTZ)
-            else:
-                new_event['endDatetime'] = self.adjust_end_time(self.to_datetime(event['end'].get('dateTime'), localTZ),
-                                                               localTZ)
-
-            new_event['updatedDatetime'] = self.to_datetime(event['updated'], localTZ)
-            new_event['isMultiday'] = self.is_multiday(new_event['startDatetime'], new_event['endDatetime'])
-            event_list.append(new_event)
-
-        # We need to sort eventList because the event will be sorted in "calendar order" instead of hours order
-        # TODO: improve because of double cycle for now is not much cost
-        event_list = sorted(event_list, key=lambda k: k['startDatetime'])
+        with span('parse', count=len(events)):
+            for event in events:
+                event_list.append(self.parse_event(event, localTZ))
+
+            # We need to sort eventList because the event will be sorted in "calendar order" instead of hours order
+            event_list = sorted(event_list, key=lambda k: k['startDatetime'])
         return event_list
+
+    def retrieve_events(self, calendars, startDatetime, endDatetime, localTZ, ignorePatterns=None):
+        # Call the Google Calendar API and return a list of events that fall within the specified dates
+        items = self.fetch_items(calendars, startDatetime, endDatetime, localTZ)
+        events = [event for cal in calendars for event in items.get(cal, [])]
+        return self.parse_items(events, localTZ, ignorePatterns)
@@ -0,0 +1,35 @@
+"""
+Matches event summaries against the ignorePatterns of the config. The patterns are joined into one case-insensitive
+regex where that gives the same result, so an event is checked with a single search. Patterns whose backreferences
+or conditionals refer to groups by number or name are kept apart, since joining shifts their group numbers and they
+would silently stop matching.
+"""
+
+import functools
+import re
+
+# Backreferences (\1, (?P=name)) and conditionals ((?(1)...)), which depend on the group numbering of the pattern
+GROUP_REFERENCE_RE = re.compile(r'\\\d|\(\?P=|\(\?\(')
+
+
+def refers_to_groups(pattern):
+    return re.compile(pattern).groups > 0 and GROUP_REFERENCE_RE.search(pattern) is not None
+
+
+@functools.lru_cache(maxsize=8)
+def ignore_matcher(patterns):
+    # Returns a search function for the patterns, compiled once per set of patterns, or None when there is nothing
+    # to ignore
+    if not patterns:
+        return None
+    compiled = [re.compile(p, re.IGNORECASE) for p in patterns if refers_to_groups(p)]
+    joinable = [p for p in patterns if not refers_to_groups(p)]
+    if joinable:
+        try:
+            compiled.insert(0, re.compile('|'.join(f'(?:{p})' for p in joinable), re.IGNORECASE))
+        except re.error:
+            # Patterns with global flags or clashing group names can't be joined, test those one by one
+            compiled += [re.compile(p, re.IGNORECASE) for p in joinable]
+    if len(compiled) == 1:
+        return compiled[0].search
+    return lambda summary: any(p.search(summary) for p in compiled)
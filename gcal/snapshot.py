@@ -0,0 +1,59 @@
+"""
+The last events fetched successfully for each calendar, kept in a JSON file so an update can go ahead without waiting
+for a slow or failing Calendar API (stale-while-revalidate). GcalHelper uses a calendar's snapshot instead of fetching
+it while the snapshot is younger than ttl, and falls back to it when the fetch doesn't finish within the run's time
+budget or fails. A fetch that missed the budget keeps running in the background and refreshes the snapshot for the
+next run. Snapshots older than maxAge are not shown any more.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+
+
+class EventSnapshot:
+
+    def __init__(self, path, ttl=0, budget=10, maxAge=86400):
+        self.logger = logging.getLogger('maginkdash')
+        self.path = path
+        self.ttl = ttl  # seconds a snapshot is used as is, without fetching the calendar again
+        self.budget = budget  # seconds an update waits for the calendars before using the snapshots
+        self.maxAge = maxAge  # seconds after which a snapshot is too old to be shown
+        self.lock = threading.Lock()
+        self.entries = self.load()  # calendar id -> {'fetched': timestamp, 'window': [start, end], 'items': [...]}
+
+    def load(self):
+        try:
+            with open(self.path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def get(self, cal, startTs, endTs):
+        # The snapshot of a calendar, if it is recent enough and was fetched for a window overlapping this one. Just
+        # after midnight that is yesterday's window, still better than nothing while the fetch catches up.
+        with self.lock:
+            entry = self.entries.get(cal)
+        if entry is None or time.time() - entry['fetched'] > self.maxAge:
+            return None
+        if entry['window'][1] <= startTs or entry['window'][0] >= endTs:
+            return None
+        return entry
+
+    def is_fresh(self, entry, startTs, endTs):
+        # Young enough to skip fetching, and covering the whole window
+        return (time.time() - entry['fetched'] < self.ttl
+                and entry['window'][0] <= startTs and endTs <= entry['window'][1])
+
+    def store(self, cal, startTs, endTs, items):
+        with self.lock:
+            self.entries[cal] = {'fetched': time.time(), 'window': [startTs, endTs], 'items': items}
+            try:
+                tmpFile = self.path + '.tmp'
+                with open(tmpFile, 'w') as f:
+                    json.dump(self.entries, f)
+                os.replace(tmpFile, self.path)
+            except OSError as e:
+                self.logger.error(f"Could not save the event snapshot: {str(e)}")
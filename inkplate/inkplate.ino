@@ -5,6 +5,7 @@
 #include "Inkplate.h"
 #include <WiFi.h>
 #include <WiFiClientSecure.h>
+#include <HTTPClient.h>
 #include <UniversalTelegramBot.h>
 #include <ArduinoJson.h>
 
@@ -14,6 +15,33 @@ const char ssid[] = "YOUR WIFI SSID";    // Your WiFi SSID
 const char *password = "YOUR WIFI PASSWORD"; // Your WiFi password
 const char *imgurl = "http://url.to.your.server/maginkdash.png"; // Your dashboard image web address
 
+// Set to 1 to load the pre-packed framebuffer written by the server ("framebuffer": true in config.json)
+// instead of decoding the PNG, which saves time and battery on every wake-up
+#define USE_FRAMEBUFFER 0
+const char *fburl = "http://url.to.your.server/maginkdash.fb"; // Your dashboard framebuffer web address
+
+// Set to 1 to only download the parts of the framebuffer that changed ("partialUpdates" in config.json).
+// Needs a microSD card in the Inkplate, which keeps a copy of the displayed frame between wake-ups.
+// The Inkplate library only supports partial refresh in 1-bit mode, so the panel itself is still fully refreshed,
+// but only when the frame actually changed.
+#define USE_PARTIAL_UPDATES 0
+const char *manifesturl = "http://url.to.your.server/maginkdash.json"; // Manifest listing the changed tiles
+const char *serverurl = "http://url.to.your.server/"; // Web address of the folder the tiles are published in
+
+// Set to 1 to ask the server whether the image changed before downloading it. The server answers with a short
+// "304 Not Modified" when it still has the ETag from last time, and the download and the refresh are skipped.
+#define USE_ETAG 0
+
+#define MAX_ROW_BYTES 640
+#define FRAME_BYTES_PER_ROW ((1200 + 1) / 2)
+#if USE_PARTIAL_UPDATES
+RTC_DATA_ATTR int32_t lastFrame = -1; // frame shown on the panel, kept in RTC memory during deep sleep
+SdFile frameCache;                    // copy of the shown frame, 4 bits per pixel, on the SD card
+#endif
+#if USE_ETAG
+RTC_DATA_ATTR char lastEtag[80] = "";  // ETag of the image on the panel, kept in RTC memory during deep sleep
+#endif
+
 // Initialize Telegram BOT
 #define BOTtoken "YOUR TELEGRAM BOT TOKEN"  // your Bot Token (Get from Botfather)
 
@@ -47,11 +75,24 @@ void setup()
     Serial.println("Connected!");
 
     // Retrieve and display image
-    Serial.print("Downloading image...");
-    char url[256];
-    strcpy(url, imgurl);
-    Serial.println(display.drawImage(url, display.PNG, 0, 0));
-    display.display();
+#if USE_ETAG
+#if USE_PARTIAL_UPDATES
+    const char *checkurl = manifesturl;
+#elif USE_FRAMEBUFFER
+    const char *checkurl = fburl;
+#else
+    const char *checkurl = imgurl;
+#endif
+    char newEtag[sizeof(lastEtag)] = "";
+    if (imageChanged(checkurl, newEtag, sizeof(newEtag))) {
+        if (downloadAndDisplay())
+            strcpy(lastEtag, newEtag);
+    } else {
+        Serial.println("Image unchanged, skipping download and refresh");
+    }
+#else
+    downloadAndDisplay();
+#endif
 
     //uncomment or delete the following section if not using Telegram to send message when battery is low
     double battvoltage = display.readBattery();
@@ -75,6 +116,227 @@ void loop()
     // Never here, as deepsleep restarts esp32
 }
 
+// Download the dashboard and refresh the panel. Returns false if the download failed.
+bool downloadAndDisplay()
+{
+    Serial.print("Downloading image...");
+#if USE_PARTIAL_UPDATES
+    bool refresh = false;
+    bool ok = true;
+    if (display.sdCardInit() && frameCache.open("/frame.raw", O_RDWR | O_CREAT)) {
+        refresh = updateFromManifest();
+        frameCache.close();
+    } else {
+        Serial.println("SD card not available, downloading the full frame");
+        refresh = ok = drawFramebuffer(fburl);
+        lastFrame = -1;
+    }
+    if (refresh)
+        display.display();
+    return ok;
+#elif USE_FRAMEBUFFER
+    bool ok = drawFramebuffer(fburl);
+    Serial.println(ok);
+    display.display();
+    return ok;
+#else
+    char url[256];
+    strcpy(url, imgurl);
+    bool ok = display.drawImage(url, display.PNG, 0, 0);
+    Serial.println(ok);
+    display.display();
+    return ok;
+#endif
+}
+
+#if USE_ETAG
+// Ask the server with a HEAD request whether the file at url differs from the one on the panel, sending the stored
+// ETag in If-None-Match. The ETag of the current file is copied to newEtag. Errors count as changed.
+bool imageChanged(const char *url, char *newEtag, size_t len)
+{
+    const char *headers[] = {"ETag"};
+    HTTPClient http;
+    http.begin(url);
+    http.collectHeaders(headers, 1);
+    if (lastEtag[0])
+        http.addHeader("If-None-Match", lastEtag);
+    int code = http.sendRequest("HEAD");
+    if (code == HTTP_CODE_NOT_MODIFIED) {
+        http.end();
+        return false;
+    }
+    if (code == HTTP_CODE_OK)
+        http.header("ETag").toCharArray(newEtag, len);
+    http.end();
+    return true;
+}
+#endif
+
+
+// Read up to len bytes from the stream, waiting for data to arrive. Returns the number of bytes read.
+size_t readBytes(WiFiClient *stream, uint8_t *buf, size_t len)
+{
+    size_t got = 0;
+    unsigned long lastData = millis();
+    while (got < len && millis() - lastData < 10000) {
+        int n = stream->read(buf + got, len - got);
+        if (n > 0) {
+            got += n;
+            lastData = millis();
+        } else if (!stream->connected() && !stream->available()) {
+            break;
+        } else {
+            delay(1);
+        }
+    }
+    return got;
+}
+
+// Draw one row of packed pixels (two 3-bit pixels per byte, left one in the high nibble) starting at (x0, y).
+// With cache set, the row is also written to the copy of the frame kept on the SD card.
+void drawPackedRow(const uint8_t *row, uint32_t bytes, int x0, int y, bool cache)
+{
+    for (uint32_t i = 0; i < bytes; i++) {
+        display.drawPixel(x0 + 2 * i, y, row[i] >> 4);
+        display.drawPixel(x0 + 2 * i + 1, y, row[i] & 0x0F);
+    }
+#if USE_PARTIAL_UPDATES
+    if (cache && frameCache.isOpen()) {
+        frameCache.seekSet((uint32_t)y * FRAME_BYTES_PER_ROW + x0 / 2);
+        frameCache.write(row, bytes);
+    }
+#endif
+}
+
+// Stream a framebuffer written by render/framebuffer.py straight into the display buffer, with its top left
+// corner at (x0, y0). See that file for the format.
+bool drawFramebufferAt(const char *url, int x0, int y0, bool cache)
+{
+    HTTPClient http;
+    http.begin(url);
+    if (http.GET() != HTTP_CODE_OK) {
+        http.end();
+        return false;
+    }
+    WiFiClient *stream = http.getStreamPtr();
+
+    uint8_t header[14];
+    if (readBytes(stream, header, sizeof(header)) != sizeof(header) || memcmp(header, "IPFB", 4) != 0 || header[4] != 1) {
+        http.end();
+        return false;
+    }
+    bool rle = header[5] & 0x01;
+    uint16_t width = header[6] | (header[7] << 8);
+    uint16_t height = header[8] | (header[9] << 8);
+    uint32_t remaining = header[10] | (header[11] << 8) | ((uint32_t)header[12] << 16) | ((uint32_t)header[13] << 24);
+    uint32_t bytesPerRow = (width + 1) / 2;
+    if (bytesPerRow > MAX_ROW_BYTES) {
+        http.end();
+        return false;
+    }
+
+    static uint8_t row[MAX_ROW_BYTES];
+    uint32_t col = 0;
+    uint16_t y = 0;
+    auto putByte = [&](uint8_t value) {
+        if (y >= height)
+            return;
+        row[col++] = value;
+        if (col == bytesPerRow) {
+            drawPackedRow(row, bytesPerRow, x0, y0 + y, cache);
+            col = 0;
+            y++;
+        }
+    };
+
+    uint8_t buf[512];
+    int count = -1; // pending RLE count, -1 when the next byte is a count
+    while (remaining > 0) {
+        size_t n = readBytes(stream, buf, remaining < sizeof(buf) ? remaining : sizeof(buf));
+        if (n == 0)
+            break;
+        remaining -= n;
+        for (size_t i = 0; i < n; i++) {
+            if (!rle) {
+                putByte(buf[i]);
+            } else if (count < 0) {
+                count = buf[i];
+            } else {
+                for (int c = 0; c < count; c++)
+                    putByte(buf[i]);
+                count = -1;
+            }
+        }
+    }
+    http.end();
+    return remaining == 0 && y == height;
+}
+
+bool drawFramebuffer(const char *url)
+{
+    return drawFramebufferAt(url, 0, 0, false);
+}
+
+#if USE_PARTIAL_UPDATES
+// Draw the frame kept on the SD card into the display buffer, so the changed tiles can be applied on top of it
+bool loadCachedFrame()
+{
+    static uint8_t row[FRAME_BYTES_PER_ROW];
+    if (!frameCache.isOpen() || !frameCache.seekSet(0))
+        return false;
+    for (int y = 0; y < display.height(); y++) {
+        if (frameCache.read(row, FRAME_BYTES_PER_ROW) != FRAME_BYTES_PER_ROW)
+            return false;
+        drawPackedRow(row, FRAME_BYTES_PER_ROW, 0, y, false);
+    }
+    return true;
+}
+
+// Bring the display buffer up to the latest frame listed in the manifest written by render/diff.py, downloading
+// only the changed tiles when the frame on the SD card is the one they are based on. Returns false when there is
+// nothing new to show, or on errors, in which case the panel should not be refreshed.
+bool updateFromManifest()
+{
+    HTTPClient http;
+    http.begin(manifesturl);
+    if (http.GET() != HTTP_CODE_OK) {
+        http.end();
+        return false;
+    }
+    DynamicJsonDocument manifest(8192);
+    DeserializationError error = deserializeJson(manifest, http.getString());
+    http.end();
+    if (error)
+        return false;
+
+    int32_t frame = manifest["frame"];
+    if (frame == lastFrame) {
+        Serial.println("Frame unchanged, skipping refresh");
+        return false;
+    }
+
+    char url[256];
+    bool partial = !manifest["full"].as<bool>() && !manifest["base"].isNull() &&
+                   manifest["base"].as<int32_t>() == lastFrame && loadCachedFrame();
+    if (partial) {
+        for (JsonObject tile : manifest["tiles"].as<JsonArray>()) {
+            snprintf(url, sizeof(url), "%s%s", serverurl, tile["file"].as<const char *>());
+            if (!drawFramebufferAt(url, tile["x"], tile["y"], true)) {
+                partial = false;
+                break;
+            }
+        }
+    }
+    if (!partial) {
+        snprintf(url, sizeof(url), "%s%s", serverurl, manifest["image"].as<const char *>());
+        if (!drawFramebufferAt(url, 0, 0, true))
+            return false;
+    }
+    Serial.println(partial ? "Applied changed tiles" : "Downloaded full frame");
+    lastFrame = frame;
+    return true;
+}
+#endif
 
 int calc_battery_percentage(double battv)
 {
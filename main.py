@@ -6,65 +6,260 @@ As a dashboard, there are many other things that could be displayed, and it can
 retrieve the information. So feel free to change up the code and amend it to your needs.
 """
 
+import argparse
 import datetime
+import hashlib
 import logging
 import sys
 import json
 import os
+import time
 from datetime import datetime as dt
 from pytz import timezone
-from gcal.gcal import GcalModule
-from render.render import RenderHelper
+from startup import StartupProfiler
+from options import display_window, gcal_options, render_options
+from tracing import span, tracer
 
 
-if __name__ == '__main__':
+def update_dashboard(config, calModule, renderService):
     logger = logging.getLogger('maginkdash')
-
-    # Basic configuration settings (user replaceable)
-    configFile = open('config.json')
-    config = json.load(configFile)
+    logger.info("Starting dashboard update")
 
     calendars = config['calendars']  # Google Calendar IDs
     ignorePatterns = config.get('ignorePatterns', [])  # Regex patterns for events to ignore
-    displayTZ = timezone(config['displayTZ'])  # list of timezones - print(pytz.all_timezones)
-    imageWidth = config['imageWidth']  # Width of image to be generated for display.
-    imageHeight = config['imageHeight']  # Height of image to be generated for display.
-    timeFormat = config.get('timeFormat', 12)  # 12 or 24-hour time format, default to 12 if not specified
     path_to_server_image = config["path_to_server_image"]  # Location to save the generated image
 
+    try:
+        with span('update'):
+            # Retrieve Calendar Data - get up to 3 days
+            displayTZ, currDate, calStartDatetime, calEndDatetime = display_window(config)
+            allEventList = calModule.get_events(
+                currDate,
+                calendars,
+                calStartDatetime,
+                calEndDatetime,
+                displayTZ,
+                3,
+                ignorePatterns,
+            )
+
+            # Render Dashboard Image
+            changed = renderService.process_inputs(
+                currDate,
+                allEventList,
+                path_to_server_image,
+                calModule.stale_since(displayTZ),
+            )
+    finally:
+        tracer.export()
+
+    # Get absolute path to the generated image
+    absolute_image_path = os.path.abspath(path_to_server_image)
+    logger.info(f"Dashboard image saved to: {absolute_image_path}")
+
+    logger.info("Completed dashboard update")
+    return allEventList, changed
+
+
+def prerender_dashboard(config, calModule, prerenderer):
+    # Render every frame for the rest of the day at once: one valid from now, one from the end of each shown event
+    # and one from midnight. Returns the event lists shown now and whether the frames changed.
+    logger = logging.getLogger('maginkdash')
+    logger.info("Starting dashboard pre-render")
+
+    calendars = config['calendars']  # Google Calendar IDs
+    ignorePatterns = config.get('ignorePatterns', [])  # Regex patterns for events to ignore
+    displayTZ, currDate, calStartDatetime, calEndDatetime = display_window(config)
+    try:
+        with span('update', frames=True):
+            # One day further than usual, so the frame from midnight on has all three days
+            eventList = calModule.calHelper.retrieve_events(calendars, calStartDatetime,
+                                                            calEndDatetime + datetime.timedelta(days=1), displayTZ,
+                                                            ignorePatterns)
+
+            now = dt.now(displayTZ)
+            midnight = displayTZ.localize(dt.combine(currDate + datetime.timedelta(days=1), dt.min.time()))
+            boundaries = sorted(set(event['endDatetime'] for event in eventList if not event['allday']
+                                    and not event['isMultiday'] and now < event['endDatetime'] < midnight))
+            frames = []
+            for validFrom in [now] + boundaries + [midnight]:
+                days = calModule.split_days(eventList, validFrom.date(), displayTZ, 3, now=validFrom)
+                frames.append((validFrom, validFrom.date(), [list(day) for day in days]))
+            changed = prerenderer.render(frames, calModule.stale_since(displayTZ))
+    finally:
+        tracer.export()
+    logger.info("Completed dashboard pre-render")
+    return frames[0][2], changed
+
+
+def next_change(allEventList, displayTZ):
+    # The next time the dashboard changes by itself: a timed event is dropped once it has ended, all-day and
+    # multi-day events and the dates move on at midnight
+    now = dt.now(displayTZ)
+    midnight = displayTZ.localize(dt.combine(now.date() + datetime.timedelta(days=1), dt.min.time()))
+    ends = [event['endDatetime'] for day in allEventList for event in day
+            if not event['allday'] and not event['isMultiday'] and event['endDatetime'] > now]
+    return min(ends + [midnight])
+
+
+def events_fingerprint(allEventList):
+    # Identifies the events fetched for the shown days, so the daemon can tell whether the calendars changed
+    # regardless of whether the dashboard was rendered again (without the render cache it always is)
+    digest = hashlib.sha256()
+    for day in allEventList:
+        for event in day:
+            digest.update(repr(sorted(event.items())).encode('utf-8'))
+        digest.update(b'\n')
+    return digest.hexdigest()
+
+
+def run_daemon(config, calModule, renderService, prerenderer=None):
+    # Keep the calendar service and the browser alive. The dashboard is refreshed right after a shown event ends and
+    # at midnight. In between, the calendars are polled for new events, every minRefreshInterval minutes after a
+    # change, backing off to every refreshInterval minutes while nothing changes. With pre-rendering, the frames for
+    # the rest of the day are rendered when polling, and at an event end the next frame is only published.
+    logger = logging.getLogger('maginkdash')
+    refreshInterval = config.get('refreshInterval', 60)  # Maximum minutes between updates in daemon mode
+    minRefreshInterval = config.get('minRefreshInterval', 5)  # Minutes between updates right after a change
+    displayTZ = timezone(config['displayTZ'])
+    logger.info(f"Running as a daemon, polling every {minRefreshInterval} to {refreshInterval} minutes")
+    interval = minRefreshInterval
+    switchOnly = False
+    fingerprint = None  # of the events fetched by the last poll
+    try:
+        while True:
+            boundary = None
+            try:
+                if switchOnly:
+                    # The frame for this moment was rendered ahead of time, it only has to be published
+                    prerenderer.store.publish_due()
+                else:
+                    if prerenderer is not None:
+                        allEventList, _ = prerender_dashboard(config, calModule, prerenderer)
+                    else:
+                        allEventList, _ = update_dashboard(config, calModule, renderService)
+                    previous, fingerprint = fingerprint, events_fingerprint(allEventList)
+                    interval = minRefreshInterval if fingerprint != previous else min(interval * 2, refreshInterval)
+                boundary = next_change(allEventList, displayTZ)
+            except Exception as e:
+                # Keep the daemon running, the next refresh may well succeed
+                logger.exception(f"Dashboard update failed: {str(e)}")
+                interval = min(interval * 2, refreshInterval)
+
+            wait = interval * 60
+            reason = 'poll'
+            if boundary is not None:
+                # A few seconds late, so the event that just ended is really in the past
+                untilBoundary = (boundary - dt.now(displayTZ)).total_seconds() + 5
+                if untilBoundary < wait:
+                    wait = max(untilBoundary, 1)
+                    reason = 'midnight' if boundary.time() == dt.min.time() else 'event end'
+            # At an event end the pre-rendered frame only has to be published, polling renders the frames again
+            switchOnly = prerenderer is not None and reason == 'event end'
+            nextRun = dt.now(displayTZ) + datetime.timedelta(seconds=wait)
+            logger.info(f"Next update at {nextRun.strftime('%H:%M:%S')} ({reason})")
+            time.sleep(wait)
+    finally:
+        renderService.close()
+        if prerenderer is not None:
+            prerenderer.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate the MagInkDash dashboard image.')
+    parser.add_argument('--daemon', action='store_true',
+                        help='keep running and refresh the dashboard periodically, reusing the browser')
+    parser.add_argument('--serve', action='store_true',
+                        help='serve the published image with the built-in web server; on its own it only serves, '
+                             'combine with --daemon to also keep the image updated')
+    parser.add_argument('--batch', nargs='+', metavar='CONFIG',
+                        help='update several dashboards, given as config files or folders of them, in one run')
+    parser.add_argument('--workers', type=int,
+                        help='number of render processes in batch mode (default: one per CPU core)')
+    parser.add_argument('--profile-startup', action='store_true',
+                        help='log the time spent importing each package and setting up before the first update')
+    args = parser.parse_args()
+
+    # The calendar client, the renderer and their dependencies are only imported once it is known they are needed
+    profiler = StartupProfiler()
+    if args.profile_startup:
+        profiler.install()
+
     # Create and configure logger
     logging.basicConfig(filename="logfile.log", format='%(asctime)s %(levelname)s - %(message)s', filemode='a')
     logger = logging.getLogger('maginkdash')
     logger.addHandler(logging.StreamHandler(sys.stdout))  # print logger to stdout
     logger.setLevel(logging.INFO)
-    logger.info("Starting dashboard update")
+
+    if args.batch:
+        with profiler.stage('BatchRunner'):
+            from batch import BatchRunner, load_dashboards
+            runner = BatchRunner(load_dashboards(args.batch), workers=args.workers)
+        if args.profile_startup:
+            profiler.report()
+        try:
+            with span('update', batch=True):
+                results = runner.run()
+        finally:
+            tracer.export()
+            runner.close()
+        # Non-zero when any dashboard failed, so cron or systemd notice
+        sys.exit(0 if len(results) == len(runner.dashboards) else 1)
+
+    # Basic configuration settings (user replaceable)
+    with profiler.stage('config.json'):
+        with open('config.json') as configFile:
+            config = json.load(configFile)
+
+    timeFormat = config.get('timeFormat', 12)  # 12 or 24-hour time format, default to 12 if not specified
+    serverHost = config.get('serverHost', '0.0.0.0')  # Address the built-in web server (--serve) listens on
+    serverPort = config.get('serverPort', 8080)  # Port of the built-in web server (--serve)
+    prerender = config.get('prerender', False)  # Render all of the day's frames ahead of time
+    frameDir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'render', '.cache', 'frames')
+    tracer.configure(spansLog=config.get('spansLog'),  # JSON-lines file the spans of every update are appended to
+                     prometheusTextfile=config.get('prometheusTextfile'),  # Prometheus textfile with the stage totals
+                     dashboard=config.get('name'))
     logger.info(f"Using {'24' if timeFormat == 24 else '12'}-hour time format")
 
-    # Retrieve Calendar Data - get up to 3 days
-    currDate = dt.now(displayTZ).date()
-    calStartDatetime = displayTZ.localize(dt.combine(currDate, dt.min.time()))
-    calEndDatetime = displayTZ.localize(dt.combine(currDate + datetime.timedelta(days=2), dt.max.time()))
-    calModule = GcalModule()
-    allEventList = calModule.get_events(
-        currDate,
-        calendars,
-        calStartDatetime,
-        calEndDatetime,
-        displayTZ,
-        3,
-    )
-
-    # Render Dashboard Image
-    renderService = RenderHelper(imageWidth, imageHeight, timeFormat)
-    renderService.process_inputs(
-        currDate,
-        allEventList,
-        path_to_server_image,
-        ignorePatterns,
-    )
+    imageServer = None
+    if args.serve:
+        from server.imageserver import ImageServer
+        frameStore = None
+        if prerender:
+            # Switch to the next pre-rendered frame as soon as it is due, even if the frames come from a cron job
+            from render.frames import FrameStore
+            frameStore = FrameStore(frameDir, config['path_to_server_image'])
+        imageServer = ImageServer(config['path_to_server_image'], host=serverHost, port=serverPort,
+                                  frameStore=frameStore)
+        imageServer.start()
+        if not args.daemon:
+            try:
+                while True:
+                    time.sleep(3600)
+            except KeyboardInterrupt:
+                imageServer.stop()
+            sys.exit(0)
 
-    # Get absolute path to the generated image
-    absolute_image_path = os.path.abspath(path_to_server_image)
-    logger.info(f"Dashboard image saved to: {absolute_image_path}")
+    with profiler.stage('GcalModule'):
+        from gcal.gcal import GcalModule
+        calModule = GcalModule(**gcal_options(config))
+    with profiler.stage('RenderHelper'):
+        from render.render import RenderHelper
+        renderService = RenderHelper(keepBrowser=args.daemon, **render_options(config))
+    prerenderer = None
+    if prerender:
+        with profiler.stage('FramePrerenderer'):
+            from render.frames import FramePrerenderer
+            prerenderer = FramePrerenderer(render_options(config), frameDir, config['path_to_server_image'])
+    if args.profile_startup:
+        profiler.report()
 
-    logger.info("Completed dashboard update")
\ No newline at end of file
+    if args.daemon:
+        run_daemon(config, calModule, renderService, prerenderer)
+    elif prerenderer is not None:
+        try:
+            prerender_dashboard(config, calModule, prerenderer)
+        finally:
+            prerenderer.close()
+    else:
+        update_dashboard(config, calModule, renderService)
@@ -0,0 +1,47 @@
+"""
+Turns a dashboard config (config.json, or one of the files given to --batch) into the keyword arguments of the
+calendar and render services and the time window to fetch. Shared by main.py and batch.py.
+"""
+
+import datetime
+from datetime import datetime as dt
+from pytz import timezone
+
+
+def gcal_options(config):
+    # Keyword arguments for GcalModule
+    return {
+        'eventStore': config.get('eventStore', False),  # Sync events incrementally into a local database
+        'fetchWorkers': config.get('fetchWorkers', 4),  # Number of calendars fetched at the same time
+        'fetchTimeout': config.get('fetchTimeout', 30),  # Seconds allowed for fetching one calendar
+        'eventCache': config.get('eventCache'),  # Fall back to the last good events, e.g. ttl, budget and maxAge
+    }
+
+
+def render_options(config):
+    # Keyword arguments for RenderHelper
+    return {
+        'width': config['imageWidth'],  # Width of image to be generated for display.
+        'height': config['imageHeight'],  # Height of image to be generated for display.
+        'timeFormat': config.get('timeFormat', 12),  # 12 or 24-hour time format, default to 12 if not specified
+        'browserOptions': config.get('browser', {}),  # Browser recycling limits, e.g. maxRenders and maxMemoryMB
+        'screenshotOptions': config.get('screenshot', {}),  # Backend choice, e.g. budget, failureThreshold, cooldown
+        'useCache': config.get('renderCache', True),  # Skip rendering when the dashboard has not changed
+        'backend': config.get('renderBackend', 'browser'),  # 'browser' (screenshot) or 'pillow' (no browser needed)
+        'grayLevels': config.get('grayLevels', 8),  # Gray levels of the published image, 0 to keep full color
+        'dither': config.get('dither', 'none'),  # 'none', 'ordered' or 'floyd-steinberg'
+        'framebuffer': config.get('framebuffer', False),  # Also publish a raw packed framebuffer for the Inkplate
+        'framebufferRLE': config.get('framebufferRLE', True),  # Run-length encode the framebuffer
+        'partialUpdates': config.get('partialUpdates'),  # Publish changed tiles, e.g. tileSize and maxPartialUpdates
+        'inlineAssets': config.get('inlineAssets', True),  # Inline the used CSS and font subsets into the page
+        'outputs': config.get('outputs'),  # Extra panels scaled from the same render, e.g. path, width and height
+    }
+
+
+def display_window(config):
+    # Today's date in the display timezone and the time window covering the three days shown
+    displayTZ = timezone(config['displayTZ'])  # list of timezones - print(pytz.all_timezones)
+    currDate = dt.now(displayTZ).date()
+    calStartDatetime = displayTZ.localize(dt.combine(currDate, dt.min.time()))
+    calEndDatetime = displayTZ.localize(dt.combine(currDate + datetime.timedelta(days=2), dt.max.time()))
+    return displayTZ, currDate, calStartDatetime, calEndDatetime
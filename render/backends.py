@@ -0,0 +1,154 @@
+"""
+Picks the screenshot backend for the browser render: the kept Selenium session, a direct headless Chromium or
+headless Firefox. Instead of always trying them in that order, each one's latency and success rate are kept as moving
+averages in a JSON file shared by all dashboards on the machine, and every capture tries the backend with the lowest
+expected time to a good screenshot first (its latency divided by its success rate).
+
+A backend that fails failureThreshold times in a row is put in a cooldown (circuit breaker), which doubles each time
+it trips again, up to maxCooldown. A backend cooling down is only tried as a last resort, once every other one has
+failed. One time budget covers the whole capture: each attempt gets what is left of it, so a broken chromedriver
+costs at most that budget and not a timeout per backend.
+
+Batch workers and frame pre-render workers record to the same file from other processes, so every update reads,
+changes and rewrites it under an exclusive file lock.
+"""
+
+from contextlib import contextmanager
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+
+# Weight of the newest capture in the moving averages
+SMOOTHING = 0.3
+# An attempt with less time than this left is not worth starting
+MIN_ATTEMPT_SECONDS = 2
+
+
+class BackendSelector:
+
+    def __init__(self, statsPath, budget=90, failureThreshold=3, cooldown=600, maxCooldown=86400):
+        self.logger = logging.getLogger('maginkdash')
+        self.statsPath = statsPath
+        self.budget = budget  # seconds for the whole capture, over all backends tried
+        self.failureThreshold = failureThreshold  # failures in a row that put a backend in cooldown
+        self.cooldown = cooldown  # seconds of the first cooldown, doubled every time it trips again
+        self.maxCooldown = maxCooldown
+        self.lock = threading.Lock()
+
+    def load(self):
+        # Re-read on every capture, other processes rendering other dashboards update the same file
+        try:
+            with open(self.statsPath, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    @contextmanager
+    def locked(self):
+        # Held across the read, change and write of an update, by the threads of this process and by other processes
+        with self.lock:
+            try:
+                os.makedirs(os.path.dirname(self.statsPath), exist_ok=True)
+                lockFile = open(self.statsPath + '.lock', 'a')
+            except OSError as e:
+                self.logger.error(f"Could not lock the screenshot backend stats: {str(e)}")
+                lockFile = None
+            try:
+                if lockFile is not None:
+                    fcntl.flock(lockFile, fcntl.LOCK_EX)
+                yield
+            finally:
+                # Closing the file releases the lock
+                if lockFile is not None:
+                    lockFile.close()
+
+    def record(self, backend, succeeded, seconds):
+        with self.locked():
+            stats = self.load()
+            entry = stats.setdefault(backend, {'attempts': 0, 'successRate': None, 'latency': None, 'failures': 0,
+                                               'trips': 0, 'cooldownUntil': 0})
+            entry['attempts'] += 1
+            outcome = 1.0 if succeeded else 0.0
+            entry['successRate'] = outcome if entry['successRate'] is None else \
+                (1 - SMOOTHING) * entry['successRate'] + SMOOTHING * outcome
+            if succeeded:
+                entry['latency'] = seconds if entry['latency'] is None else \
+                    (1 - SMOOTHING) * entry['latency'] + SMOOTHING * seconds
+                entry['failures'] = 0
+                entry['trips'] = 0
+                entry['cooldownUntil'] = 0
+            else:
+                entry['failures'] += 1
+                if entry['failures'] >= self.failureThreshold:
+                    cooldown = min(self.cooldown * 2 ** entry['trips'], self.maxCooldown)
+                    entry['cooldownUntil'] = time.time() + cooldown
+                    entry['trips'] += 1
+                    entry['failures'] = 0
+                    self.logger.warning(f"Screenshot backend {backend} failed {self.failureThreshold} times in a row, "
+                                        f"not using it for {cooldown:.0f}s.")
+            try:
+                tmpFile = f'{self.statsPath}.{os.getpid()}.tmp'
+                with open(tmpFile, 'w') as f:
+                    json.dump(stats, f, indent=2)
+                os.replace(tmpFile, self.statsPath)
+            except OSError as e:
+                self.logger.error(f"Could not save the screenshot backend stats: {str(e)}")
+
+    def order(self, backends, stats):
+        # Healthy backends by expected time to a good capture, then the ones without a success yet in the preferred
+        # order, then the ones cooling down, the soonest to recover first
+        now = time.time()
+
+        def key(backend):
+            entry = stats.get(backend, {})
+            if entry.get('cooldownUntil', 0) > now:
+                return (2, entry['cooldownUntil'])
+            if entry.get('latency') is None:
+                # Backends not tried yet go before the ones that never worked
+                return (1, entry.get('attempts', 0) > 0, backends.index(backend))
+            return (0, entry['latency'] / max(entry['successRate'], 0.05))
+        return sorted(backends, key=key)
+
+    def describe(self, backend, stats):
+        entry = stats.get(backend)
+        if entry is None or not entry['attempts']:
+            return f"{backend} (untried)"
+        if entry['cooldownUntil'] > time.time():
+            return f"{backend} (cooling down for {entry['cooldownUntil'] - time.time():.0f}s)"
+        latency = f"{entry['latency']:.1f}s" if entry['latency'] is not None else 'no success yet'
+        return f"{backend} ({latency}, {100 * entry['successRate']:.0f}% ok)"
+
+    def capture(self, captures):
+        # captures maps each backend, in the preferred order while nothing is known about them, to a function taking
+        # the seconds it may use. Returns the backend that succeeded, or raises once all have failed or the budget is
+        # used up.
+        stats = self.load()
+        order = self.order(list(captures), stats)
+        self.logger.info('Screenshot backends: ' + ', '.join(self.describe(backend, stats) for backend in order))
+        deadline = time.monotonic() + self.budget
+        tried = []
+        lastError = None
+        for backend in order:
+            remaining = deadline - time.monotonic()
+            if remaining < MIN_ATTEMPT_SECONDS:
+                break
+            start = time.monotonic()
+            try:
+                captures[backend](remaining)
+            except Exception as e:
+                seconds = time.monotonic() - start
+                self.logger.error(f"Screenshot with {backend} failed after {seconds:.1f}s: {str(e)}")
+                self.record(backend, False, seconds)
+                tried.append(backend)
+                lastError = e
+                continue
+            seconds = time.monotonic() - start
+            self.record(backend, True, seconds)
+            self.logger.info(f"Screenshot captured with {backend} in {seconds:.1f}s"
+                             + (f" after {', '.join(tried)} failed." if tried else '.'))
+            return backend
+        raise RuntimeError(f"No screenshot within the {self.budget}s budget, tried "
+                           f"{', '.join(tried) or 'nothing'}") from lastError
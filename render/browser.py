@@ -0,0 +1,246 @@
+"""
+Keeps a headless Chrome session alive between renders. Starting Chrome is by far the slowest part of an update on a
+Raspberry Pi, so when the dashboard is refreshed from a long-running process (see the daemon mode in main.py) the same
+browser is reused and each render only costs a page load and a capture.
+
+The session is health-checked before every render and restarted if it stopped responding. It is also recycled after
+a number of renders or when the browser's memory use grows past a threshold, since long-lived Chrome instances tend
+to leak.
+"""
+
+from selenium import webdriver
+from selenium.webdriver.chrome.options import Options
+from selenium.webdriver.chrome.service import Service
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support.ui import WebDriverWait
+from selenium.common.exceptions import TimeoutException
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+import logging
+import os
+import signal
+import subprocess
+import time
+from tracing import span
+
+
+def find_chromedriver(logger):
+    # Try to automatically locate chromedriver
+    try:
+        chromedriver_path = subprocess.check_output(['which', 'chromedriver']).decode('utf-8').strip()
+        logger.info(f"Found chromedriver at: {chromedriver_path}")
+        return chromedriver_path
+    except (subprocess.SubprocessError, FileNotFoundError):
+        pass
+
+    # Default paths to try if 'which' command fails
+    possible_paths = [
+        '/usr/bin/chromedriver',
+        '/usr/local/bin/chromedriver',
+        '/usr/lib/chromium-browser/chromedriver'
+    ]
+    for path in possible_paths:
+        if os.path.exists(path) and os.access(path, os.X_OK):
+            logger.info(f"Found chromedriver at default location: {path}")
+            return path
+
+    logger.error("Could not find chromedriver. Please install it with 'sudo apt-get install chromium-chromedriver'")
+    raise FileNotFoundError("chromedriver executable not found in PATH")
+
+
+def process_tree(root_pid):
+    # Return the PID of a process and all of its descendants, using /proc (Linux only)
+    children = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat', 'r') as f:
+                # The command name is wrapped in parentheses and may itself contain spaces
+                ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+
+    pids = []
+    stack = [root_pid]
+    while stack:
+        pid = stack.pop()
+        pids.append(pid)
+        stack.extend(children.get(pid, []))
+    return pids
+
+
+def rss_mb(pids):
+    # Sum the resident memory of the given processes, in MB
+    total_kb = 0
+    for pid in pids:
+        try:
+            with open(f'/proc/{pid}/status', 'r') as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        total_kb += int(line.split()[1])
+                        break
+        except (OSError, ValueError):
+            continue
+    return total_kb / 1024
+
+
+class BrowserSession:
+
+    def __init__(self, width, height, logPath, maxRenders=50, maxMemoryMB=600, healthTimeout=10, pageLoadTimeout=60,
+                 readyTimeout=15):
+        self.logger = logging.getLogger('maginkdash')
+        self.imageWidth = width
+        self.imageHeight = height
+        self.logPath = logPath
+        self.maxRenders = maxRenders  # recycle the browser after this many renders (0 to disable)
+        self.maxMemoryMB = maxMemoryMB  # recycle the browser once its process tree uses more memory (0 to disable)
+        self.healthTimeout = healthTimeout  # seconds to wait for the browser to answer a health check
+        self.pageLoadTimeout = pageLoadTimeout
+        self.readyTimeout = readyTimeout  # seconds to wait for the page to signal it is ready to be captured
+        self.driver = None
+        self.driverPid = None
+        self.renderCount = 0
+        self.viewportSize = None
+
+    def start(self):
+        opts = Options()
+        opts.add_argument("--headless=new")
+        opts.add_argument("--no-sandbox")
+        opts.add_argument("--disable-dev-shm-usage")
+        opts.add_argument("--hide-scrollbars")
+        opts.add_argument("--disable-gpu")
+        opts.add_argument("--remote-debugging-pipe")
+        opts.add_argument(f"--window-size={self.imageWidth},{self.imageHeight}")
+        opts.add_argument('--force-device-scale-factor=1')
+
+        service = Service(find_chromedriver(self.logger), log_output=self.logPath)
+        with span('browser_start'):
+            self.driver = webdriver.Chrome(service=service, options=opts)
+        self.driver.set_page_load_timeout(self.pageLoadTimeout)
+        self.driverPid = service.process.pid if service.process else None
+        self.renderCount = 0
+        self.viewportSize = None
+        self.logger.info('Started headless Chrome session.')
+
+    def quit(self):
+        if self.driver is None:
+            return
+        try:
+            self.driver.quit()
+        except Exception as e:
+            self.logger.warning(f"Error while closing browser, killing it instead: {str(e)}")
+            self.kill()
+        self.driver = None
+        self.driverPid = None
+
+    def kill(self):
+        # Used when the browser is hung and no longer answers webdriver commands
+        if self.driverPid:
+            for pid in reversed(process_tree(self.driverPid)):
+                try:
+                    os.kill(pid, signal.SIGKILL)
+                except OSError:
+                    pass
+        self.driver = None
+        self.driverPid = None
+
+    def memory_mb(self):
+        if not self.driverPid or not os.path.isdir('/proc'):
+            return 0
+        return rss_mb(process_tree(self.driverPid))
+
+    def is_healthy(self):
+        # Run a trivial script in a worker thread so a hung browser cannot block us past healthTimeout
+        executor = ThreadPoolExecutor(max_workers=1)
+        future = executor.submit(self.driver.execute_script, 'return 1;')
+        try:
+            return future.result(timeout=self.healthTimeout) == 1
+        except FutureTimeoutError:
+            self.logger.warning(f"Browser did not answer a health check within {self.healthTimeout}s.")
+            return False
+        except Exception as e:
+            self.logger.warning(f"Browser health check failed: {str(e)}")
+            return False
+        finally:
+            executor.shutdown(wait=False)
+
+    def needs_recycle(self):
+        if self.maxRenders and self.renderCount >= self.maxRenders:
+            self.logger.info(f"Recycling browser after {self.renderCount} renders.")
+            return True
+        memory = self.memory_mb()
+        if self.maxMemoryMB and memory > self.maxMemoryMB:
+            self.logger.info(f"Recycling browser using {memory:.0f} MB (limit {self.maxMemoryMB} MB).")
+            return True
+        return False
+
+    def ensure_ready(self):
+        if self.driver is not None:
+            if not self.is_healthy():
+                self.logger.warning('Restarting unresponsive browser.')
+                self.kill()
+            elif self.needs_recycle():
+                self.quit()
+        if self.driver is None:
+            self.start()
+
+    def set_viewport_size(self, width, height):
+        # Extract the current window size from the driver
+        current_window_size = self.driver.get_window_size()
+
+        # Extract the client window size from the html tag
+        html = self.driver.find_element(By.TAG_NAME, 'html')
+        inner_width = int(html.get_attribute("clientWidth"))
+        inner_height = int(html.get_attribute("clientHeight"))
+
+        # "Internal width you want to set+Set "outer frame width" to window size
+        target_width = width + (current_window_size["width"] - inner_width)
+        target_height = height + (current_window_size["height"] - inner_height)
+
+        self.driver.set_window_rect(
+            width=target_width,
+            height=target_height)
+        self.viewportSize = (width, height)
+
+    def wait_until_ready(self, load_time):
+        # dashboard_template.html sets window.dashboardReady once fonts are loaded, layout has settled and the
+        # event titles have been shrunk to fit. Capture anyway if that doesn't happen within readyTimeout.
+        wait_start = time.monotonic()
+        try:
+            WebDriverWait(self.driver, self.readyTimeout, poll_frequency=0.05).until(
+                lambda d: d.execute_script('return window.dashboardReady === true;'))
+        except TimeoutException:
+            self.logger.warning(f"Page did not signal it was ready within {self.readyTimeout}s, capturing anyway.")
+        wait_time = time.monotonic() - wait_start
+
+        timings = self.driver.execute_script('return window.dashboardTimings || {};') or {}
+        stages = []
+        previous = 0
+        for stage in ('dom', 'fonts', 'layout', 'fit'):
+            if stage in timings:
+                stages.append(f"{stage} {timings[stage] - previous}ms")
+                previous = timings[stage]
+        self.logger.info(f"Page loaded in {load_time * 1000:.0f}ms, ready after a further {wait_time * 1000:.0f}ms"
+                         + (f" ({', '.join(stages)})" if stages else ''))
+
+    def capture(self, url, outputPath, width=None, height=None):
+        width = width or self.imageWidth
+        height = height or self.imageHeight
+        self.ensure_ready()
+        try:
+            if self.viewportSize != (width, height):
+                self.set_viewport_size(width, height)
+            with span('page_load'):
+                load_start = time.monotonic()
+                self.driver.get(url)
+                self.wait_until_ready(time.monotonic() - load_start)
+            with span('capture', backend='browser') as record:
+                self.driver.get_screenshot_as_file(outputPath)
+                record['bytes'] = os.path.getsize(outputPath)
+            self.renderCount += 1
+        except Exception:
+            # Don't reuse a browser that just failed, the next capture starts a fresh one
+            self.kill()
+            raise
+
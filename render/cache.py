@@ -0,0 +1,106 @@
+"""
+Remembers the last rendered dashboard so an unchanged dashboard doesn't need a browser at all. Every file the render
+published (image, framebuffer, partial update manifest and tiles, extra outputs) is kept, so they are restored
+together and always match. The cache key is a
+hash of the final HTML together with every stylesheet, font and image it references, so editing the template, the
+CSS or a font invalidates it just like a new event does.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+
+ASSET_ATTR_RE = re.compile(r'(?:href|src)="([^"]+)"')
+CSS_URL_RE = re.compile(r'url\(\s*[\'"]?([^\'")]+)[\'"]?\s*\)')
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 16), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def is_local(ref):
+    return not re.match(r'^(?:[a-z]+:|//|#)', ref, re.IGNORECASE) or ref.startswith('file:')
+
+
+def find_assets(html, baseDir):
+    # Collect the local files referenced by the page, following url() references inside stylesheets
+    assets = []
+    pending = [(ref, baseDir) for ref in ASSET_ATTR_RE.findall(html)]
+    while pending:
+        ref, relativeTo = pending.pop(0)
+        if not is_local(ref):
+            continue
+        path = os.path.normpath(os.path.join(relativeTo, ref.replace('file://', '').split('?')[0].split('#')[0]))
+        if path in assets or not os.path.isfile(path):
+            continue
+        assets.append(path)
+        if path.endswith('.css'):
+            with open(path, 'r') as f:
+                pending.extend((url, os.path.dirname(path)) for url in CSS_URL_RE.findall(f.read()))
+    return sorted(assets)
+
+
+class RenderCache:
+
+    def __init__(self, cacheDir):
+        self.logger = logging.getLogger('maginkdash')
+        self.cacheDir = cacheDir
+        self.stateFile = os.path.join(cacheDir, 'render.json')
+
+    def compute_key(self, html, baseDir, *extra):
+        # extra holds anything else that changes the output, such as the image size
+        digest = hashlib.sha256(html.encode('utf-8'))
+        for value in extra:
+            digest.update(repr(value).encode('utf-8'))
+        for path in find_assets(html, baseDir):
+            digest.update(os.path.relpath(path, baseDir).encode('utf-8'))
+            digest.update(file_hash(path).encode('utf-8'))
+        return digest.hexdigest()
+
+    def load_state(self):
+        try:
+            with open(self.stateFile, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def is_current(self, key, files):
+        # Returns True if the last render used the same inputs and every file it published is cached. Republishes
+        # the cached copies of any published file that is missing or was changed by something else, so the image,
+        # the framebuffer and the partial update manifest and tiles always belong to the same render.
+        state = self.load_state()
+        cached = state.get('files', {})  # published path -> {'copy': file in cacheDir, 'hash': ...}
+        if state.get('key') != key or any(os.path.abspath(path) not in cached for path in files):
+            return False
+        if not all(os.path.exists(os.path.join(self.cacheDir, entry['copy'])) for entry in cached.values()):
+            return False
+
+        stale = [path for path, entry in cached.items()
+                 if not os.path.exists(path) or file_hash(path) != entry['hash']]
+        if stale:
+            self.logger.info(f"Restoring {len(stale)} published files from the render cache.")
+        for path in stale:
+            tmpFile = path + '.tmp'
+            shutil.copyfile(os.path.join(self.cacheDir, cached[path]['copy']), tmpFile)
+            os.replace(tmpFile, path)
+        return True
+
+    def store(self, key, files):
+        # Keep a copy of every file the render published
+        os.makedirs(self.cacheDir, exist_ok=True)
+        cached = {}
+        for i, path in enumerate(files):
+            copy = f'last-{i}{os.path.splitext(path)[1]}'
+            shutil.copyfile(path, os.path.join(self.cacheDir, copy))
+            cached[os.path.abspath(path)] = {'copy': copy, 'hash': file_hash(path)}
+        tmpFile = self.stateFile + '.tmp'
+        with open(tmpFile, 'w') as f:
+            json.dump({'key': key, 'files': cached}, f)
+        os.replace(tmpFile, self.stateFile)
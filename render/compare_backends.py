@@ -0,0 +1,76 @@
+"""
+Golden-image check for the Pillow renderer: renders the same sample dashboard with the browser and with Pillow and
+reports how much the two images differ. The browser output is the reference. Run it from the project folder after
+changing the template, the stylesheets or pillow_renderer.py:
+
+    python3 -m render.compare_backends
+
+The images and a difference map are written to render/.cache/compare/. The exit status is non-zero when more than
+--threshold percent of the pixels differ noticeably.
+"""
+
+import argparse
+import datetime
+import logging
+import os
+import sys
+from PIL import Image, ImageChops
+from pytz import timezone
+from render.render import RenderHelper
+
+
+def sample_events(currDate, displayTZ):
+    def event(summary, day, hour, minute, hours=1, allday=False, multiday=False):
+        start = displayTZ.localize(datetime.datetime.combine(currDate + datetime.timedelta(days=day),
+                                                             datetime.time(hour, minute)))
+        return {'summary': summary, 'allday': allday, 'isMultiday': multiday, 'startDatetime': start,
+                'endDatetime': start + datetime.timedelta(hours=hours), 'updatedDatetime': start}
+
+    today = [event('Conference 🎤', 0, 0, 0, hours=48, multiday=True),
+             event('Standup', 0, 9, 30),
+             event('Lunch with the product team at the new place downtown', 0, 12, 0)]
+    today += [event(f'Review session {i}', 0, 13 + i % 8, 15 * (i % 4)) for i in range(8)]
+    tomorrow = [event('Conference 🎤', 0, 0, 0, hours=48, multiday=True), event('Dentist 🦷', 1, 8, 0)]
+    return [today, tomorrow, []]
+
+
+def compare(referencePath, candidatePath, diffPath, tolerance):
+    reference = Image.open(referencePath).convert('L')
+    candidate = Image.open(candidatePath).convert('L')
+    if candidate.size != reference.size:
+        candidate = candidate.resize(reference.size)
+    diff = ImageChops.difference(reference, candidate)
+    diff.point(lambda v: 0 if v > tolerance else 255).save(diffPath)
+
+    histogram = diff.histogram()
+    pixels = reference.width * reference.height
+    differing = sum(histogram[tolerance + 1:])
+    meanError = sum(value * count for value, count in enumerate(histogram)) / pixels
+    return 100 * differing / pixels, meanError
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare the Pillow renderer against the browser.')
+    parser.add_argument('--threshold', type=float, default=3.0,
+                        help='maximum percentage of pixels allowed to differ (default 3)')
+    parser.add_argument('--tolerance', type=int, default=64,
+                        help='gray level difference below which pixels count as equal (default 64)')
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(levelname)s - %(message)s', level=logging.INFO)
+    displayTZ = timezone('UTC')
+    currDate = datetime.date(2024, 3, 15)
+    events = sample_events(currDate, displayTZ)
+
+    outputDir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache', 'compare')
+    os.makedirs(outputDir, exist_ok=True)
+    paths = {}
+    for backend in ('browser', 'pillow'):
+        paths[backend] = os.path.join(outputDir, backend + '.png')
+        renderer = RenderHelper(1200, 825, useCache=False, backend=backend, grayLevels=0)
+        renderer.process_inputs(currDate, [list(day) for day in events], paths[backend])
+
+    differing, meanError = compare(paths['browser'], paths['pillow'], os.path.join(outputDir, 'diff.png'),
+                                   args.tolerance)
+    print(f"{differing:.2f}% of pixels differ (mean absolute error {meanError:.2f}), see {outputDir}")
+    sys.exit(0 if differing <= args.threshold else 1)
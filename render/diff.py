@@ -0,0 +1,124 @@
+"""
+Works out which parts of the dashboard changed since the previously published frame, so the display only has to
+download those. The frame is split into tiles, the changed tiles are found with one vectorized comparison and merged
+into rectangles, and each rectangle is written as a small framebuffer file (see framebuffer.py). A JSON manifest next
+to the image lists them:
+
+    {"frame": 12, "base": 11, "full": false, "width": 1200, "height": 825, "image": "maginkdash.fb",
+     "tiles": [{"x": 0, "y": 200, "w": 400, "h": 80, "file": "maginkdash.12.0.fb"}]}
+
+A device that shows frame "base" can apply the tiles to get to "frame". Anything else, or "full": true, means
+downloading the whole framebuffer. A full frame is also forced every maxPartialUpdates frames to clear ghosting.
+"""
+
+import glob
+import json
+import logging
+import numpy as np
+import os
+from render.framebuffer import write_framebuffer
+
+
+def changed_tiles(previous, current, tileSize):
+    # Boolean grid with one entry per tile, True where any pixel differs
+    height, width = current.shape
+    rows = -(-height // tileSize)
+    cols = -(-width // tileSize)
+    changed = np.zeros((rows * tileSize, cols * tileSize), dtype=bool)
+    changed[:height, :width] = previous != current
+    return changed.reshape(rows, tileSize, cols, tileSize).any(axis=(1, 3))
+
+
+def merge_tiles(tiles):
+    # Merge changed tiles into rectangles: runs of tiles within a row, then identical runs in consecutive rows
+    rects = []
+    openRuns = {}
+    for row in range(tiles.shape[0]):
+        padded = np.concatenate(([False], tiles[row], [False]))
+        edges = np.flatnonzero(padded[1:] != padded[:-1])
+        runs = list(zip(edges[0::2], edges[1::2]))
+        stillOpen = {}
+        for run in runs:
+            if run in openRuns:
+                rect = openRuns[run]
+                rect[3] += 1
+            else:
+                rect = [run[0], row, run[1] - run[0], 1]
+                rects.append(rect)
+            stillOpen[run] = rect
+        openRuns = stillOpen
+    return rects
+
+
+class FrameDiffer:
+
+    def __init__(self, cacheDir, tileSize=40, maxPartialUpdates=6, maxChangedFraction=0.5):
+        self.logger = logging.getLogger('maginkdash')
+        self.cacheDir = cacheDir
+        self.stateFile = os.path.join(cacheDir, 'frames.json')
+        self.previousFile = os.path.join(cacheDir, 'previous-frame.npy')
+        # Tiles must start on whole bytes of the 4-bit framebuffer, so the size is kept even
+        self.tileSize = tileSize + tileSize % 2
+        self.maxPartialUpdates = maxPartialUpdates  # force a full frame after this many partial ones
+        self.maxChangedFraction = maxChangedFraction  # send a full frame when more than this share changed
+
+    def load_state(self):
+        try:
+            with open(self.stateFile, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {'frame': 0, 'partials': 0}
+
+    def publish(self, indices, path_to_server_image, levels):
+        os.makedirs(self.cacheDir, exist_ok=True)
+        state = self.load_state()
+        frame = state['frame'] + 1
+        stem = os.path.splitext(path_to_server_image)[0]
+        outputDir = os.path.dirname(os.path.abspath(path_to_server_image))
+        height, width = indices.shape
+
+        previous = None
+        if os.path.exists(self.previousFile):
+            previous = np.load(self.previousFile)
+            if previous.shape != indices.shape:
+                previous = None
+
+        manifest = {'frame': frame, 'base': state['frame'] or None, 'full': True, 'width': width, 'height': height,
+                    'image': os.path.basename(stem) + '.fb', 'tiles': []}
+        partials = 0
+        if previous is not None and state['partials'] < self.maxPartialUpdates:
+            tiles = changed_tiles(previous, indices, self.tileSize)
+            if tiles.mean() <= self.maxChangedFraction:
+                manifest['full'] = False
+                partials = state['partials'] + 1
+                for i, (tx, ty, tw, th) in enumerate(merge_tiles(tiles)):
+                    x, y = int(tx * self.tileSize), int(ty * self.tileSize)
+                    w, h = int(min(tw * self.tileSize, width - x)), int(min(th * self.tileSize, height - y))
+                    tileName = f"{os.path.basename(stem)}.{frame}.{i}.fb"
+                    write_framebuffer(indices[y:y + h, x:x + w], os.path.join(outputDir, tileName), levels)
+                    manifest['tiles'].append({'x': x, 'y': y, 'w': w, 'h': h, 'file': tileName})
+
+        tmpFile = stem + '.json.tmp'
+        with open(tmpFile, 'w') as f:
+            json.dump(manifest, f)
+        os.replace(tmpFile, stem + '.json')
+
+        # Keep the tiles of the previous frame for a device that is downloading them right now
+        for oldTile in glob.glob(glob.escape(stem) + '.*.*.fb'):
+            oldFrame = os.path.basename(oldTile)[len(os.path.basename(stem)) + 1:].split('.')[0]
+            if oldFrame.isdigit() and int(oldFrame) < frame - 1:
+                os.remove(oldTile)
+
+        np.save(self.previousFile + '.tmp.npy', indices)
+        os.replace(self.previousFile + '.tmp.npy', self.previousFile)
+        with open(self.stateFile + '.tmp', 'w') as f:
+            json.dump({'frame': frame, 'partials': partials}, f)
+        os.replace(self.stateFile + '.tmp', self.stateFile)
+
+        if manifest['full']:
+            self.logger.info(f"Frame {frame}: full update")
+        else:
+            changedArea = sum(tile['w'] * tile['h'] for tile in manifest['tiles'])
+            self.logger.info(f"Frame {frame}: {len(manifest['tiles'])} changed tiles covering "
+                             f"{100 * changedArea / (width * height):.1f}% of the frame")
+        return manifest
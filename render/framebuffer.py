@@ -0,0 +1,74 @@
+"""
+Writes the dashboard as a raw framebuffer that the Inkplate can copy straight into its display buffer, skipping the
+PNG decoding on the ESP32. The file layout, all integers little-endian:
+
+    offset  size  field
+    0       4     magic "IPFB"
+    4       1     format version (1)
+    5       1     flags, bit 0 set when the pixel data is run-length encoded
+    6       2     width in pixels
+    8       2     height in pixels
+    10      4     length of the pixel data that follows, in bytes
+
+The pixel data holds the rows from top to bottom, 4 bits per pixel and two pixels per byte, the left pixel in the
+high nibble. A row with an odd width is padded with one white pixel. Values are the panel's gray levels, 0 is black
+and 7 is white in 3-bit mode. When RLE is enabled the data is a sequence of (count, byte) pairs, count 1 to 255,
+each expanding to count copies of the packed byte.
+"""
+
+import numpy as np
+import os
+import struct
+
+MAGIC = b'IPFB'
+VERSION = 1
+FLAG_RLE = 0x01
+HEADER = struct.Struct('<4sBBHHI')
+
+
+def pack_pixels(indices, padValue):
+    # Pack a 2D array of levels (0-15) into 4-bit pixels, two per byte
+    height, width = indices.shape
+    if width % 2:
+        indices = np.hstack([indices, np.full((height, 1), padValue, dtype=indices.dtype)])
+    indices = indices.astype(np.uint8)
+    return ((indices[:, 0::2] << 4) | (indices[:, 1::2] & 0x0F)).ravel()
+
+
+def rle_encode(data):
+    # Encode a 1D uint8 array as (count, byte) pairs, without a Python loop over the bytes
+    if data.size == 0:
+        return np.empty(0, dtype=np.uint8)
+    starts = np.concatenate(([0], np.flatnonzero(data[1:] != data[:-1]) + 1))
+    lengths = np.diff(np.concatenate((starts, [data.size])))
+    values = data[starts]
+
+    # Runs longer than 255 bytes are split into several pairs
+    chunks = (lengths + 254) // 255
+    counts = np.full(chunks.sum(), 255, dtype=np.int64)
+    lastChunk = np.cumsum(chunks) - 1
+    counts[lastChunk] = lengths - 255 * (chunks - 1)
+
+    encoded = np.empty(2 * counts.size, dtype=np.uint8)
+    encoded[0::2] = counts
+    encoded[1::2] = np.repeat(values, chunks)
+    return encoded
+
+
+def write_framebuffer(indices, path, levels=8, rle=True):
+    height, width = indices.shape
+    payload = pack_pixels(indices, levels - 1)
+    flags = 0
+    if rle:
+        encoded = rle_encode(payload)
+        # Busy, noisy images (heavy dithering) can come out larger, in which case store them raw
+        if encoded.size < payload.size:
+            payload = encoded
+            flags |= FLAG_RLE
+
+    tmpFile = path + '.tmp'
+    with open(tmpFile, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, flags, width, height, payload.size))
+        f.write(payload.tobytes())
+    os.replace(tmpFile, path)
+    return payload.size + HEADER.size
@@ -0,0 +1,146 @@
+"""
+Pre-rendered frames. Once the events are known, the dashboard only changes by itself when a shown event ends (it is
+dropped) and at midnight (the days move on). FramePrerenderer renders every frame for the rest of the day in one go,
+on a pool of worker processes, and FrameStore keeps them on disk indexed by the time from which each one is valid:
+
+    render/.cache/frames/index.json          {"generation": 3, "frames": [1710489600, 1710493200, ...]}
+    render/.cache/frames/3/1710493200/       maginkdash.png, maginkdash.fb, ... as published for that frame
+
+Publishing a frame copies its files into place atomically. It happens right after rendering for the frame that is
+valid now, and later whenever publish_due() is called: by the daemon at each boundary, and by the built-in image
+server before it answers a request, so the display gets the right frame without any rendering at that moment.
+"""
+
+from concurrent.futures import wait
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from datetime import datetime
+from render.pool import create_pool, render_dashboard
+from tracing import tracer
+
+
+class FrameStore:
+
+    def __init__(self, frameDir, path_to_server_image):
+        self.logger = logging.getLogger('maginkdash')
+        self.frameDir = frameDir
+        self.indexFile = os.path.join(frameDir, 'index.json')
+        self.path_to_server_image = path_to_server_image
+        self.lock = threading.Lock()
+
+    def load_index(self):
+        try:
+            with open(self.indexFile, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {'generation': 0, 'frames': [], 'published': None, 'inputs': None}
+
+    def save_index(self, index):
+        os.makedirs(self.frameDir, exist_ok=True)
+        tmpFile = self.indexFile + '.tmp'
+        with open(tmpFile, 'w') as f:
+            json.dump(index, f)
+        os.replace(tmpFile, self.indexFile)
+
+    def generation_dir(self, generation):
+        return os.path.join(self.frameDir, str(generation))
+
+    def frame_path(self, generation, validFrom):
+        # Where a frame is published to while it is being rendered
+        return os.path.join(self.generation_dir(generation), str(validFrom),
+                            os.path.basename(self.path_to_server_image))
+
+    def replace(self, generation, frames, inputs):
+        # Switch to a fully rendered generation of frames in one step, then remove the older generations. The one
+        # just replaced is kept until the next switch: a --serve process may have read the old index and still be
+        # copying from it, which the lock doesn't prevent across processes.
+        with self.lock:
+            previous = self.load_index()['generation']
+            self.save_index({'generation': generation, 'frames': sorted(frames), 'published': None,
+                             'inputs': inputs})
+        for name in os.listdir(self.frameDir):
+            if name.isdigit() and int(name) not in (generation, previous):
+                shutil.rmtree(os.path.join(self.frameDir, name), ignore_errors=True)
+
+    def publish_due(self, now=None):
+        # Publish the frame valid at the given time, unless it already is. Returns True if a frame was published.
+        now = time.time() if now is None else now
+        with self.lock:
+            index = self.load_index()
+            due = [validFrom for validFrom in index['frames'] if validFrom <= now]
+            if not due or due[-1] == index['published']:
+                return False
+            validFrom = due[-1]
+            sourceDir = os.path.dirname(self.frame_path(index['generation'], validFrom))
+            outputDir = os.path.dirname(os.path.abspath(self.path_to_server_image))
+            for name in sorted(os.listdir(sourceDir)):
+                tmpFile = os.path.join(outputDir, name + '.tmp')
+                shutil.copyfile(os.path.join(sourceDir, name), tmpFile)
+                os.replace(tmpFile, os.path.join(outputDir, name))
+            index['published'] = validFrom
+            self.save_index(index)
+        self.logger.info(f"Published the frame valid from {datetime.fromtimestamp(validFrom).strftime('%H:%M:%S')}.")
+        return True
+
+    def next_switch(self, now=None):
+        # Time of the next frame that is not valid yet, or None
+        now = time.time() if now is None else now
+        later = [validFrom for validFrom in self.load_index()['frames'] if validFrom > now]
+        return later[0] if later else None
+
+
+class FramePrerenderer:
+
+    def __init__(self, renderOptions, frameDir, path_to_server_image, workers=None):
+        self.logger = logging.getLogger('maginkdash')
+        # Every frame is rendered from scratch into its own folder: no render cache, and no tile diffs, which
+        # only make sense against the frame published right before. Extra outputs are written where they are
+        # served, so they can't be rendered ahead of time.
+        self.options = dict(renderOptions, useCache=False, partialUpdates=None, outputs=None)
+        self.store = FrameStore(frameDir, path_to_server_image)
+        self.workers = max(1, workers or os.cpu_count() or 1)
+        self.executor = None
+
+    def render(self, frames, staleSince=None):
+        # frames is a list of (validFrom datetime, currDate, day lists). Returns False if they are the same as the
+        # frames already rendered, in which case nothing is rendered again.
+        inputs = hashlib.sha256(repr(([(currDate, days) for validFrom, currDate, days in frames],
+                                      staleSince)).encode()).hexdigest()
+        index = self.store.load_index()
+        if index['inputs'] == inputs and index['frames']:
+            self.logger.info('Events unchanged, keeping the pre-rendered frames.')
+            self.store.publish_due()
+            return False
+
+        if self.executor is None:
+            self.executor = create_pool(min(self.workers, len(frames)))
+        start = time.perf_counter()
+        generation = index['generation'] + 1
+        futures = []
+        for i, (validFrom, currDate, days) in enumerate(frames):
+            path = self.store.frame_path(generation, int(validFrom.timestamp()))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # One name per position in the day, so frames rendered at the same time use separate pages
+            futures.append(self.executor.submit(render_dashboard, f'frame-{i}', self.options, currDate, days, path,
+                                                staleSince))
+        wait(futures)
+        for future in futures:
+            # A frame that failed to render would leave a gap, so the previous generation is kept instead
+            name, rendered, renderTime, spans = future.result()
+            tracer.extend([dict(record, dashboard=tracer.dashboard, frame=name) for record in spans])
+
+        validFroms = [int(validFrom.timestamp()) for validFrom, currDate, days in frames]
+        self.store.replace(generation, validFroms, inputs)
+        self.logger.info(f"Pre-rendered {len(frames)} frames in {time.perf_counter() - start:.2f}s.")
+        self.store.publish_due()
+        return True
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
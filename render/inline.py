@@ -0,0 +1,262 @@
+"""
+Makes the dashboard page self-contained before it is loaded in the browser. The linked stylesheets are replaced by a
+single <style> block holding only the rules whose selectors can match something on the page, and the fonts those
+rules use are subset to the characters on the page and embedded as data: URLs. Instead of parsing all of Bootstrap and
+loading the 2 MB emoji font on every render, the browser gets a few kilobytes of CSS and fonts without touching the
+disk.
+
+Font subsets are cached in cacheDir/fonts/, named after a hash of the font file and the characters it was subset to.
+Without fontTools, the stylesheets are still inlined but the fonts are loaded from their original files.
+"""
+
+import base64
+import hashlib
+import html
+import io
+import logging
+import os
+import re
+import threading
+from render.cache import file_hash, is_local
+from render.template import FileCache
+
+try:
+    from fontTools import subset
+    from fontTools.ttLib import TTFont
+except ImportError:
+    subset = None
+
+STYLESHEET_LINK_RE = re.compile(r'<link\b[^>]*\brel="stylesheet"[^>]*>\s*', re.IGNORECASE)
+HREF_RE = re.compile(r'\bhref="([^"]+)"')
+CSS_URL_RE = re.compile(r'url\(\s*([\'"]?)([^\'")]+)\1\s*\)')
+COMMENT_RE = re.compile(r'/\*.*?\*/', re.DOTALL)
+FONT_FAMILY_RE = re.compile(r'font-family\s*:\s*([^;}]+)', re.IGNORECASE)
+CONTENT_RE = re.compile(r'content\s*:\s*(["\'])(.*?)\1', re.IGNORECASE)
+CSS_ESCAPE_RE = re.compile(r'\\([0-9a-fA-F]{1,6})\s?')
+PSEUDO_RE = re.compile(r'::?[\w-]+(?:\([^)]*\))?')
+ATTRIBUTE_RE = re.compile(r'\[[^\]]*\]')
+TAG_RE = re.compile(r'(?:^|(?<=[\s>+~(]))([a-zA-Z][\w-]*)')
+CLASS_RE = re.compile(r'\.([\w-]+)')
+ID_RE = re.compile(r'#([\w-]+)')
+
+
+def split_blocks(css):
+    # Split CSS into top-level (prelude, body) pairs; body is None for statements such as @charset
+    blocks = []
+    depth = 0
+    start = 0
+    bodyStart = 0
+    quote = None
+    for i, char in enumerate(css):
+        if quote:
+            if char == quote and css[i - 1] != '\\':
+                quote = None
+        elif char in '"\'':
+            quote = char
+        elif char == '{':
+            if depth == 0:
+                bodyStart = i
+            depth += 1
+        elif char == '}':
+            depth -= 1
+            if depth == 0:
+                blocks.append((css[start:bodyStart].strip(), css[bodyStart + 1:i].strip()))
+                start = i + 1
+        elif char == ';' and depth == 0:
+            blocks.append((css[start:i].strip(), None))
+            start = i + 1
+    return blocks
+
+
+def selector_requirements(selector):
+    # The tags, classes and ids an element chain needs for the selector to match anything. Pseudo-classes and
+    # attribute selectors are ignored, which can only keep a rule that turns out to be unused, never drop a used one.
+    selector = ATTRIBUTE_RE.sub('', PSEUDO_RE.sub('', selector))
+    return (frozenset(tag.lower() for tag in TAG_RE.findall(selector)), frozenset(CLASS_RE.findall(selector)),
+            frozenset(ID_RE.findall(selector)))
+
+
+def parse_rules(css, baseDir):
+    # Turn a stylesheet into a list of rules: ('style', prelude, body, requirements), ('font-face', body),
+    # ('group', prelude, rules) for @media and @supports, ('at', prelude, body) for anything else
+    rules = []
+    for prelude, body in split_blocks(COMMENT_RE.sub('', css)):
+        if body is not None:
+            # Relative url() references are made absolute, as the rules end up in a page in another folder
+            body = CSS_URL_RE.sub(lambda m: f'url("{absolute_url(m.group(2), baseDir)}")', body)
+        if not prelude.startswith('@'):
+            requirements = [selector_requirements(s) for s in prelude.split(',')]
+            rules.append(('style', prelude, body, requirements))
+        elif prelude.lower() == '@font-face':
+            rules.append(('font-face', body))
+        elif prelude.lower().startswith(('@media', '@supports')):
+            rules.append(('group', prelude, parse_rules(body, baseDir)))
+        elif prelude.lower().startswith('@charset'):
+            continue
+        else:
+            rules.append(('at', prelude, body))
+    return rules
+
+
+def absolute_url(ref, baseDir):
+    if not is_local(ref) or ref.startswith('file:'):
+        return ref
+    return 'file://' + os.path.normpath(os.path.join(baseDir, ref))
+
+
+def load_stylesheet(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return parse_rules(f.read(), os.path.dirname(path))
+
+
+def font_families(value):
+    return [name.strip().strip('"\'') for name in value.split(',')]
+
+
+def page_usage(page):
+    # Tags, classes and ids present in the page
+    tags = set(tag.lower() for tag in re.findall(r'<([a-zA-Z][\w-]*)', page)) | {'html', 'body', ':root'}
+    classes = set(name for value in re.findall(r'\bclass="([^"]*)"', page) for name in value.split())
+    ids = set(re.findall(r'\bid="([^"]*)"', page))
+    return tags, classes, ids
+
+
+def page_text(page):
+    # The characters the page can show, in both cases to account for text-transform and small-caps
+    body = re.sub(r'<(script|style)\b.*?</\1>', '', page, flags=re.DOTALL | re.IGNORECASE)
+    text = html.unescape(re.sub(r'<[^>]+>', '', body))
+    return set(text) | set(text.upper()) | set(text.lower())
+
+
+class AssetInliner:
+
+    def __init__(self, cacheDir):
+        self.logger = logging.getLogger('maginkdash')
+        self.fontDir = os.path.join(cacheDir, 'fonts')
+        self.stylesheets = FileCache(load_stylesheet)
+        self.fontHashes = FileCache(file_hash)
+        self.subsets = {}  # cache key -> data: URL, for subsets already read in this process
+        self.lock = threading.Lock()
+        self.warnedNoFontTools = False
+
+    def used_rules(self, rules, usage, families, text):
+        # Keep the style rules that can match the page. families collects the fonts they use, and text the
+        # characters of generated content, e.g. bullets added with ::before, which need glyphs in the subset too.
+        tags, classes, ids = usage
+        kept = []
+        for rule in rules:
+            if rule[0] == 'style':
+                if any(ruleTags <= tags and ruleClasses <= classes and ruleIds <= ids
+                       for ruleTags, ruleClasses, ruleIds in rule[3]):
+                    kept.append(f'{rule[1]}{{{rule[2]}}}')
+                    for value in FONT_FAMILY_RE.findall(rule[2]):
+                        families.update(font_families(value))
+                    for _, value in CONTENT_RE.findall(rule[2]):
+                        text |= set(CSS_ESCAPE_RE.sub(lambda m: chr(int(m.group(1), 16)), value))
+            elif rule[0] == 'group':
+                inner = self.used_rules(rule[2], usage, families, text)
+                if inner:
+                    kept.append(f'{rule[1]}{{{"".join(inner)}}}')
+        return kept
+
+    def subset_font(self, path, text):
+        # Returns a data: URL with the font reduced to the given characters
+        key = hashlib.sha256((self.fontHashes.get(path) + ''.join(sorted(text))).encode('utf-8')).hexdigest()[:32]
+        with self.lock:
+            if key in self.subsets:
+                return self.subsets[key]
+        cachedPath = os.path.join(self.fontDir, key + '.woff')
+        if os.path.exists(cachedPath):
+            with open(cachedPath, 'rb') as f:
+                data = f.read()
+        else:
+            options = subset.Options()
+            options.flavor = 'woff'
+            options.layout_features = ['*']
+            options.name_IDs = ['*']
+            options.notdef_outline = True
+            font = TTFont(path, lazy=True)
+            subsetter = subset.Subsetter(options)
+            subsetter.populate(text=''.join(sorted(text)))
+            subsetter.subset(font)
+            font.flavor = 'woff'
+            buffer = io.BytesIO()
+            font.save(buffer)
+            data = buffer.getvalue()
+            os.makedirs(self.fontDir, exist_ok=True)
+            with open(cachedPath + '.tmp', 'wb') as f:
+                f.write(data)
+            os.replace(cachedPath + '.tmp', cachedPath)
+        url = 'data:font/woff;base64,' + base64.b64encode(data).decode('ascii')
+        with self.lock:
+            self.subsets[key] = url
+        return url
+
+    def font_faces(self, rules, families, text, stats):
+        faces = []
+        for rule in rules:
+            if rule[0] == 'group':
+                faces += self.font_faces(rule[2], families, text, stats)
+            if rule[0] != 'font-face':
+                continue
+            family = FONT_FAMILY_RE.search(rule[1])
+            if not family or font_families(family.group(1))[0] not in families:
+                continue
+            body = rule[1]
+            match = CSS_URL_RE.search(body)
+            path = match.group(2)[len('file://'):] if match and match.group(2).startswith('file://') else None
+            if subset is not None and path and os.path.splitext(path)[1] in ('.ttf', '.otf') and os.path.isfile(path):
+                url = self.subset_font(path, text)
+                stats['fontsBefore'] += os.path.getsize(path)
+                stats['fontsAfter'] += len(url)
+                declarations = [d for d in body.split(';') if d.strip() and not d.strip().lower().startswith('src')]
+                body = ';'.join(declarations + [f'src:url("{url}") format("woff")'])
+            faces.append(f'@font-face{{{body}}}')
+        return faces
+
+    def inline(self, page, baseDir):
+        links = STYLESHEET_LINK_RE.findall(page)
+        paths = []
+        for link in links:
+            href = HREF_RE.search(link)
+            if not href or not is_local(href.group(1)):
+                continue
+            path = os.path.normpath(os.path.join(baseDir, href.group(1).replace('file://', '')))
+            if os.path.isfile(path):
+                paths.append((link, path))
+        if not paths:
+            return page
+
+        if subset is None and not self.warnedNoFontTools:
+            self.logger.warning('fontTools is not installed, fonts are not subset before rendering.')
+            self.warnedNoFontTools = True
+
+        usage = page_usage(page)
+        text = page_text(page)
+        families = set()
+        kept = []
+        faces = []
+        keyframes = []
+        stats = {'cssBefore': 0, 'fontsBefore': 0, 'fontsAfter': 0, 'rulesBefore': 0}
+        for link, path in paths:
+            rules = self.stylesheets.get(path)
+            stats['cssBefore'] += os.path.getsize(path)
+            stats['rulesBefore'] += len(rules)
+            kept += self.used_rules(rules, usage, families, text)
+        keptCss = ''.join(kept)
+        for link, path in paths:
+            # @keyframes and similar are only kept when a kept rule refers to them by name
+            keyframes += [f'{rule[1]}{{{rule[2]}}}' for rule in self.stylesheets.get(path)
+                          if rule[0] == 'at' and rule[2] is not None and rule[1].split()[-1] in keptCss]
+        for link, path in paths:
+            faces += self.font_faces(self.stylesheets.get(path), families, text, stats)
+
+        style = '<style>' + ''.join(faces + keyframes) + keptCss + '</style>\n'
+        inlined = page.replace(paths[0][0], style, 1)
+        for link, path in paths[1:]:
+            inlined = inlined.replace(link, '', 1)
+
+        self.logger.info(f"Inlined {len(kept)} of {stats['rulesBefore']} CSS rules "
+                         f"({stats['cssBefore'] // 1024} KB -> {len(keptCss) // 1024} KB) and "
+                         f"{len(faces)} fonts ({stats['fontsBefore'] // 1024} KB -> {stats['fontsAfter'] // 1024} KB).")
+        return inlined
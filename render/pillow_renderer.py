@@ -0,0 +1,217 @@
+"""
+Draws the dashboard directly with Pillow, without a browser. It reproduces the three-column layout of
+dashboard_template.html and css/dashboard.css (sizes, spacing, borders and the title sizes fitted by render/textfit.py)
+using the bundled Lexend and Noto Emoji fonts, so it renders in a fraction of a second on a Raspberry Pi.
+
+The geometry below mirrors the stylesheets, so keep the two in sync when changing the design. Empty-state
+illustrations are SVGs, which Pillow can't draw: they are rasterized once with cairosvg (if installed) and cached as
+PNGs next to the render cache.
+"""
+
+from PIL import Image, ImageDraw, ImageFont
+from functools import lru_cache
+import logging
+import os
+import re
+from render.textfit import (FONT_DIR, FONT_FILES, LINE_HEIGHT, SCREEN_PADDING, GRID_BORDER, GRID_HEIGHT, COL_BORDER,
+                            HEADER_PADDING, HEADER_BORDER, EVENTS_PADDING, EVENTS_MAX_HEIGHT, EVENT_MARGIN,
+                            EVENT_PADDING, EVENT_BORDER, ALLDAY_BORDER, TITLE_LINE_HEIGHT, COLUMN_WIDTH, split_runs,
+                            text_width, layout_events, fit_sizes)
+
+
+@lru_cache(maxsize=1)
+def load_cairosvg():
+    # cairosvg and cairo take a while to load, and are only needed the first time an illustration is rasterized
+    try:
+        import cairosvg
+        return cairosvg
+    except (ImportError, OSError):
+        # OSError when the Python package is installed but the cairo library isn't
+        return None
+
+
+# css/dashboard.css, the layout of the event lists is in render/textfit.py
+GRID_RADIUS = 24
+EMPTY_SVG_PADDING = (8, 12)
+EMPTY_SVG_MAX_HEIGHT = 300
+STALE_MARGIN = (22, 30)  # bottom, right
+STALE_PADDING = (3, 10)
+STALE_BORDER = 2
+STALE_RADIUS = 12
+STALE_FONT_SIZE = 14
+
+
+@lru_cache(maxsize=None)
+def get_font(family, size):
+    return ImageFont.truetype(os.path.join(FONT_DIR, FONT_FILES[family]), size)
+
+
+class PillowRenderer:
+
+    def __init__(self, width, height, cacheDir):
+        self.logger = logging.getLogger('maginkdash')
+        self.imageWidth = width
+        self.imageHeight = height
+        self.cacheDir = cacheDir
+        self.colWidth = COLUMN_WIDTH
+        self.warnedNoCairo = False
+
+    def draw_text(self, draw, x, top, text, family, size, lineHeight, letterSpacing=0.0):
+        # Draw one line of text in a CSS line box starting at top, placing the baseline the way the browser does
+        font = get_font(family, size)
+        ascent, descent = font.getmetrics()
+        baseline = top + (lineHeight - (ascent + descent)) / 2 + ascent
+        for runFamily, run in split_runs(family, text):
+            runFont = get_font(runFamily, size)
+            if letterSpacing:
+                for char in run:
+                    draw.text((x, baseline), char, font=runFont, fill=0, anchor='ls')
+                    x += runFont.getlength(char) + letterSpacing
+            else:
+                draw.text((x, baseline), run, font=runFont, fill=0, anchor='ls')
+                x += runFont.getlength(run)
+
+    def draw_dashed_rect(self, draw, box, width, dash):
+        left, top, right, bottom = box
+        for y in (top, bottom - width):
+            for x in range(int(left), int(right), 2 * dash):
+                draw.rectangle([x, y, min(x + dash, right) - 1, y + width - 1], fill=0)
+        for x in (left, right - width):
+            for y in range(int(top), int(bottom), 2 * dash):
+                draw.rectangle([x, y, x + width - 1, min(y + dash, bottom) - 1], fill=0)
+
+    def fit_events(self, day, available):
+        # Use the sizes RenderHelper already fitted for the template, so both backends shrink the same days
+        if 'titleSize' in day:
+            titleSize, timeSize = day['titleSize'], day['timeSize']
+        else:
+            titleSize, timeSize = fit_sizes(day, self.colWidth, available)
+        return layout_events(day, self.colWidth, titleSize, timeSize)[1]
+
+    def empty_state_image(self, svgPath, maxWidth, maxHeight):
+        # Rasterize an empty-state SVG to fit the box, caching the result on disk
+        with open(svgPath, 'r') as f:
+            svg = f.read()
+        viewBox = re.search(r'viewBox="\s*[\d.-]+[\s,]+[\d.-]+[\s,]+([\d.]+)[\s,]+([\d.]+)\s*"', svg)
+        if viewBox:
+            aspect = float(viewBox.group(2)) / float(viewBox.group(1))
+        else:
+            aspect = 1
+        width = int(maxWidth)
+        height = int(min(maxWidth * aspect, maxHeight))
+        if height < maxWidth * aspect:
+            width = int(height / aspect)
+
+        name = os.path.splitext(os.path.basename(svgPath))[0]
+        pngPath = os.path.join(self.cacheDir, 'empty_states',
+                               f"{name}-{int(os.path.getmtime(svgPath))}-{width}x{height}.png")
+        if not os.path.exists(pngPath):
+            cairosvg = load_cairosvg()
+            if cairosvg is None:
+                if not self.warnedNoCairo:
+                    self.logger.warning('cairosvg is not installed, empty-state illustrations are left out.')
+                    self.warnedNoCairo = True
+                return None
+            os.makedirs(os.path.dirname(pngPath), exist_ok=True)
+            tmpFile = pngPath + '.tmp'
+            cairosvg.svg2png(bytestring=svg.encode('utf-8'), write_to=tmpFile, output_width=width,
+                             output_height=height, background_color='white')
+            os.replace(tmpFile, pngPath)
+        with Image.open(pngPath) as image:
+            return image.convert('L')
+
+    def draw_column(self, image, draw, left, top, day, lastColumn):
+        right = left + self.colWidth - (0 if lastColumn else COL_BORDER)
+        if not lastColumn:
+            draw.rectangle([right, top, right + COL_BORDER - 1, top + GRID_HEIGHT], fill=0)
+
+        # Header
+        y = top + HEADER_PADDING[0]
+        x = left + HEADER_PADDING[1]
+        if day['isToday']:
+            # font-variant: small-caps on lowercase text, which the browser draws as capitals at 70% size
+            size = 17
+            labelWidth = text_width('Lexend-Regular', round(size * 0.7), 'TODAY', 0.18 * size)
+            self.draw_text(draw, right - 18 - labelWidth, top + 14, 'TODAY', 'Lexend-Regular', round(size * 0.7),
+                           size * LINE_HEIGHT, 0.18 * size)
+        self.draw_text(draw, x, y, day['weekday'].upper(), 'Lexend-Regular', 22, 22 * LINE_HEIGHT, 0.12 * 22)
+        y += 22 * LINE_HEIGHT + 2
+        # font-weight: bold on a regular-only family, so the browser emboldens the glyphs itself
+        font = get_font('Lexend-Regular', 96)
+        ascent, descent = font.getmetrics()
+        draw.text((x, y + (96 - (ascent + descent)) / 2 + ascent), day['day'], font=font, fill=0, anchor='ls',
+                  stroke_width=2, stroke_fill=0)
+        y += 96 + 3
+        self.draw_text(draw, x, y, day['month'].upper(), 'Lexend-Regular', 19, 19 * LINE_HEIGHT, 0.1 * 19)
+        y += 19 * LINE_HEIGHT + HEADER_PADDING[2]
+        draw.rectangle([left, y, right - 1, y + HEADER_BORDER - 1], fill=0)
+        y += HEADER_BORDER
+
+        # Events
+        available = min(top + GRID_HEIGHT - y, EVENTS_MAX_HEIGHT)
+        listTop = y + EVENTS_PADDING
+        if day['empty']:
+            size = 23
+            itemTop = listTop + EVENT_MARGIN[0]
+            itemBottom = itemTop + 2 * EVENT_PADDING[0] + size * TITLE_LINE_HEIGHT
+            draw.rectangle([left + EVENT_MARGIN[1], itemTop, left + EVENT_MARGIN[1] + EVENT_BORDER - 1, itemBottom],
+                           fill=0)
+            self.draw_text(draw, left + EVENT_MARGIN[1] + EVENT_BORDER + EVENT_PADDING[1],
+                           itemTop + EVENT_PADDING[0], 'Nothing to do!', 'Lexend-Regular', size,
+                           size * TITLE_LINE_HEIGHT)
+            if day['emptySvg']:
+                boxTop = itemBottom + EVENT_MARGIN[0] + EMPTY_SVG_PADDING[0]
+                boxBottom = y + available - EVENTS_PADDING - EMPTY_SVG_PADDING[0]
+                boxWidth = right - left - 2 * EMPTY_SVG_PADDING[1]
+                illustration = self.empty_state_image(day['emptySvg'], boxWidth, EMPTY_SVG_MAX_HEIGHT)
+                if illustration is not None:
+                    image.paste(illustration, (int(left + EMPTY_SVG_PADDING[1] + (boxWidth - illustration.width) / 2),
+                                               int(boxTop + (boxBottom - boxTop - illustration.height) / 2)))
+            return
+
+        for op in self.fit_events(day, available):
+            if op[0] == 'text':
+                _, opX, opY, text, family, size, lineHeight, letterSpacing = op
+                if opY >= available - EVENTS_PADDING:
+                    # Below the bottom of the list, where the overflow is hidden
+                    continue
+                self.draw_text(draw, left + opX, listTop + opY, text, family, size, lineHeight, letterSpacing)
+            elif op[0] == 'bar':
+                _, x0, y0, x1, y1 = op
+                draw.rectangle([left + x0, listTop + y0, left + x1 - 1, listTop + y1 - 1], fill=0)
+            elif op[0] == 'dashed':
+                _, x0, y0, x1, y1 = op
+                self.draw_dashed_rect(draw, (left + x0, listTop + y0, left + x1, listTop + y1), ALLDAY_BORDER,
+                                      3 * ALLDAY_BORDER)
+
+    def draw_stale_marker(self, draw, text):
+        width = text_width('Lexend-Regular', STALE_FONT_SIZE, text) + 2 * (STALE_PADDING[1] + STALE_BORDER)
+        height = STALE_FONT_SIZE * LINE_HEIGHT + 2 * (STALE_PADDING[0] + STALE_BORDER)
+        right = self.imageWidth - STALE_MARGIN[1]
+        bottom = self.imageHeight - STALE_MARGIN[0]
+        draw.rounded_rectangle([right - width, bottom - height, right - 1, bottom - 1], radius=STALE_RADIUS, fill=255,
+                               outline=0, width=STALE_BORDER)
+        self.draw_text(draw, right - width + STALE_BORDER + STALE_PADDING[1], bottom - height + STALE_BORDER +
+                       STALE_PADDING[0], text, 'Lexend-Regular', STALE_FONT_SIZE, STALE_FONT_SIZE * LINE_HEIGHT)
+
+    def render(self, days, outputPath, staleText=''):
+        image = Image.new('L', (self.imageWidth, self.imageHeight), 255)
+        # Columns are drawn on their own layer so overflowing content is clipped by the rounded grid border
+        columns = Image.new('L', (self.imageWidth, self.imageHeight), 255)
+        draw = ImageDraw.Draw(columns)
+        gridTop = SCREEN_PADDING + GRID_BORDER
+        for i, day in enumerate(days):
+            left = SCREEN_PADDING + GRID_BORDER + i * self.colWidth
+            self.draw_column(columns, draw, left, gridTop, day, i == len(days) - 1)
+
+        gridBox = [SCREEN_PADDING, SCREEN_PADDING, 1200 - SCREEN_PADDING - 1, SCREEN_PADDING + GRID_HEIGHT - 1]
+        mask = Image.new('L', image.size, 0)
+        ImageDraw.Draw(mask).rounded_rectangle(gridBox, radius=GRID_RADIUS, fill=255)
+        image.paste(columns, (0, 0), mask)
+        ImageDraw.Draw(image).rounded_rectangle(gridBox, radius=GRID_RADIUS, outline=0, width=GRID_BORDER)
+        if staleText:
+            self.draw_stale_marker(ImageDraw.Draw(image), staleText)
+
+        tmpFile = outputPath + '.tmp'
+        image.save(tmpFile, 'PNG')
+        os.replace(tmpFile, outputPath)
@@ -0,0 +1,72 @@
+"""
+Worker processes that render dashboards in parallel, used by batch mode and by pre-rendering. Each worker keeps one
+headless browser (or the Pillow renderer and its font cache) and one RenderHelper per dashboard name for all the
+renders it is given, so only the first render in a worker pays for starting them.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+import logging
+import multiprocessing
+import multiprocessing.util
+import os
+import sys
+import time
+from render.render import RenderHelper
+from tracing import tracer
+
+# Kept by each worker process between the dashboards it renders
+workerBrowser = None
+workerRenderers = {}  # dashboard name -> (options, RenderHelper)
+
+
+def create_pool(workers):
+    # Workers are started with spawn so they don't inherit the fetch threads and open connections of this process
+    return ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                               mp_context=multiprocessing.get_context('spawn'))
+
+
+def init_worker():
+    logger = logging.getLogger('maginkdash')
+    # A spawned worker re-imports the entry point but doesn't run its main block. Log the way main.py does only if
+    # nothing was configured at import time, otherwise every line would also go to the handlers set up there.
+    if not logger.handlers and not logging.getLogger().handlers:
+        logging.basicConfig(filename="logfile.log", format='%(asctime)s %(levelname)s - %(message)s', filemode='a')
+        logger.addHandler(logging.StreamHandler(sys.stdout))
+    if logger.level == logging.NOTSET:
+        logger.setLevel(logging.INFO)
+    # Shut the browser down when the pool exits
+    multiprocessing.util.Finalize(None, close_worker, exitpriority=10)
+
+
+def close_worker():
+    global workerBrowser
+    for options, renderer in workerRenderers.values():
+        renderer.close()
+    workerRenderers.clear()
+    if workerBrowser is not None:
+        workerBrowser.quit()
+        workerBrowser = None
+
+
+def render_dashboard(name, options, currDate, eventList, path_to_server_image, staleSince=None):
+    # Runs in a worker process. Returns the dashboard name, whether it was rendered, the render time and the spans
+    # recorded, which are exported by the process that submitted the render.
+    global workerBrowser
+    start = time.perf_counter()
+    cached = workerRenderers.get(name)
+    if cached is None or cached[0] != options:
+        browser = None
+        if options.get('backend', 'browser') == 'browser':
+            if workerBrowser is None:
+                from render.browser import BrowserSession
+                logPath = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                       f'chromedriver-{os.getpid()}.log')
+                workerBrowser = BrowserSession(options['width'], options['height'], logPath,
+                                               **options.get('browserOptions', {}))
+            browser = workerBrowser
+        if cached is not None:
+            cached[1].close()
+        workerRenderers[name] = (options, RenderHelper(name=name, browser=browser, **options))
+    rendered = workerRenderers[name][1].process_inputs(currDate, eventList, path_to_server_image, staleSince)
+    spans = [dict(record, dashboard=name) for record in tracer.collect()]
+    return name, rendered, time.perf_counter() - start, spans
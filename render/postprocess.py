@@ -0,0 +1,80 @@
+"""
+Turns the captured dashboard into what the e-ink panel can actually show. The Inkplate 10 runs in 3-bit mode, so the
+image is reduced to 8 gray levels here on the server, optionally dithered, and published as a small palette-indexed
+PNG instead of a full-color screenshot. The device then only has to copy the levels to the panel.
+"""
+
+from PIL import Image
+import numpy as np
+import os
+
+DITHER_MODES = ('none', 'ordered', 'floyd-steinberg')
+
+# 8x8 Bayer threshold map for ordered dithering
+BAYER_8X8 = np.array([
+    [0, 32, 8, 40, 2, 34, 10, 42],
+    [48, 16, 56, 24, 50, 18, 58, 26],
+    [12, 44, 4, 36, 14, 46, 6, 38],
+    [60, 28, 52, 20, 62, 30, 54, 22],
+    [3, 35, 11, 43, 1, 33, 9, 41],
+    [51, 19, 59, 27, 49, 17, 57, 25],
+    [15, 47, 7, 39, 13, 45, 5, 37],
+    [63, 31, 55, 23, 61, 29, 53, 21],
+], dtype=np.float32)
+
+
+def gray_palette(levels):
+    # Evenly spaced gray values, level 0 is black and the last level is white
+    return [round(i * 255 / (levels - 1)) for i in range(levels)]
+
+
+def quantize(image, levels=8, dither='none'):
+    # Returns a 2D uint8 array of gray levels in 0..levels-1
+    if dither not in DITHER_MODES:
+        raise ValueError(f"Unknown dither mode '{dither}', use one of {', '.join(DITHER_MODES)}")
+    gray = image.convert('L')
+
+    if dither == 'floyd-steinberg':
+        # Error diffusion is inherently sequential, so use Pillow's C implementation against a gray palette
+        palette = gray_palette(levels)
+        paletteImage = Image.new('P', (1, 1))
+        paletteImage.putpalette([v for value in palette for v in (value, value, value)] * (256 // levels))
+        indices = np.asarray(gray.convert('RGB').quantize(palette=paletteImage, dither=Image.Dither.FLOYDSTEINBERG))
+        # The palette is repeated to fill all 256 entries, fold the indices back onto the levels
+        return (indices % levels).astype(np.uint8)
+
+    values = np.asarray(gray, dtype=np.float32) * ((levels - 1) / 255)
+    if dither == 'ordered':
+        height, width = values.shape
+        thresholds = (BAYER_8X8 + 0.5) / 64
+        tiled = np.tile(thresholds, (height // 8 + 1, width // 8 + 1))[:height, :width]
+        levelsArray = np.floor(values + tiled)
+    else:
+        levelsArray = np.rint(values)
+    return np.clip(levelsArray, 0, levels - 1).astype(np.uint8)
+
+
+def to_palette_image(indices, levels):
+    image = Image.fromarray(indices, 'P')
+    image.putpalette([v for value in gray_palette(levels) for v in (value, value, value)])
+    return image
+
+
+def save_atomic(image, path, **params):
+    # Write to a temporary file first so a web server never serves a half-written image
+    tmpFile = path + '.tmp'
+    image.save(tmpFile, 'PNG', **params)
+    os.replace(tmpFile, path)
+
+
+def save_levels(indices, outputPath, levels):
+    # Save gray levels as a palette PNG with as few bits per pixel as they need
+    bits = 1 if levels <= 2 else 2 if levels <= 4 else 4 if levels <= 16 else 8
+    save_atomic(to_palette_image(indices, levels), outputPath, optimize=True, bits=bits)
+
+
+def publish_grayscale(sourcePath, outputPath, levels=8, dither='none'):
+    with Image.open(sourcePath) as source:
+        indices = quantize(source, levels, dither)
+    save_levels(indices, outputPath, levels)
+    return indices
@@ -7,106 +7,174 @@ format the calendar exactly the way I want it using HTML/CSS, and (ii) I can del
 calendar and refreshing of the eInk display.
 """
 
-from selenium import webdriver
-from selenium.webdriver.chrome.options import Options
-from time import sleep
+from render.cache import RenderCache
+from render.template import DashboardTemplate
+from render.textfit import fit_sizes
+from tracing import span
 from datetime import timedelta
+import json
 import pathlib
 import logging
 import os
-from selenium.webdriver.common.by import By
+import shutil
+import time
 
 
 class RenderHelper:
 
-    def __init__(self, width, height, timeFormat=12):
+    def __init__(self, width, height, timeFormat=12, keepBrowser=False, browserOptions=None, useCache=True,
+                 backend='browser', grayLevels=8, dither='none', framebuffer=False, framebufferRLE=True,
+                 partialUpdates=None, inlineAssets=True, name=None, browser=None, outputs=None,
+                 screenshotOptions=None):
         self.logger = logging.getLogger('maginkdash')
         self.currPath = str(pathlib.Path(__file__).parent.absolute())
-        self.htmlFile = 'file://' + self.currPath + '/dashboard.html'
+        # With several dashboards rendered from one process (batch mode), each gets its own name, which keeps their
+        # pages, screenshots and caches apart
+        self.name = name
+        suffix = '-' + name if name else ''
+        self.htmlPath = self.currPath + '/dashboard' + suffix + '.html'
+        self.htmlFile = 'file://' + self.htmlPath
+        self.imagePath = self.currPath + '/dashboard' + suffix + '.png'
+        self.cacheDir = self.currPath + '/.cache' + ('/' + name if name else '')
         self.imageWidth = width
         self.imageHeight = height
         self.timeFormat = timeFormat  # 12 or 24-hour time format
-
-    def set_viewport_size(self, driver):
-
-        # Extract the current window size from the driver
-        current_window_size = driver.get_window_size()
-
-        # Extract the client window size from the html tag
-        html = driver.find_element(By.TAG_NAME,'html')
-        inner_width = int(html.get_attribute("clientWidth"))
-        inner_height = int(html.get_attribute("clientHeight"))
-
-        # "Internal width you want to set+Set "outer frame width" to window size
-        target_width = self.imageWidth + (current_window_size["width"] - inner_width)
-        target_height = self.imageHeight + (current_window_size["height"] - inner_height)
-
-        driver.set_window_rect(
-            width=target_width,
-            height=target_height)
-
-    def get_screenshot(self, path_to_server_image):
-        import subprocess
-        from selenium.webdriver.chrome.service import Service
-
-        opts = Options()
-        opts.add_argument("--headless=new")
-        opts.add_argument("--no-sandbox")
-        opts.add_argument("--disable-dev-shm-usage")
-        opts.add_argument("--hide-scrollbars")
-        opts.add_argument("--disable-gpu")
-        opts.add_argument("--remote-debugging-pipe")
-        opts.add_argument(f"--window-size={self.imageWidth},{self.imageHeight}")
-        opts.add_argument('--force-device-scale-factor=1')
-
-        # Try to automatically locate chromedriver
-        try:
-            chromedriver_path = subprocess.check_output(['which', 'chromedriver']).decode('utf-8').strip()
-            self.logger.info(f"Found chromedriver at: {chromedriver_path}")
-        except (subprocess.SubprocessError, FileNotFoundError):
-            # Default paths to try if 'which' command fails
-            possible_paths = [
-                '/usr/bin/chromedriver',
-                '/usr/local/bin/chromedriver',
-                '/usr/lib/chromium-browser/chromedriver'
-            ]
-
-            chromedriver_path = None
-            for path in possible_paths:
-                if os.path.exists(path) and os.access(path, os.X_OK):
-                    chromedriver_path = path
-                    self.logger.info(f"Found chromedriver at default location: {chromedriver_path}")
-                    break
-
-            if not chromedriver_path:
-                self.logger.error("Could not find chromedriver. Please install it with 'sudo apt-get install chromium-chromedriver'")
-                raise FileNotFoundError("chromedriver executable not found in PATH")
-
-        # Use the discovered chromedriver path
-        service = Service(chromedriver_path, log_output=self.currPath + '/chromedriver.log')
-
-        driver = None
+        # Parsed template and sanitized empty-state illustrations, reloaded only when the files change
+        self.template = DashboardTemplate(self.currPath + '/dashboard_template.html')
+        # Options passed to BrowserSession, e.g. maxRenders and maxMemoryMB
+        self.browserOptions = browserOptions or {}
+        # Gray levels of the published image (0 keeps the full-color capture) and how to dither down to them
+        self.grayLevels = grayLevels
+        self.dither = dither
+        # Also write a raw 4-bit framebuffer next to the image, which the Inkplate can load without decoding a PNG
+        self.framebuffer = framebuffer and 2 <= grayLevels <= 16
+        self.framebufferRLE = framebufferRLE
+        # Publish the changed tiles since the previous frame as well, options are passed to FrameDiffer
+        self.frameDiffer = None
+        if self.framebuffer and partialUpdates is not None:
+            from render.diff import FrameDiffer
+            self.frameDiffer = FrameDiffer(self.cacheDir, **partialUpdates)
+        # 'browser' takes a screenshot of the HTML page, 'pillow' draws the same layout directly with Pillow
+        self.backend = backend
+        self.pillowRenderer = None
+        if backend == 'pillow':
+            from render.pillow_renderer import PillowRenderer
+            self.pillowRenderer = PillowRenderer(width, height, self.currPath + '/.cache')
+        # Inline the used CSS and subset fonts into the page before the browser loads it
+        self.inliner = None
+        if inlineAssets and backend == 'browser':
+            from render.inline import AssetInliner
+            self.inliner = AssetInliner(self.currPath + '/.cache')
+        # When keepBrowser is set, one headless Chrome session is reused across renders until close() is called.
+        # A session passed in as browser is shared with other dashboards and left open by close().
+        self.browser = browser
+        self.ownsBrowser = browser is None
+        # Which of Selenium, Chromium and Firefox takes the screenshot, learned from how they did before. The stats
+        # are shared by all dashboards, options are passed to BackendSelector, e.g. budget and cooldown.
+        self.backendSelector = None
+        if backend == 'browser':
+            from render.backends import BackendSelector
+            self.backendSelector = BackendSelector(self.currPath + '/.cache/backends.json',
+                                                   **(screenshotOptions or {}))
+        # Selenium is only imported by the browser backend.
+        if browser is None and keepBrowser and backend == 'browser':
+            from render.browser import BrowserSession
+            self.browser = BrowserSession(width, height, self.currPath + '/chromedriver.log', **self.browserOptions)
+        # Extra panels scaled from the same capture (see targets.py). They default to the main image's gray levels
+        # and dithering.
+        self.outputOptions = outputs or []
+        self.outputTargets = []
+        if outputs:
+            from render.targets import OutputTarget
+            self.outputTargets = [OutputTarget(**dict({'grayLevels': grayLevels, 'dither': dither}, **output))
+                                  for output in outputs]
+        # Remembers the inputs of the last render so unchanged dashboards are not rendered again
+        self.renderCache = RenderCache(self.cacheDir) if useCache else None
+        # Seconds spent in each stage of the last process_inputs call: html, inline, capture, publish and outputs
+        self.timings = {}
+
+    def get_screenshot(self, imagePath, width=None, height=None):
+        # Try the backends in the order BackendSelector picks, all within one time budget
+        width = width or self.imageWidth
+        height = height or self.imageHeight
+        self.backendSelector.capture({
+            'selenium': lambda timeout: self.get_screenshot_with_selenium(imagePath, width, height, timeout),
+            'chromium': lambda timeout: self.get_screenshot_with_chromium(imagePath, width, height, timeout),
+            'firefox': lambda timeout: self.get_screenshot_with_firefox(imagePath, width, height, timeout),
+        })
+
+    def get_screenshot_with_selenium(self, imagePath, width, height, timeout=90):
+        from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+        session = self.browser
+        if session is None:
+            from render.browser import BrowserSession
+            session = BrowserSession(width, height, self.currPath + '/chromedriver.log', **self.browserOptions)
+        # Capture in a worker thread, so a hung browser can't hold up the fallbacks past the time left
+        executor = ThreadPoolExecutor(max_workers=1)
         try:
-            driver = webdriver.Chrome(service=service, options=opts)
-            self.set_viewport_size(driver)
-            driver.get(self.htmlFile)
-            sleep(1)
-            driver.get_screenshot_as_file(self.currPath + '/dashboard.png')
-            driver.get_screenshot_as_file(path_to_server_image)
-            self.logger.info('Screenshot captured and saved to file.')
-        except Exception as e:
-            self.logger.error(f"Error taking screenshot: {str(e)}")
-            self.logger.error(f"ChromeDriver log: {self.currPath + '/chromedriver.log'}")
+            future = executor.submit(session.capture, self.htmlFile, imagePath, width, height)
             try:
-                self.get_screenshot_with_chromium(path_to_server_image)
-            except Exception as chromium_error:
-                self.logger.error(f"Direct Chromium screenshot failed: {str(chromium_error)}")
-                self.get_screenshot_with_firefox(path_to_server_image)
+                future.result(timeout=timeout)
+            except FutureTimeoutError:
+                # Killing the browser also ends the capture thread, a kept session starts afresh next time
+                session.kill()
+                raise TimeoutError(f"no screenshot within {timeout:.0f}s")
+        except Exception:
+            self.logger.error(f"ChromeDriver log: {self.currPath + '/chromedriver.log'}")
+            raise
         finally:
-            if driver:
-                driver.quit()
-
-    def get_screenshot_with_chromium(self, path_to_server_image):
+            executor.shutdown(wait=False)
+            if self.browser is None:
+                session.quit()
+
+    def publish(self, imagePath, path_to_server_image):
+        # Reduce the captured image to the panel's gray levels and write it where the display fetches it from
+        if self.grayLevels:
+            from render.postprocess import publish_grayscale
+            with span('encode', format='png') as record:
+                indices = publish_grayscale(imagePath, path_to_server_image, self.grayLevels, self.dither)
+                record['bytes'] = os.path.getsize(path_to_server_image)
+            self.logger.info(f"Published {self.grayLevels}-level grayscale image (dither: {self.dither}).")
+            if self.framebuffer:
+                from render.framebuffer import write_framebuffer
+                fbPath = os.path.splitext(path_to_server_image)[0] + '.fb'
+                with span('encode', format='framebuffer') as record:
+                    size = write_framebuffer(indices, fbPath, self.grayLevels, self.framebufferRLE)
+                    record['bytes'] = size
+                self.logger.info(f"Published packed framebuffer to {fbPath} ({size} bytes).")
+                if self.frameDiffer is not None:
+                    self.frameDiffer.publish(indices, path_to_server_image, self.grayLevels)
+        else:
+            tmpFile = path_to_server_image + '.tmp'
+            shutil.copyfile(imagePath, tmpFile)
+            os.replace(tmpFile, path_to_server_image)
+
+    def published_files(self, path_to_server_image, withTiles=False):
+        # Every file an update publishes, which the render cache keeps and restores together. The tiles of a partial
+        # update are only known from the manifest once it has been written.
+        stem = os.path.splitext(path_to_server_image)[0]
+        files = [path_to_server_image]
+        if self.grayLevels and self.framebuffer:
+            files.append(stem + '.fb')
+            if self.frameDiffer is not None:
+                files.append(stem + '.json')
+                if withTiles:
+                    with open(stem + '.json', 'r') as f:
+                        manifest = json.load(f)
+                    outputDir = os.path.dirname(os.path.abspath(path_to_server_image))
+                    files += [os.path.join(outputDir, tile['file']) for tile in manifest['tiles']]
+        for target in self.outputTargets:
+            files.append(target.path)
+            if target.framebuffer:
+                files.append(os.path.splitext(target.path)[0] + '.fb')
+        return files
+
+    def close(self):
+        # Shut down the browser kept alive between renders, if any
+        if self.browser is not None and self.ownsBrowser:
+            self.browser.quit()
+
+    def get_screenshot_with_chromium(self, imagePath, width=None, height=None, timeout=90):
         import shutil
         import subprocess
 
@@ -122,12 +190,13 @@ class RenderHelper:
             '--disable-dev-shm-usage',
             '--hide-scrollbars',
             '--disable-gpu',
-            f'--window-size={self.imageWidth},{self.imageHeight}',
+            f'--window-size={width or self.imageWidth},{height or self.imageHeight}',
             '--force-device-scale-factor=1',
-            f'--screenshot={self.currPath + "/dashboard.png"}',
+            f'--screenshot={imagePath}',
             self.htmlFile,
         ]
-        result = subprocess.run(command, capture_output=True, text=True, timeout=90)
+        with span('capture', backend='chromium'):
+            result = subprocess.run(command, capture_output=True, text=True, timeout=timeout)
         if result.returncode != 0:
             if result.stdout:
                 self.logger.error(result.stdout.strip())
@@ -135,10 +204,7 @@ class RenderHelper:
                 self.logger.error(result.stderr.strip())
             result.check_returncode()
 
-        shutil.copyfile(self.currPath + '/dashboard.png', path_to_server_image)
-        self.logger.info('Screenshot captured with direct Chromium and saved to file.')
-
-    def get_screenshot_with_firefox(self, path_to_server_image):
+    def get_screenshot_with_firefox(self, imagePath, width=None, height=None, timeout=90):
         import shutil
         import subprocess
 
@@ -151,12 +217,13 @@ class RenderHelper:
             firefox_path,
             '--headless',
             '--window-size',
-            f'{self.imageWidth},{self.imageHeight}',
+            f'{width or self.imageWidth},{height or self.imageHeight}',
             '--screenshot',
-            self.currPath + '/dashboard.png',
+            imagePath,
             self.htmlFile,
         ]
-        result = subprocess.run(command, capture_output=True, text=True, timeout=90)
+        with span('capture', backend='firefox'):
+            result = subprocess.run(command, capture_output=True, text=True, timeout=timeout)
         if result.returncode != 0:
             if result.stdout:
                 self.logger.error(result.stdout.strip())
@@ -164,9 +231,6 @@ class RenderHelper:
                 self.logger.error(result.stderr.strip())
             result.check_returncode()
 
-        shutil.copyfile(self.currPath + '/dashboard.png', path_to_server_image)
-        self.logger.info('Screenshot captured with Firefox and saved to file.')
-
     def get_short_time(self, datetimeObj):
         is24hour = (self.timeFormat == 24)
         datetime_str = ''
@@ -247,103 +311,124 @@ class RenderHelper:
 
         return optimal_days
 
+    def build_days(self, current_date, event_list):
+        # Describe the three columns independently of how they are drawn, so the HTML template and the Pillow
+        # renderer show the same thing.
+        # Load and shuffle SVGs for empty state display. The shuffle is seeded with the date so the same day always
+        # gets the same illustrations and an unchanged dashboard can be served from the render cache.
+        import random
+        empty_state_dir = os.path.join(self.currPath, 'empty_states')
+        svg_files = list(self.template.empty_state_files(empty_state_dir))
+        random.Random(current_date.toordinal()).shuffle(svg_files)
+        svg_index = 0
+
+        days = []
+        for i in range(3):
+            date = current_date + timedelta(days=i)
+            day_events = event_list[i] if i < len(event_list) else []
+            # Group all-day and timed events
+            allday_events = [e for e in day_events if e["isMultiday"] or e["allday"]]
+            timed_events = [e for e in day_events if not e["isMultiday"] and not e["allday"]]
+            day = {
+                'weekday': date.strftime("%A"),
+                'day': date.strftime("%-d"),
+                'month': date.strftime("%B"),
+                'isToday': i == 0,
+                'allday': [e['summary'] for e in allday_events],
+                'timed': [(self.get_short_time(e['startDatetime']), e['summary']) for e in timed_events],
+                'empty': len(day_events) == 0,
+                'emptySvg': None,
+            }
+            # Shrink the titles of a crowded day here rather than in the browser, which would need a layout pass for
+            # every pixel
+            day['titleSize'], day['timeSize'] = fit_sizes(day)
+            if not day_events and svg_files:
+                day['emptySvg'] = os.path.join(empty_state_dir, svg_files[svg_index % len(svg_files)])
+                svg_index += 1
+            days.append(day)
+        return days
+
+    def stale_text(self, current_date, staleSince):
+        # Marker shown when some events come from a snapshot because the calendar couldn't be fetched in time
+        if staleSince is None:
+            return ''
+        when = self.get_short_time(staleSince)
+        if staleSince.date() != current_date:
+            when = staleSince.strftime('%a ') + when
+        return f'Stale since {when}'
+
     def process_inputs(
         self,
         current_date,
         all_event_list,
         path_to_server_image,
-        ignore_patterns=None,
+        staleSince=None,
     ):
         # Always prepare three days (today + next two days)
         max_display_days = min(3, len(all_event_list)) if all_event_list else 1
         event_list = all_event_list[:max_display_days]
 
-        # Filter out events matching any ignore pattern
-        if ignore_patterns:
-            import re
-            compiled = [re.compile(p, re.IGNORECASE) for p in ignore_patterns]
-            event_list = [
-                [e for e in day if not any(p.search(e['summary']) for p in compiled)]
-                for day in event_list
-            ]
-
         # Pad with empty lists if fewer than three days are available
         while len(event_list) < 3:
             event_list.append([])
 
-        # Load and shuffle SVGs for empty state display
-        import random
-        empty_state_dir = os.path.join(self.currPath, 'empty_states')
-        svg_files = sorted([f for f in os.listdir(empty_state_dir) if f.endswith('.svg')])
-        random.shuffle(svg_files)
-        svg_index = 0
-        with open(self.currPath + '/dashboard_template.html', 'r') as file:
-            dashboard_template = file.read()
-
-        # Populate the date and events
-        cal_events_list = []
-        for i in range(3):
-            day_events = event_list[i] if i < len(event_list) else []
-            cal_events_text = ""
-
-            if len(day_events) == 0:
-                svg_content = ""
-                if svg_files:
-                    import re as _re
-                    svg_path = os.path.join(empty_state_dir, svg_files[svg_index % len(svg_files)])
-                    svg_index += 1
-                    with open(svg_path, 'r') as f:
-                        svg_content = f.read()
-                    # Remove hardcoded width/height from <svg> tag so CSS can control size
-                    svg_content = _re.sub(r'(<svg[^>]*)\s+width="[^"]*"', r'\1', svg_content)
-                    svg_content = _re.sub(r'(<svg[^>]*)\s+height="[^"]*"', r'\1', svg_content)
-                cal_events_text = (
-                    '<li class="nothing-today"><div class="event-title">Nothing to do!</div></li>'
-                    '<li class="empty-state-svg">' + svg_content + '</li>'
-                )
-            else:
-                # Group all-day and timed events
-                allday_events = [e for e in day_events if e["isMultiday"] or e["allday"]]
-                timed_events  = [e for e in day_events if not e["isMultiday"] and not e["allday"]]
-
-                if allday_events:
-                    cal_events_text += '<li class="event allday"><div class="event-time">All day</div>'
-                    for e in allday_events:
-                        cal_events_text += '<div class="event-title">• ' + e['summary'] + '</div>'
-                    cal_events_text += '</li>\n'
-
-                for event in timed_events:
-                    cal_events_text += (
-                        '<li class="event">'
-                        '<div class="event-time">' + self.get_short_time(event['startDatetime']) + '</div>'
-                        '<div class="event-title">' + event['summary'] + '</div>'
-                        '</li>\n'
-                    )
-
-            cal_events_list.append(cal_events_text)
-
-        # Build the params dictionary for template formatting
-        params = {
-            "day": current_date.strftime("%-d"),
-            "month": current_date.strftime("%B"),
-            "weekday": current_date.strftime("%A"),
-            "today_empty": 'empty' if len(event_list[0]) == 0 else '',
-            "events_today": cal_events_list[0],
-            "tomorrow": (current_date + timedelta(days=1)).strftime("%A"),
-            "tomorrow_day": (current_date + timedelta(days=1)).strftime("%-d"),
-            "tomorrow_month": (current_date + timedelta(days=1)).strftime("%B"),
-            "tomorrow_empty": 'empty' if len(event_list[1]) == 0 else '',
-            "events_tomorrow": cal_events_list[1],
-            "dayafter": (current_date + timedelta(days=2)).strftime("%A"),
-            "dayafter_day": (current_date + timedelta(days=2)).strftime("%-d"),
-            "dayafter_month": (current_date + timedelta(days=2)).strftime("%B"),
-            "dayafter_empty": 'empty' if len(event_list[2]) == 0 else '',
-            "events_dayafter": cal_events_list[2],
-        }
+        self.timings = {}
+        htmlStart = time.perf_counter()
+        with span('template', count=sum(len(day) for day in event_list)) as record:
+            days = self.build_days(current_date, event_list)
+            staleText = self.stale_text(current_date, staleSince)
+            html = self.template.render(days, staleText)
+            record['bytes'] = len(html)
+        self.timings['html'] = time.perf_counter() - htmlStart
+        self.logger.info(f"Generated dashboard HTML for {sum(len(day) for day in event_list)} events in "
+                          f"{1000 * self.timings['html']:.1f} ms.")
 
         # Write out the HTML file
-        with open(self.currPath + '/dashboard.html', "w") as htmlFile:
-            htmlFile.write(dashboard_template.format(**params))
-
-        # Take the screenshot
-        self.get_screenshot(path_to_server_image)
+        with open(self.htmlPath, "w") as htmlFile:
+            htmlFile.write(html)
+
+        # Skip the browser entirely if nothing changed since the last render
+        cacheKey = None
+        if self.renderCache is not None:
+            cacheKey = self.renderCache.compute_key(html, self.currPath, self.imageWidth, self.imageHeight,
+                                                    self.backend, self.grayLevels, self.dither, self.framebuffer,
+                                                    self.framebufferRLE, self.inliner is not None, self.outputOptions)
+            if self.renderCache.is_current(cacheKey, self.published_files(path_to_server_image)):
+                self.logger.info('Dashboard unchanged since the last render, skipping the screenshot.')
+                return False
+
+        if self.pillowRenderer is not None:
+            start = time.perf_counter()
+            with span('capture', backend='pillow') as record:
+                self.pillowRenderer.render(days, self.imagePath, staleText)
+                record['bytes'] = os.path.getsize(self.imagePath)
+            self.timings['capture'] = time.perf_counter() - start
+            self.logger.info('Dashboard drawn with Pillow and saved to file.')
+        else:
+            if self.inliner is not None:
+                start = time.perf_counter()
+                with span('inline') as record:
+                    inlined = self.inliner.inline(html, self.currPath)
+                    record['bytes'] = len(inlined)
+                with open(self.htmlPath, "w") as htmlFile:
+                    htmlFile.write(inlined)
+                self.timings['inline'] = time.perf_counter() - start
+            # Take the screenshot
+            start = time.perf_counter()
+            self.get_screenshot(self.imagePath)
+            self.timings['capture'] = time.perf_counter() - start
+        start = time.perf_counter()
+        with span('publish'):
+            self.publish(self.imagePath, path_to_server_image)
+        self.timings['publish'] = time.perf_counter() - start
+        if self.outputTargets:
+            from render.targets import publish_targets
+            start = time.perf_counter()
+            with span('outputs'):
+                publish_targets(self.imagePath, self.outputTargets)
+            self.timings['outputs'] = time.perf_counter() - start
+            self.logger.info(f"Published {len(self.outputTargets)} extra outputs in "
+                             f"{1000 * self.timings['outputs']:.1f} ms.")
+        if cacheKey is not None:
+            self.renderCache.store(cacheKey, self.published_files(path_to_server_image, withTiles=True))
+        return True
@@ -0,0 +1,90 @@
+"""
+Extra output panels served from the same dashboard, configured with the outputs option. Instead of a full update per
+display, every panel is scaled from the main capture with Pillow's C resampler, mapped through its own tone curve and
+reduced to its own gray levels:
+
+    "outputs": [{"path": "/var/www/html/inkplate6.png", "width": 800, "height": 600, "grayLevels": 8,
+                 "dither": "ordered", "gamma": 1.2}]
+
+The layout is designed for imageWidth by imageHeight, so it is never rendered at another size. A panel with another
+aspect ratio gets the whole dashboard scaled to fit and centered on white (letterboxed) rather than a crop of it.
+"""
+
+from PIL import Image
+import numpy as np
+import os
+from render.postprocess import quantize, save_atomic, save_levels
+from tracing import span
+
+# Panels with an aspect ratio closer than this are stretched to fill, by at most half a percent
+ASPECT_TOLERANCE = 0.005
+
+
+class OutputTarget:
+
+    def __init__(self, path, width, height, grayLevels=8, dither='none', gamma=1.0, framebuffer=False,
+                 framebufferRLE=True):
+        self.path = path
+        self.width = width
+        self.height = height
+        self.grayLevels = grayLevels  # 0 keeps the full-color capture
+        self.dither = dither
+        # Tone curve of the panel, above 1 darkens the midtones for panels that show grays too light
+        self.gamma = gamma
+        self.framebuffer = framebuffer and 2 <= grayLevels <= 16
+        self.framebufferRLE = framebufferRLE
+
+    def tone_curve(self):
+        # 256-entry lookup table applied to the gray image before quantizing, None when it would change nothing
+        if self.gamma == 1.0:
+            return None
+        return np.rint(255 * (np.arange(256) / 255) ** self.gamma).astype(np.uint8).tolist()
+
+
+def fit_to_panel(image, width, height, fill):
+    # Scale the image to the panel. Within ASPECT_TOLERANCE it is stretched to fill it, otherwise it keeps its aspect
+    # ratio and the rest of the panel is filled.
+    if image.size == (width, height):
+        return image
+    sourceAspect = image.width / image.height
+    if abs(width / height - sourceAspect) <= ASPECT_TOLERANCE * sourceAspect:
+        size = (width, height)
+    elif width / height > sourceAspect:
+        size = (max(1, round(height * sourceAspect)), height)
+    else:
+        size = (width, max(1, round(width / sourceAspect)))
+    # reducing_gap first averages whole blocks of pixels, then filters the remaining small factor
+    scaled = image.resize(size, Image.Resampling.LANCZOS, reducing_gap=2.0)
+    if size == (width, height):
+        return scaled
+    panel = Image.new(image.mode, (width, height), fill)
+    panel.paste(scaled, ((width - size[0]) // 2, (height - size[1]) // 2))
+    return panel
+
+
+def publish_targets(sourcePath, targets):
+    # Write every target from one capture. The capture is decoded and converted to gray once for all of them.
+    from render.framebuffer import write_framebuffer
+    with Image.open(sourcePath) as source:
+        source.load()
+    gray = None
+    for target in targets:
+        with span('encode', format='png', output=os.path.basename(target.path)) as record:
+            if not target.grayLevels:
+                image = fit_to_panel(source.convert('RGB'), target.width, target.height, (255, 255, 255))
+                save_atomic(image, target.path)
+                indices = None
+            else:
+                if gray is None:
+                    gray = source.convert('L')
+                image = fit_to_panel(gray, target.width, target.height, 255)
+                curve = target.tone_curve()
+                if curve is not None:
+                    image = image.point(curve)
+                indices = quantize(image, target.grayLevels, target.dither)
+                save_levels(indices, target.path, target.grayLevels)
+            record['bytes'] = os.path.getsize(target.path)
+        if target.framebuffer:
+            with span('encode', format='framebuffer', output=os.path.basename(target.path)) as record:
+                record['bytes'] = write_framebuffer(indices, os.path.splitext(target.path)[0] + '.fb',
+                                                    target.grayLevels, target.framebufferRLE)
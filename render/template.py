@@ -0,0 +1,123 @@
+"""
+Turns the days built by RenderHelper.build_days into the dashboard HTML. The template is parsed once into its literal
+parts and fields, and the empty-state illustrations are sanitized once, both kept until the file on disk changes, so
+a daemon only pays for the events themselves on each update. Event text is HTML-escaped.
+"""
+
+import html
+import os
+import re
+import string
+import threading
+
+SVG_WIDTH = re.compile(r'(<svg[^>]*)\s+width="[^"]*"')
+SVG_HEIGHT = re.compile(r'(<svg[^>]*)\s+height="[^"]*"')
+
+
+class FileCache:
+    # Keeps the result of load(path) until the file's modification time or size changes
+
+    def __init__(self, load):
+        self.load = load
+        self.entries = {}  # path -> (mtime_ns, size, value)
+        self.lock = threading.Lock()
+
+    def get(self, path):
+        stat = os.stat(path)
+        with self.lock:
+            cached = self.entries.get(path)
+            if cached and cached[0] == stat.st_mtime_ns and cached[1] == stat.st_size:
+                return cached[2]
+        value = self.load(path)
+        with self.lock:
+            self.entries[path] = (stat.st_mtime_ns, stat.st_size, value)
+        return value
+
+
+def parse_template(path):
+    # Split a str.format template into (literal, field) pairs once, instead of parsing it on every render
+    with open(path, 'r') as f:
+        source = f.read()
+    parts = []
+    for literal, field, spec, conversion in string.Formatter().parse(source):
+        if spec or conversion:
+            raise ValueError(f"{path}: format specs and conversions are not supported in field '{field}'")
+        parts.append((literal, field))
+    return parts
+
+
+def sanitize_svg(path):
+    # Remove hardcoded width/height from the <svg> tag so CSS can control the size
+    with open(path, 'r') as f:
+        svg = f.read()
+    return SVG_HEIGHT.sub(r'\1', SVG_WIDTH.sub(r'\1', svg))
+
+
+def list_svgs(directory):
+    return sorted(f for f in os.listdir(directory) if f.endswith('.svg'))
+
+
+class DashboardTemplate:
+
+    def __init__(self, templatePath):
+        self.templatePath = templatePath
+        self.templates = FileCache(parse_template)
+        self.svgs = FileCache(sanitize_svg)
+        self.svgLists = FileCache(list_svgs)  # keyed on the directory, whose mtime changes when files are added
+
+    def empty_state_files(self, directory):
+        return self.svgLists.get(directory)
+
+    def events_html(self, day):
+        parts = []
+        if day['empty']:
+            svg = self.svgs.get(day['emptySvg']) if day['emptySvg'] else ''
+            parts += ['<li class="nothing-today"><div class="event-title">Nothing to do!</div></li>',
+                      '<li class="empty-state-svg">', svg, '</li>']
+            return ''.join(parts)
+
+        if day['allday']:
+            parts.append('<li class="event allday"><div class="event-time">All day</div>')
+            for summary in day['allday']:
+                parts += ['<div class="event-title">• ', html.escape(summary), '</div>']
+            parts.append('</li>\n')
+
+        for time_str, summary in day['timed']:
+            parts += ['<li class="event"><div class="event-time">', html.escape(time_str),
+                      '</div><div class="event-title">', html.escape(summary), '</div></li>\n']
+        return ''.join(parts)
+
+    def fit_style(self, day):
+        # Sizes fitted by RenderHelper.build_days, passed to the stylesheet as CSS variables
+        if day.get('titleSize') is None:
+            return ''
+        return f' style="--title-size: {day["titleSize"]}px; --time-size: {day["timeSize"]}px"'
+
+    def render(self, days, staleText=''):
+        params = {
+            "day": days[0]['day'],
+            "month": days[0]['month'],
+            "weekday": days[0]['weekday'],
+            "today_empty": 'empty' if days[0]['empty'] else '',
+            "today_fit": self.fit_style(days[0]),
+            "events_today": self.events_html(days[0]),
+            "tomorrow": days[1]['weekday'],
+            "tomorrow_day": days[1]['day'],
+            "tomorrow_month": days[1]['month'],
+            "tomorrow_empty": 'empty' if days[1]['empty'] else '',
+            "tomorrow_fit": self.fit_style(days[1]),
+            "events_tomorrow": self.events_html(days[1]),
+            "dayafter": days[2]['weekday'],
+            "dayafter_day": days[2]['day'],
+            "dayafter_month": days[2]['month'],
+            "dayafter_empty": 'empty' if days[2]['empty'] else '',
+            "dayafter_fit": self.fit_style(days[2]),
+            "events_dayafter": self.events_html(days[2]),
+            "stale_marker": f'<div class="stale-marker">{html.escape(staleText)}</div>' if staleText else '',
+        }
+        parts = []
+        for literal, field in self.templates.get(self.templatePath):
+            parts.append(literal)
+            if field is not None:
+                parts.append(params[field])
+        return ''.join(parts)
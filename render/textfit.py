@@ -0,0 +1,205 @@
+"""
+Lays out the event list of a column and picks the title size that makes it fit, before any HTML is written. The
+geometry mirrors css/dashboard.css, and text is measured with the advance widths of the bundled Lexend and Noto Emoji
+fonts, read once per font and scaled to any size, so trying a size costs a few dictionary lookups per word.
+
+The size is found with a binary search over the same candidates the template script steps through one pixel at a
+time (the default title size down to MIN_FONT_SIZE). RenderHelper passes it to the template as the --title-size and
+--time-size CSS variables, so the browser lays the page out once, and PillowRenderer draws with the same layout.
+"""
+
+from functools import lru_cache
+import os
+
+try:
+    from fontTools.ttLib import TTFont
+except ImportError:
+    TTFont = None
+
+FONT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'font')
+FONT_FILES = {
+    'Lexend-Regular': 'Lexend-Regular.ttf',
+    'Lexend-Light': 'Lexend-Light.ttf',
+    'Noto Emoji': 'NotoEmoji-VariableFont_wght.ttf',
+}
+EMOJI_FONT = 'Noto Emoji'
+
+# Inherited from bootstrap.min.css (body line-height)
+LINE_HEIGHT = 1.42857143
+
+# css/dashboard.css
+SCREEN_PADDING = 10
+GRID_BORDER = 2
+GRID_HEIGHT = 805
+COL_BORDER = 2
+HEADER_PADDING = (16, 20, 12)  # top, left/right, bottom
+HEADER_BORDER = 2
+EVENTS_PADDING = 12
+EVENTS_MAX_HEIGHT = 805 - 170
+EVENT_MARGIN = (8, 12)  # vertical, horizontal
+EVENT_PADDING = (9, 18)
+EVENT_BORDER = 3
+ALLDAY_PADDING = (8, 14)
+ALLDAY_BORDER = 2
+TIME_MARGIN_BOTTOM = 3
+TITLE_LINE_HEIGHT = 1.3
+TITLE_SIZE = 23
+TIME_SIZE = 16
+ALLDAY_TITLE_SIZE = 22
+ALLDAY_TIME_SIZE = 15
+
+# Same limits as the shrink loop in dashboard_template.html
+MIN_FONT_SIZE = 12
+TIME_SIZE_OFFSET = 4
+
+COLUMN_WIDTH = (1200 - 2 * SCREEN_PADDING - 2 * GRID_BORDER) / 3
+# Height of the day header: weekday, date and month lines, padding and bottom border
+HEADER_HEIGHT = (HEADER_PADDING[0] + 22 * LINE_HEIGHT + 2 + 96 + 3 + 19 * LINE_HEIGHT + HEADER_PADDING[2]
+                 + HEADER_BORDER)
+EVENTS_AVAILABLE = min(GRID_HEIGHT - HEADER_HEIGHT, EVENTS_MAX_HEIGHT)
+
+
+@lru_cache(maxsize=None)
+def font_codepoints(family):
+    # The characters a font has glyphs for, or None if fontTools isn't available to tell
+    if TTFont is None:
+        return None
+    return frozenset(TTFont(os.path.join(FONT_DIR, FONT_FILES[family]), lazy=True).getBestCmap())
+
+
+@lru_cache(maxsize=None)
+def font_advances(family):
+    # Advance width of every character as a fraction of the font size. Without fontTools, Pillow measures the
+    # characters one by one at a large size as they are needed.
+    path = os.path.join(FONT_DIR, FONT_FILES[family])
+    if TTFont is None:
+        from PIL import ImageFont
+        font = ImageFont.truetype(path, 1000)
+        return None, lambda char: font.getlength(char) / 1000
+    font = TTFont(path, lazy=True)
+    unitsPerEm = font['head'].unitsPerEm
+    metrics = font['hmtx'].metrics
+    return {codepoint: metrics[glyph][0] / unitsPerEm for codepoint, glyph in font.getBestCmap().items()}, None
+
+
+@lru_cache(maxsize=4096)
+def char_advance(family, char):
+    advances, measure = font_advances(family)
+    if advances is None:
+        return measure(char)
+    return advances.get(ord(char), advances.get(ord(' '), 0.25) if char.isspace() else 0)
+
+
+@lru_cache(maxsize=4096)
+def font_for_char(family, char):
+    # Fall back to Noto Emoji for characters Lexend doesn't have, like the browser does with the font-family list
+    codepoints = font_codepoints(family)
+    if codepoints is None:
+        # Without fontTools, assume Lexend covers everything below the symbol and emoji blocks
+        return family if ord(char) < 0x2100 else EMOJI_FONT
+    return family if ord(char) in codepoints or char.isspace() else EMOJI_FONT
+
+
+def split_runs(family, text):
+    # Split text into (family, substring) runs that can each be drawn with a single font
+    runs = []
+    for char in text:
+        charFamily = font_for_char(family, char)
+        if runs and runs[-1][0] == charFamily:
+            runs[-1][1] += char
+        else:
+            runs.append([charFamily, char])
+    return runs
+
+
+@lru_cache(maxsize=16384)
+def em_width(family, text):
+    # Width of the text at a font size of 1, cached per word and line
+    return sum(char_advance(font_for_char(family, char), char) for char in text)
+
+
+def text_width(family, size, text, letterSpacing=0.0):
+    return size * em_width(family, text) + letterSpacing * len(text)
+
+
+def wrap_text(family, size, text, maxWidth):
+    # Greedy word wrap, like the browser's default white-space: normal
+    lines = []
+    current = ''
+    for word in text.split():
+        candidate = word if not current else current + ' ' + word
+        if current and text_width(family, size, candidate) > maxWidth:
+            lines.append(current)
+            current = word
+        else:
+            current = candidate
+    if current or not lines:
+        lines.append(current)
+    return lines
+
+
+def layout_events(day, colWidth, titleSize=None, timeSize=None):
+    # Returns the height of the event list content and a list of drawing operations relative to its top. Without
+    # sizes, the stylesheet's defaults are used.
+    ops = []
+    y = 0
+    innerWidth = colWidth - COL_BORDER - 2 * EVENT_MARGIN[1]
+
+    if day['allday']:
+        size = titleSize or ALLDAY_TITLE_SIZE
+        tSize = timeSize or ALLDAY_TIME_SIZE
+        y += EVENT_MARGIN[0]
+        top = y
+        y += ALLDAY_BORDER + ALLDAY_PADDING[0]
+        textX = EVENT_MARGIN[1] + ALLDAY_BORDER + ALLDAY_PADDING[1]
+        ops.append(('text', textX, y, 'ALL DAY', 'Lexend-Light', tSize, tSize * LINE_HEIGHT, 0.08 * tSize))
+        y += tSize * LINE_HEIGHT + TIME_MARGIN_BOTTOM
+        textWidth = innerWidth - 2 * ALLDAY_BORDER - 2 * ALLDAY_PADDING[1]
+        for summary in day['allday']:
+            for line in wrap_text('Lexend-Regular', size, '• ' + summary, textWidth):
+                ops.append(('text', textX, y, line, 'Lexend-Regular', size, size * TITLE_LINE_HEIGHT, 0))
+                y += size * TITLE_LINE_HEIGHT
+        y += ALLDAY_PADDING[0] + ALLDAY_BORDER
+        ops.append(('dashed', EVENT_MARGIN[1], top, EVENT_MARGIN[1] + innerWidth, y))
+        y += EVENT_MARGIN[0]
+
+    for time_str, summary in day['timed']:
+        size = titleSize or TITLE_SIZE
+        tSize = timeSize or TIME_SIZE
+        # Vertical margins between list items collapse into one
+        y += EVENT_MARGIN[0] if y == 0 else 0
+        top = y
+        y += EVENT_PADDING[0]
+        textX = EVENT_MARGIN[1] + EVENT_BORDER + EVENT_PADDING[1]
+        ops.append(('text', textX, y, time_str.upper(), 'Lexend-Light', tSize, tSize * LINE_HEIGHT, 0.08 * tSize))
+        y += tSize * LINE_HEIGHT + TIME_MARGIN_BOTTOM
+        textWidth = innerWidth - EVENT_BORDER - 2 * EVENT_PADDING[1]
+        for line in wrap_text('Lexend-Regular', size, summary, textWidth):
+            ops.append(('text', textX, y, line, 'Lexend-Regular', size, size * TITLE_LINE_HEIGHT, 0))
+            y += size * TITLE_LINE_HEIGHT
+        y += EVENT_PADDING[0]
+        ops.append(('bar', EVENT_MARGIN[1], top, EVENT_MARGIN[1] + EVENT_BORDER, y))
+        y += EVENT_MARGIN[0]
+
+    return y, ops
+
+
+def fit_sizes(day, colWidth=COLUMN_WIDTH, available=EVENTS_AVAILABLE):
+    # Title and time size for the day's events to fit the column, or (None, None) if they fit at the default sizes.
+    # Like the template script, every title gets the same size once shrinking starts, and the smallest size is used
+    # when even that overflows.
+    def fits(titleSize):
+        timeSize = max(titleSize - TIME_SIZE_OFFSET, MIN_FONT_SIZE) if titleSize else None
+        return layout_events(day, colWidth, titleSize, timeSize)[0] + 2 * EVENTS_PADDING <= available
+
+    if day['empty'] or fits(None):
+        return None, None
+    # The script starts from the size of the first title, the all-day one if there is one
+    low, high = MIN_FONT_SIZE, (ALLDAY_TITLE_SIZE if day['allday'] else TITLE_SIZE) - 1
+    while low < high:
+        size = (low + high + 1) // 2
+        if fits(size):
+            low = size
+        else:
+            high = size - 1
+    return low, max(low - TIME_SIZE_OFFSET, MIN_FONT_SIZE)
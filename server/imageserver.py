@@ -0,0 +1,130 @@
+"""
+A small built-in web server for the generated dashboard, as an alternative to Apache. It only serves the files
+published next to path_to_server_image (the image, framebuffer, diff manifest and tiles), with a strong ETag based on
+the file content and a Last-Modified date. A display that sends back the ETag it got last time with If-None-Match
+gets a 304 Not Modified when nothing changed, so it can skip both the download and the e-ink refresh.
+"""
+
+from email.utils import formatdate, parsedate_to_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import hashlib
+import logging
+import os
+import threading
+
+
+class ImageServer:
+
+    def __init__(self, path_to_server_image, host='0.0.0.0', port=8080, frameStore=None):
+        self.logger = logging.getLogger('maginkdash')
+        self.directory = os.path.dirname(os.path.abspath(path_to_server_image))
+        # Only files belonging to the dashboard are served, e.g. maginkdash.png, maginkdash.fb, maginkdash.12.0.fb
+        self.prefix = os.path.splitext(os.path.basename(path_to_server_image))[0] + '.'
+        self.host = host
+        self.port = port
+        self.etags = {}  # path -> (mtime_ns, size, etag)
+        self.lock = threading.Lock()
+        self.httpd = None
+        # With pre-rendered frames, the frame that has become due is published before answering a request
+        self.frameStore = frameStore
+
+    def etag(self, path, stat, body):
+        # Hashing is only redone when the file was replaced
+        with self.lock:
+            cached = self.etags.get(path)
+            if cached and cached[0] == stat.st_mtime_ns and cached[1] == stat.st_size:
+                return cached[2]
+        etag = '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+        with self.lock:
+            self.etags[path] = (stat.st_mtime_ns, stat.st_size, etag)
+        return etag
+
+    def resolve(self, urlPath):
+        name = urlPath.split('?', 1)[0].lstrip('/')
+        if '/' in name or '\\' in name or not name.startswith(self.prefix) or name.endswith('.tmp'):
+            return None
+        path = os.path.join(self.directory, name)
+        return path if os.path.isfile(path) else None
+
+    def make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            CONTENT_TYPES = {'.png': 'image/png', '.json': 'application/json', '.fb': 'application/octet-stream'}
+
+            def do_HEAD(self):
+                self.respond(send_body=False)
+
+            def do_GET(self):
+                self.respond(send_body=True)
+
+            def respond(self, send_body):
+                if server.frameStore is not None:
+                    try:
+                        server.frameStore.publish_due()
+                    except OSError as e:
+                        server.logger.error(f"Could not publish the next frame: {str(e)}")
+                path = server.resolve(self.path)
+                if path is None:
+                    self.send_error(404)
+                    return
+                try:
+                    # Read once so the ETag, the headers and the body all describe the same version of the file,
+                    # even if it is replaced while we answer
+                    with open(path, 'rb') as f:
+                        stat = os.fstat(f.fileno())
+                        body = f.read()
+                    etag = server.etag(path, stat, body)
+                except OSError:
+                    self.send_error(404)
+                    return
+
+                if self.not_modified(etag, stat.st_mtime):
+                    self.send_response(304)
+                    self.send_header('ETag', etag)
+                    self.send_header('Cache-Control', 'no-cache')
+                    self.end_headers()
+                    return
+
+                self.send_response(200)
+                self.send_header('Content-Type',
+                                 self.CONTENT_TYPES.get(os.path.splitext(path)[1], 'application/octet-stream'))
+                self.send_header('Content-Length', str(len(body)))
+                self.send_header('ETag', etag)
+                self.send_header('Last-Modified', formatdate(stat.st_mtime, usegmt=True))
+                self.send_header('Cache-Control', 'no-cache')
+                self.end_headers()
+                if send_body:
+                    self.wfile.write(body)
+
+            def not_modified(self, etag, mtime):
+                ifNoneMatch = self.headers.get('If-None-Match')
+                if ifNoneMatch is not None:
+                    # If-None-Match takes precedence over If-Modified-Since
+                    tags = [tag.strip() for tag in ifNoneMatch.split(',')]
+                    return '*' in tags or etag in tags or ('W/' + etag) in tags
+                ifModifiedSince = self.headers.get('If-Modified-Since')
+                if ifModifiedSince:
+                    try:
+                        return int(mtime) <= parsedate_to_datetime(ifModifiedSince).timestamp()
+                    except (TypeError, ValueError):
+                        return False
+                return False
+
+            def log_message(self, format, *args):
+                server.logger.debug('%s - %s' % (self.address_string(), format % args))
+
+        return Handler
+
+    def start(self):
+        # Serve from a background thread, so the dashboard can keep updating in the same process
+        self.httpd = ThreadingHTTPServer((self.host, self.port), self.make_handler())
+        thread = threading.Thread(target=self.httpd.serve_forever, name='image-server', daemon=True)
+        thread.start()
+        self.logger.info(f"Serving {self.prefix}* from {self.directory} on http://{self.host}:{self.port}/")
+
+    def stop(self):
+        if self.httpd is not None:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+            self.httpd = None
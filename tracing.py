@@ -0,0 +1,138 @@
+"""
+Per-stage spans of a dashboard update: auth, fetch (one per calendar), filter, parse, bucket, template, inline,
+browser_start, page_load, capture, encode and publish, inside an update span covering the whole run. Each span records
+when it started, how long it took and, where it applies, the bytes it produced or received and the number of items it
+handled:
+
+    with span('fetch', calendar=cal) as record:
+        items = ...
+        record['count'] = len(items)
+
+The spans of a run are written by export(), if configured, as JSON lines appended to spansLog, and as a Prometheus
+textfile (for node_exporter's textfile collector) with the totals per stage of the last run:
+
+    {"span": "fetch", "start": 1710489600.12, "duration": 0.231, "bytes": 48211, "count": 37, "calendar": "..."}
+
+    maginkdash_stage_duration_seconds{dashboard="maginkdash",stage="fetch"} 0.694
+"""
+
+from contextlib import contextmanager
+import json
+import logging
+import os
+import threading
+import time
+
+# Prometheus metrics written for every stage: (name, span field, help)
+STAGE_METRICS = [
+    ('maginkdash_stage_duration_seconds', 'duration', 'Seconds spent in the stage during the last update.'),
+    ('maginkdash_stage_bytes', 'bytes', 'Bytes produced or received by the stage during the last update.'),
+    ('maginkdash_stage_items', 'count', 'Items handled by the stage during the last update.'),
+    ('maginkdash_stage_spans', None, 'Number of times the stage ran during the last update.'),
+    ('maginkdash_stage_errors', 'error', 'Number of times the stage failed during the last update.'),
+]
+
+
+def prometheus_labels(labels):
+    escaped = [(key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+               for key, value in sorted(labels.items())]
+    return '{' + ','.join(f'{key}="{value}"' for key, value in escaped) + '}'
+
+
+class Tracer:
+
+    def __init__(self):
+        self.logger = logging.getLogger('maginkdash')
+        self.spans = []  # finished spans not exported yet
+        self.lock = threading.Lock()
+        self.spansLog = None
+        self.prometheusTextfile = None
+        self.dashboard = 'maginkdash'
+
+    def configure(self, spansLog=None, prometheusTextfile=None, dashboard=None):
+        self.spansLog = spansLog
+        self.prometheusTextfile = prometheusTextfile
+        self.dashboard = dashboard or 'maginkdash'
+
+    @contextmanager
+    def span(self, name, **fields):
+        # The caller can set 'bytes', 'count' or any other field of the yielded record
+        record = dict({'span': name, 'start': time.time(), 'duration': None, 'bytes': None, 'count': None}, **fields)
+        start = time.perf_counter()
+        try:
+            yield record
+        except BaseException:
+            record['error'] = True
+            raise
+        finally:
+            record['duration'] = round(time.perf_counter() - start, 6)
+            with self.lock:
+                self.spans.append(record)
+
+    def collect(self):
+        # Take the finished spans, e.g. to send them from a worker process to the one exporting them
+        with self.lock:
+            spans, self.spans = self.spans, []
+        return spans
+
+    def extend(self, spans):
+        with self.lock:
+            self.spans += spans
+
+    def export(self):
+        # Write out the spans of the run that just finished. Without a destination they are dropped, so a daemon
+        # doesn't keep them forever.
+        spans = self.collect()
+        if not spans:
+            return
+        try:
+            if self.spansLog:
+                self.write_jsonl(spans)
+            if self.prometheusTextfile:
+                self.write_prometheus(spans)
+        except OSError as e:
+            self.logger.error(f"Could not export spans: {str(e)}")
+
+    def write_jsonl(self, spans):
+        directory = os.path.dirname(os.path.abspath(self.spansLog))
+        os.makedirs(directory, exist_ok=True)
+        with open(self.spansLog, 'a') as f:
+            for record in spans:
+                f.write(json.dumps(dict({'dashboard': self.dashboard}, **record), default=str) + '\n')
+
+    def write_prometheus(self, spans):
+        # Totals per dashboard and stage. The file is replaced in one step, as the collector may read it any time.
+        totals = {}  # (dashboard, stage) -> {field: total}
+        for record in spans:
+            key = (record.get('dashboard', self.dashboard), record['span'])
+            total = totals.setdefault(key, {'duration': 0.0, 'bytes': None, 'count': None, 'error': 0, None: 0})
+            total['duration'] += record['duration']
+            total['error'] += 1 if record.get('error') else 0
+            total[None] += 1
+            for field in ('bytes', 'count'):
+                if record.get(field) is not None:
+                    total[field] = (total[field] or 0) + record[field]
+
+        lines = []
+        for metric, field, description in STAGE_METRICS:
+            lines += [f'# HELP {metric} {description}', f'# TYPE {metric} gauge']
+            for (dashboard, stage), total in sorted(totals.items()):
+                if total[field] is not None:
+                    lines.append(f'{metric}{prometheus_labels({"dashboard": dashboard, "stage": stage})} '
+                                 f'{round(total[field], 6)}')
+        lines += ['# HELP maginkdash_last_update_timestamp_seconds When the last update finished.',
+                  '# TYPE maginkdash_last_update_timestamp_seconds gauge',
+                  f'maginkdash_last_update_timestamp_seconds{prometheus_labels({"dashboard": self.dashboard})} '
+                  f'{time.time():.3f}']
+
+        directory = os.path.dirname(os.path.abspath(self.prometheusTextfile))
+        os.makedirs(directory, exist_ok=True)
+        tmpFile = self.prometheusTextfile + '.tmp'
+        with open(tmpFile, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(tmpFile, self.prometheusTextfile)
+
+
+# One tracer per process
+tracer = Tracer()
+span = tracer.span